@@ -42,6 +42,17 @@ def create_app():
     # Upload configuration
     app.config["UPLOAD_FOLDER"] = "uploads"
     app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB max file size
+    app.config["BACKUP_MAX_CONTENT_LENGTH"] = int(os.environ.get("BACKUP_MAX_CONTENT_LENGTH", str(20 * 1024 ** 3)))  # Backup uploads for restore
+    
+    # Report cache configuration (set REPORT_CACHE_URL to share it through Redis)
+    app.config["REPORT_CACHE_SIZE"] = int(os.environ.get("REPORT_CACHE_SIZE", "256"))
+    app.config["REPORT_CACHE_URL"] = os.environ.get("REPORT_CACHE_URL")
+    
+    # Bilingual PDFs (PDF_ARABIC=0 for English only) and the TrueType fonts
+    # for their Arabic text (paths relative to the app root)
+    app.config["PDF_ARABIC"] = os.environ.get("PDF_ARABIC", "1") == "1"
+    app.config["PDF_ARABIC_FONT"] = os.environ.get("PDF_ARABIC_FONT", "static/fonts/DejaVuSans.ttf")
+    app.config["PDF_ARABIC_FONT_BOLD"] = os.environ.get("PDF_ARABIC_FONT_BOLD", "static/fonts/DejaVuSans-Bold.ttf")
     
     # Proxy fix for production
     app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
@@ -67,6 +78,7 @@ def create_app():
     from blueprints.dashboard import dashboard_bp
     from blueprints.clients import clients_bp
     from blueprints.invoices import invoices_bp
+    from blueprints.purchases import purchases_bp
     from blueprints.vat_zakat import vat_zakat_bp
     from blueprints.tasks import tasks_bp
     from blueprints.reports import reports_bp
@@ -76,11 +88,33 @@ def create_app():
     app.register_blueprint(dashboard_bp, url_prefix="/")
     app.register_blueprint(clients_bp, url_prefix="/clients")
     app.register_blueprint(invoices_bp, url_prefix="/invoices")
+    app.register_blueprint(purchases_bp, url_prefix="/purchases")
     app.register_blueprint(vat_zakat_bp, url_prefix="/vat-zakat")
     app.register_blueprint(tasks_bp, url_prefix="/tasks")
     app.register_blueprint(reports_bp, url_prefix="/reports")
     app.register_blueprint(settings_bp, url_prefix="/settings")
     
+    from pdf_engine import check_arabic_support
+    check_arabic_support(app)
+    
+    # Importing rollups registers the session hooks that maintain invoice rollups
+    from rollups import rebuild_rollups_command, rebuild_client_summaries_command
+    app.cli.add_command(rebuild_rollups_command)
+    app.cli.add_command(rebuild_client_summaries_command)
+    
+    from einvoice import issue_einvoices_command
+    app.cli.add_command(issue_einvoices_command)
+    
+    from client_deletion import purge_deleted_clients_command
+    app.cli.add_command(purge_deleted_clients_command)
+    
+    from archive import archive_year_command
+    app.cli.add_command(archive_year_command)
+    
+    from backup import backup_command, restore_backup_command
+    app.cli.add_command(backup_command)
+    app.cli.add_command(restore_backup_command)
+    
     # Create database tables
     with app.app_context():
         import models
@@ -103,7 +137,7 @@ def create_app():
             accountant_role.name = "Accountant" 
             accountant_role.description = "Accountant"
             db.session.add(accountant_role)
-            
+        
         client_role = Role.query.filter_by(name="Client").first()
         if not client_role:
             client_role = Role()
@@ -0,0 +1,163 @@
+"""
+Archive tier for closed years. Paid invoices (with their items,
+attachments, payments and e-invoices) and completed tasks of a closed year
+are moved to the *_archive tables, so the hot tables only hold the working
+set. Reports ask for invoice_source/payment_source/task_source with their
+period: inside the active years they get the model itself, otherwise an
+alias over the hot table and its archive, so results do not change.
+
+The daily rollups and client summaries keep covering archived invoices.
+"""
+from datetime import date, datetime
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import select, insert, delete, union_all
+from sqlalchemy.orm import aliased
+from app import db
+from models import (Invoice, InvoiceItem, InvoiceAttachment, Payment, EInvoice, Task, ArchivedYear,
+                    invoices_archive, invoice_items_archive, invoice_attachments_archive, payments_archive,
+                    einvoices_archive, tasks_archive)
+
+# Invoices or tasks moved per statement and transaction
+ARCHIVE_BATCH_SIZE = 1000
+
+# Hot model, its archive table and the column tying rows to the batch;
+# parents first, as rows are inserted in this order and deleted in reverse
+INVOICE_TABLES = [
+    (Invoice, invoices_archive, 'id'),
+    (InvoiceItem, invoice_items_archive, 'invoice_id'),
+    (InvoiceAttachment, invoice_attachments_archive, 'invoice_id'),
+    (Payment, payments_archive, 'invoice_id'),
+    (EInvoice, einvoices_archive, 'invoice_id')
+]
+TASK_TABLES = [(Task, tasks_archive, 'id')]
+
+def _touches_archive(start=None, end=None):
+    """Whether any archived year falls within start..end (open-ended when None)"""
+    years = select(ArchivedYear.year)
+    if start is not None:
+        years = years.where(ArchivedYear.year >= start.year)
+    if end is not None:
+        years = years.where(ArchivedYear.year <= end.year)
+    return db.session.query(years.exists()).scalar()
+
+def _with_archive(model, archive):
+    table = model.__table__
+    rows = union_all(
+        select(table),
+        select(*[archive.c[column.name] for column in table.columns])
+    ).subquery(f'{table.name}_all')
+    return aliased(model, rows)
+
+def invoice_source(start=None, end=None):
+    """Invoice, or an alias that includes archived invoices when start..end reaches an archived year"""
+    return _with_archive(Invoice, invoices_archive) if _touches_archive(start, end) else Invoice
+
+def payment_source(start=None, end=None):
+    # Payments are archived with their invoice, so a payment made after an
+    # archived year may be archived too: any archived year up to end counts
+    return _with_archive(Payment, payments_archive) if _touches_archive(None, end) else Payment
+
+def task_source(start=None, end=None):
+    """Task, or an alias that includes archived tasks when start..end reaches an archived year"""
+    return _with_archive(Task, tasks_archive) if _touches_archive(start, end) else Task
+
+def _year_range(year):
+    return date(year, 1, 1), date(year, 12, 31)
+
+def _move_rows(tables, ids, restore=False):
+    """Copy the rows of a batch between the hot and archive tables, then delete the originals"""
+    for model, archive, key in tables:
+        names = [column.name for column in model.__table__.columns]
+        if restore:
+            rows = select(*[archive.c[name] for name in names]).where(archive.c[key].in_(ids))
+            db.session.execute(insert(model).from_select(names, rows))
+        else:
+            rows = select(model.__table__).where(getattr(model, key).in_(ids))
+            db.session.execute(insert(archive).from_select(names, rows))
+    
+    for model, archive, key in reversed(tables):
+        if restore:
+            db.session.execute(delete(archive).where(archive.c[key].in_(ids)))
+        else:
+            db.session.execute(delete(model).where(getattr(model, key).in_(ids)),
+                               execution_options={'synchronize_session': False})
+
+def _move_in_batches(tables, ids_query, restore=False):
+    moved = 0
+    while True:
+        ids = db.session.scalars(ids_query.limit(ARCHIVE_BATCH_SIZE)).all()
+        if not ids:
+            return moved
+        _move_rows(tables, ids, restore)
+        db.session.commit()
+        moved += len(ids)
+
+def archive_year(year):
+    """
+    Move the paid invoices and completed tasks of a closed year to the
+    archive tables, a committed batch at a time. Running it again for the
+    same year moves whatever was settled since.
+    Returns (invoice_count, task_count).
+    """
+    if year >= date.today().year:
+        raise ValueError('Only closed years can be archived.')
+    first_day, last_day = _year_range(year)
+    
+    # Recorded first, so reports include the archive as soon as rows move
+    archived = db.session.get(ArchivedYear, year)
+    if archived is None:
+        archived = ArchivedYear(year=year)
+        db.session.add(archived)
+        db.session.commit()
+    
+    invoice_count = _move_in_batches(INVOICE_TABLES, select(Invoice.id).where(
+        Invoice.status == 'Paid',
+        Invoice.issue_date >= first_day,
+        Invoice.issue_date <= last_day
+    ).order_by(Invoice.id))
+    task_count = _move_in_batches(TASK_TABLES, select(Task.id).where(
+        Task.status == 'Completed',
+        Task.created_at >= datetime.combine(first_day, datetime.min.time()),
+        Task.created_at <= datetime.combine(last_day, datetime.max.time())
+    ).order_by(Task.id))
+    
+    archived = db.session.get(ArchivedYear, year)
+    archived.invoice_count += invoice_count
+    archived.task_count += task_count
+    archived.archived_at = datetime.utcnow()
+    db.session.commit()
+    return invoice_count, task_count
+
+def restore_year(year):
+    """Move an archived year back to the hot tables. Returns (invoice_count, task_count)."""
+    first_day, last_day = _year_range(year)
+    
+    invoice_count = _move_in_batches(INVOICE_TABLES, select(invoices_archive.c.id).where(
+        invoices_archive.c.issue_date >= first_day,
+        invoices_archive.c.issue_date <= last_day
+    ).order_by(invoices_archive.c.id), restore=True)
+    task_count = _move_in_batches(TASK_TABLES, select(tasks_archive.c.id).where(
+        tasks_archive.c.created_at >= datetime.combine(first_day, datetime.min.time()),
+        tasks_archive.c.created_at <= datetime.combine(last_day, datetime.max.time())
+    ).order_by(tasks_archive.c.id), restore=True)
+    
+    db.session.execute(delete(ArchivedYear).where(ArchivedYear.year == year))
+    db.session.commit()
+    return invoice_count, task_count
+
+@click.command('archive-year')
+@click.argument('year', type=int)
+@click.option('--restore', is_flag=True, help='Move the year back from the archive instead.')
+@with_appcontext
+def archive_year_command(year, restore):
+    """Move a closed year's paid invoices and completed tasks to the archive tables."""
+    if restore:
+        invoice_count, task_count = restore_year(year)
+        click.echo(f'Restored {invoice_count} invoices and {task_count} tasks from {year}.')
+        return
+    try:
+        invoice_count, task_count = archive_year(year)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Archived {invoice_count} invoices and {task_count} tasks from {year}.')
@@ -0,0 +1,25 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from app import db
+
+logger = logging.getLogger(__name__)
+
+# Shared worker pool for work that should not hold up a request
+executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='background')
+
+def _run_in_app_context(app, fn, args, kwargs):
+    with app.app_context():
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            logger.exception('Background job %s failed', fn.__name__)
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
+
+def submit(fn, *args, **kwargs):
+    """Run fn in the background worker pool inside an application context"""
+    app = current_app._get_current_object()
+    return executor.submit(_run_in_app_context, app, fn, args, kwargs)
@@ -0,0 +1,577 @@
+"""
+Streaming backup and restore of the whole database and uploaded files.
+
+A backup is a tar stream of independently gzip-compressed chunks, written
+straight to the response and read back one member at a time, so neither
+side holds more than one chunk in memory:
+
+    backup.json                  format, snapshot id, kind and table layout
+    keys/<table>/<n>.jsonl.gz    incremental only: every primary key, children first
+    tables/<table>/<n>.jsonl.gz  up to BACKUP_CHUNK_ROWS rows, one JSON array per line
+    files/<sha256>               uploaded file contents, each stored once
+    manifest.json                row counts and the path -> sha256 map of uploaded files
+
+Each member carries the SHA-256 of its data in a pax header, which is
+checked before the member is applied.
+
+An incremental backup holds the rows changed since the last backup for
+tables with a change timestamp (CHANGE_COLUMNS) and every row of the other
+tables. It also holds every primary key, so rows deleted since can be
+removed, and only the uploaded files that changed.
+"""
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, delete, exists, and_, or_, union_all, literal, text, MetaData, Table, Column
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from models import (BackupSnapshot, BackupFile, ClientDocument, InvoiceAttachment, Company,
+                    invoice_attachments_archive)
+from report_cache import TRACKED_MODELS, get_backend
+
+BACKUP_FORMAT = 1
+
+# Rows per compressed chunk; a chunk is the unit held in memory
+BACKUP_CHUNK_ROWS = 10000
+
+# Bytes read at a time when hashing and copying uploaded files
+FILE_BLOCK_SIZE = 1024 * 1024
+
+# Bookkeeping of the backups themselves and short-lived report results
+SKIPPED_TABLES = {'backup_snapshots', 'backup_files', 'report_jobs'}
+
+# Tables whose rows carry a timestamp bumped on every change
+CHANGE_COLUMNS = {
+    'companies': 'updated_at',
+    'clients': 'updated_at',
+    'invoices': 'updated_at',
+    'tasks': 'updated_at',
+    'einvoices': 'issued_at'  # Never modified once issued
+}
+
+# Where uploaded files live, relative to the app root
+UPLOAD_FOLDER = 'uploads'
+LOGO_FOLDER = 'static/uploads/logos'
+
+CHECKSUM_HEADER = 'BACKUP.sha256'
+
+def backup_tables():
+    """Tables included in backups, parents before children"""
+    return [table for table in db.metadata.sorted_tables if table.name not in SKIPPED_TABLES]
+
+def last_snapshot():
+    """
+    The last completed backup taken from this database, which an
+    incremental backup builds on. None once a restore has replaced the data.
+    """
+    snapshot = BackupSnapshot.query.filter(
+        BackupSnapshot.completed_at.isnot(None)
+    ).order_by(BackupSnapshot.completed_at.desc()).first()
+    restored = BackupSnapshot.query.filter(BackupSnapshot.restored_at.isnot(None)).order_by(
+        BackupSnapshot.restored_at.desc()
+    ).first()
+    if snapshot is None or (restored is not None and restored.restored_at > snapshot.completed_at):
+        return None
+    return snapshot
+
+def _last_restored():
+    return BackupSnapshot.query.filter(BackupSnapshot.restored_at.isnot(None)).order_by(
+        BackupSnapshot.restored_at.desc()
+    ).first()
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'Cannot back up {type(value).__name__} values')
+
+def _encode_chunk(rows):
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=6, mtime=0) as stream:
+        for row in rows:
+            stream.write(json.dumps(list(row), default=_json_default, separators=(',', ':')).encode('utf-8'))
+            stream.write(b'\n')
+    return buffer.getvalue()
+
+def _decode_chunk(data):
+    return [json.loads(line) for line in gzip.decompress(data).splitlines() if line]
+
+def _member_header(name, size, checksum):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(time.time())
+    info.mode = 0o644
+    info.pax_headers = {CHECKSUM_HEADER: checksum}
+    return info.tobuf(tarfile.PAX_FORMAT)
+
+def _padding(size):
+    return b'\0' * (-size % tarfile.BLOCKSIZE)
+
+def _data_member(name, data):
+    yield _member_header(name, len(data), hashlib.sha256(data).hexdigest())
+    yield data
+    yield _padding(len(data))
+
+def _file_member(path, digest, size):
+    yield _member_header(f'files/{digest}', size, digest)
+    remaining = size
+    with open(path, 'rb') as source:
+        while remaining:
+            block = source.read(min(FILE_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+    # A file that shrank while being read fails its checksum on restore
+    yield b'\0' * remaining
+    yield _padding(size)
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(FILE_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+@contextmanager
+def _snapshot_connection():
+    """A read-only connection that sees every table as of the same moment"""
+    connection = db.engine.connect()
+    try:
+        if connection.dialect.name == 'postgresql':
+            connection.execution_options(isolation_level='REPEATABLE READ', postgresql_readonly=True)
+        with connection.begin():
+            yield connection.execution_options(yield_per=BACKUP_CHUNK_ROWS)
+    finally:
+        connection.close()
+
+def _uploaded_files(connection):
+    """Paths, relative to the app root, of every uploaded file the data refers to"""
+    documents = ClientDocument.__table__
+    attachments = InvoiceAttachment.__table__
+    companies = Company.__table__
+    rows = union_all(
+        select(literal(UPLOAD_FOLDER), documents.c.filename),
+        select(literal(UPLOAD_FOLDER), attachments.c.filename),
+        select(literal(UPLOAD_FOLDER), invoice_attachments_archive.c.filename),
+        select(literal(LOGO_FOLDER), companies.c.logo_filename).where(companies.c.logo_filename.isnot(None))
+    )
+    seen = set()
+    for folder, filename in connection.execute(rows):
+        path = f'{folder}/{filename}'
+        if path not in seen:
+            seen.add(path)
+            yield path
+
+def start_backup(incremental=False):
+    """
+    Record a new backup and return its snapshot id. An incremental backup
+    builds on the last completed one; ValueError if there is none.
+    """
+    base = None
+    if incremental:
+        base = last_snapshot()
+        if base is None:
+            raise ValueError('Take a full backup before an incremental one.')
+    
+    snapshot = BackupSnapshot(
+        id=uuid.uuid4().hex,
+        kind='incremental' if incremental else 'full',
+        base_id=base.id if base else None,
+        since=base.started_at if base else None,
+        started_at=datetime.utcnow()
+    )
+    db.session.add(snapshot)
+    db.session.commit()
+    return snapshot.id
+
+def stream_backup(snapshot_id):
+    """Yield the backup started by start_backup as a stream of bytes"""
+    snapshot = db.session.get(BackupSnapshot, snapshot_id)
+    since = snapshot.since
+    root = current_app.root_path
+    tables = backup_tables()
+    changed_only = {table.name for table in tables if since is not None and table.name in CHANGE_COLUMNS}
+    known = {record.path: (record.size, record.mtime, record.sha256) for record in BackupFile.query}
+    
+    yield from _data_member('backup.json', json.dumps({
+        'format': BACKUP_FORMAT,
+        'id': snapshot.id,
+        'kind': snapshot.kind,
+        'base_id': snapshot.base_id,
+        'started_at': snapshot.started_at.isoformat(),
+        'tables': [
+            {
+                'name': table.name,
+                'columns': [column.name for column in table.columns],
+                'changed_only': table.name in changed_only
+            }
+            for table in tables
+        ]
+    }).encode('utf-8'))
+    
+    # Reading happens on the snapshot connection; end this transaction meanwhile
+    db.session.rollback()
+    
+    row_counts = {}
+    file_hashes = {}
+    records = []
+    sent = set()
+    
+    with _snapshot_connection() as connection:
+        if since is not None:
+            # Every key, children first, so restore can remove deleted rows up front
+            for table in reversed(tables):
+                keys = select(*table.primary_key.columns).order_by(*table.primary_key.columns)
+                for number, rows in enumerate(connection.execute(keys).partitions(), 1):
+                    yield from _data_member(f'keys/{table.name}/{number:06d}.jsonl.gz', _encode_chunk(rows))
+        
+        for table in tables:
+            rows = select(table).order_by(*table.primary_key.columns)
+            if table.name in changed_only:
+                column = table.c[CHANGE_COLUMNS[table.name]]
+                rows = rows.where(or_(column >= since, column.is_(None)))
+            row_counts[table.name] = 0
+            for number, chunk in enumerate(connection.execute(rows).partitions(), 1):
+                row_counts[table.name] += len(chunk)
+                yield from _data_member(f'tables/{table.name}/{number:06d}.jsonl.gz', _encode_chunk(chunk))
+        
+        for path in _uploaded_files(connection):
+            full_path = os.path.join(root, path)
+            try:
+                stat = os.stat(full_path)
+            except FileNotFoundError:
+                continue
+            
+            size, mtime, digest = known.get(path, (None, None, None))
+            unchanged = size == stat.st_size and mtime == stat.st_mtime
+            if not unchanged:
+                digest = _file_digest(full_path)
+            file_hashes[path] = digest
+            records.append({'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': digest})
+            
+            # Unchanged files are already in the backup this one builds on
+            if digest in sent or (since is not None and unchanged):
+                continue
+            sent.add(digest)
+            yield from _file_member(full_path, digest, stat.st_size)
+    
+    yield from _data_member('manifest.json', json.dumps({
+        'tables': row_counts,
+        'files': file_hashes
+    }).encode('utf-8'))
+    yield b'\0' * (2 * tarfile.BLOCKSIZE)
+    
+    snapshot = db.session.get(BackupSnapshot, snapshot_id)
+    snapshot.completed_at = datetime.utcnow()
+    snapshot.row_count = sum(row_counts.values())
+    snapshot.file_count = len(sent)
+    db.session.execute(delete(BackupFile))
+    if records:
+        db.session.execute(BackupFile.__table__.insert(), records)
+    db.session.commit()
+
+def _read_member(archive, member):
+    """Data of a tar member, checked against its checksum header"""
+    data = archive.extractfile(member).read()
+    if hashlib.sha256(data).hexdigest() != member.pax_headers.get(CHECKSUM_HEADER):
+        raise ValueError(f'Backup is damaged: {member.name} failed its checksum.')
+    return data
+
+def _stage_file(archive, member, staging):
+    """Write an uploaded file from the backup to the staging folder, checking its hash"""
+    digest = member.name.split('/', 1)[1]
+    if len(digest) != 64 or not all(c in '0123456789abcdef' for c in digest):
+        raise ValueError(f'Backup is damaged: unexpected member {member.name}.')
+    
+    source = archive.extractfile(member)
+    hasher = hashlib.sha256()
+    partial_path = os.path.join(staging, f'{digest}.part')
+    with open(partial_path, 'wb') as target:
+        for block in iter(lambda: source.read(FILE_BLOCK_SIZE), b''):
+            hasher.update(block)
+            target.write(block)
+    if hasher.hexdigest() != digest:
+        raise ValueError(f'Backup is damaged: {member.name} failed its checksum.')
+    os.replace(partial_path, os.path.join(staging, digest))
+
+def _decoder(column):
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return None
+    if python_type is datetime:
+        return datetime.fromisoformat
+    if python_type is date:
+        return date.fromisoformat
+    if python_type is Decimal:
+        return Decimal
+    return None
+
+def _decoded_rows(table, names, rows):
+    decoders = [_decoder(table.c[name]) for name in names]
+    return [
+        {
+            name: decode(value) if decode and value is not None else value
+            for name, decode, value in zip(names, decoders, row)
+        }
+        for row in rows
+    ]
+
+def _csv_value(value):
+    # COPY reads an unquoted empty field as NULL and a quoted one as ''
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return '"' + value.replace('"', '""') + '"'
+    return str(value)
+
+def _copy_rows(connection, table, names, rows):
+    """PostgreSQL COPY of a chunk into an empty table"""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(','.join(_csv_value(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    
+    preparer = connection.dialect.identifier_preparer
+    columns = ', '.join(preparer.quote(name) for name in names)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY {preparer.format_table(table)} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+    finally:
+        cursor.close()
+
+def _upsert_rows(connection, table, names, rows):
+    """Insert a chunk, replacing rows whose key already exists"""
+    dialect = {'postgresql': postgresql, 'sqlite': sqlite}.get(connection.dialect.name)
+    if dialect is None:
+        raise ValueError('Incremental restore needs PostgreSQL or SQLite.')
+    statement = dialect.insert(table)
+    keys = [column.name for column in table.primary_key.columns]
+    updates = {name: statement.excluded[name] for name in names if name not in keys}
+    if updates:
+        statement = statement.on_conflict_do_update(index_elements=keys, set_=updates)
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=keys)
+    connection.execute(statement, _decoded_rows(table, names, rows))
+
+class _KeySet:
+    """Primary keys of one table from an incremental backup, kept in a temporary table"""
+    
+    def __init__(self, connection, table):
+        self.connection = connection
+        self.table = table
+        self.keys = Table(
+            f'backup_keys_{table.name}', MetaData(),
+            *[Column(column.name, column.type) for column in table.primary_key.columns],
+            prefixes=['TEMPORARY']
+        )
+        self.keys.create(connection)
+    
+    def add(self, rows):
+        names = [column.name for column in self.keys.columns]
+        self.connection.execute(self.keys.insert(), _decoded_rows(self.keys, names, rows))
+    
+    def delete_missing(self):
+        """Delete the table's rows whose key is not in the backup"""
+        match = and_(*[self.keys.c[column.name] == column for column in self.table.primary_key.columns])
+        self.connection.execute(delete(self.table).where(~exists().where(match)))
+        self.keys.drop(self.connection)
+
+def _reset_sequences(connection, tables):
+    """Move PostgreSQL id sequences past the restored ids"""
+    if connection.dialect.name != 'postgresql':
+        return
+    preparer = connection.dialect.identifier_preparer
+    for table in tables:
+        columns = list(table.primary_key.columns)
+        if len(columns) != 1 or columns[0].type.python_type is not int:
+            continue
+        connection.execute(text(
+            'SELECT setval(pg_get_serial_sequence(:table, :column), '
+            f'COALESCE((SELECT MAX({preparer.quote(columns[0].name)}) FROM {preparer.format_table(table)}), 0) + 1, false) '
+            'WHERE pg_get_serial_sequence(:table, :column) IS NOT NULL'
+        ), {'table': table.name, 'column': columns[0].name})
+
+def _restore_path(root, path):
+    """Absolute target of an uploaded file path from a backup, refusing anything outside the upload folders"""
+    normalized = os.path.normpath(path)
+    if os.path.isabs(normalized) or normalized.startswith('..') or not any(
+        normalized.startswith(folder + os.sep) for folder in (UPLOAD_FOLDER, os.path.normpath(LOGO_FOLDER))
+    ):
+        raise ValueError(f'Backup is damaged: unexpected file path {path}.')
+    return os.path.join(root, normalized)
+
+def restore_backup(stream):
+    """
+    Load a backup from a binary stream in a single transaction. A full
+    backup replaces every table; on PostgreSQL secondary indexes are
+    dropped, rows loaded with COPY and the indexes rebuilt at the end.
+    An incremental backup must follow the last backup restored here; it
+    removes deleted rows and upserts the rest. Uploaded files are put in
+    place once the data is committed.
+    Returns (snapshot_id, row_count, file_count); ValueError if the backup
+    cannot be restored.
+    """
+    root = current_app.root_path
+    archive = tarfile.open(fileobj=stream, mode='r|')
+    members = iter(archive)
+    
+    member = next(members, None)
+    if member is None or member.name != 'backup.json':
+        raise ValueError('Not a backup file.')
+    header = json.loads(_read_member(archive, member))
+    if header.get('format') != BACKUP_FORMAT:
+        raise ValueError('This backup was made by an unsupported version.')
+    
+    full = header['kind'] == 'full'
+    if not full:
+        restored = _last_restored()
+        if restored is None or restored.id != header['base_id']:
+            raise ValueError('This incremental backup does not follow the last backup restored here.')
+    
+    tables = {table.name: table for table in backup_tables()}
+    layout = {}
+    for entry in header['tables']:
+        table = tables.get(entry['name'])
+        if table is None or [column.name for column in table.columns] != entry['columns']:
+            raise ValueError(f"Backup does not match this database: table {entry['name']} differs.")
+        layout[entry['name']] = entry['columns']
+    
+    connection = db.session.connection()
+    # DDL is only transactional on PostgreSQL, so indexes are dropped there alone
+    bulk = full and connection.dialect.name == 'postgresql'
+    ordered = [table for table in backup_tables() if table.name in layout]
+    staging = os.path.join(root, UPLOAD_FOLDER, '.restore')
+    os.makedirs(staging, exist_ok=True)
+    row_counts = Counter()
+    manifest = None
+    
+    try:
+        if bulk:
+            for table in ordered:
+                for index in table.indexes:
+                    index.drop(connection)
+        if full:
+            for table in reversed(ordered):
+                connection.execute(delete(table))
+        
+        key_set = None
+        for member in members:
+            kind, _, rest = member.name.partition('/')
+            name = rest.split('/', 1)[0]
+            
+            if key_set is not None and (kind != 'keys' or name != key_set.table.name):
+                key_set.delete_missing()
+                key_set = None
+            
+            if kind == 'keys' and not full and name in layout:
+                if key_set is None:
+                    key_set = _KeySet(connection, tables[name])
+                key_set.add(_decode_chunk(_read_member(archive, member)))
+            elif kind == 'tables' and name in layout:
+                rows = _decode_chunk(_read_member(archive, member))
+                if bulk:
+                    _copy_rows(connection, tables[name], layout[name], rows)
+                elif full:
+                    connection.execute(tables[name].insert(), _decoded_rows(tables[name], layout[name], rows))
+                else:
+                    _upsert_rows(connection, tables[name], layout[name], rows)
+                row_counts[name] += len(rows)
+            elif kind == 'files':
+                _stage_file(archive, member, staging)
+            elif member.name == 'manifest.json':
+                manifest = json.loads(_read_member(archive, member))
+            else:
+                raise ValueError(f'Backup is damaged: unexpected member {member.name}.')
+        
+        if manifest is None:
+            raise ValueError('Backup is incomplete: the manifest is missing.')
+        for name, count in manifest['tables'].items():
+            if row_counts[name] != count:
+                raise ValueError(f'Backup is incomplete: table {name} has {row_counts[name]} of {count} rows.')
+        
+        if bulk:
+            for table in ordered:
+                for index in table.indexes:
+                    index.create(connection)
+        _reset_sequences(connection, ordered)
+        
+        snapshot = db.session.get(BackupSnapshot, header['id'])
+        if snapshot is None:
+            snapshot = BackupSnapshot(id=header['id'], kind=header['kind'], base_id=header['base_id'])
+            db.session.add(snapshot)
+        snapshot.restored_at = datetime.utcnow()
+        snapshot.row_count = sum(row_counts.values())
+        # File hashes of this database's own backups no longer describe the files
+        db.session.execute(delete(BackupFile))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    
+    # The data is committed; move the files it refers to into place
+    uses = Counter(manifest['files'].values())
+    file_count = 0
+    for path, digest in manifest['files'].items():
+        target = _restore_path(root, path)
+        staged = os.path.join(staging, digest)
+        if not os.path.exists(staged):
+            # Unchanged since the backup this one builds on
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        uses[digest] -= 1
+        if uses[digest]:
+            shutil.copyfile(staged, target)
+        else:
+            os.replace(staged, target)
+        file_count += 1
+    shutil.rmtree(staging, ignore_errors=True)
+    
+    # Restored rows bypass the session, so cached reports are dropped here
+    get_backend().bump(list(TRACKED_MODELS.values()))
+    
+    return header['id'], sum(row_counts.values()), file_count
+
+@click.command('backup')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.option('--incremental', is_flag=True, help='Only what changed since the last backup.')
+@with_appcontext
+def backup_command(output, incremental):
+    """Write a backup of the database and uploaded files to OUTPUT."""
+    try:
+        snapshot_id = start_backup(incremental)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    with open(output, 'wb') as target:
+        for data in stream_backup(snapshot_id):
+            target.write(data)
+    click.echo(f'Backup {snapshot_id} written to {output}.')
+
+@click.command('restore-backup')
+@click.argument('source', type=click.Path(exists=True, dir_okay=False))
+@with_appcontext
+def restore_backup_command(source):
+    """Restore a backup written by the backup command."""
+    with open(source, 'rb') as stream:
+        try:
+            snapshot_id, row_count, file_count = restore_backup(stream)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    click.echo(f'Restored backup {snapshot_id}: {row_count} rows and {file_count} files.')
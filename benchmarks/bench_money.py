@@ -0,0 +1,72 @@
+"""
+Microbenchmarks for the integer-halala money helpers against the previous
+str/Decimal round-tripping path.
+
+Run from the project root:
+    python benchmarks/bench_money.py
+"""
+import os
+import random
+import sys
+import timeit
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from money import Money, parse_halalas, percent_of, percent_many, sum_halalas, halalas_to_decimal, format_halalas
+
+AMOUNT_COUNT = 100000
+REPEAT = 5
+
+def decimal_calculate_vat(subtotal, vat_rate=15.0):
+    """The calculate_vat implementation before the Money type"""
+    subtotal = Decimal(str(subtotal))
+    vat_rate = Decimal(str(vat_rate))
+    vat_amount = subtotal * (vat_rate / 100)
+    return vat_amount, subtotal + vat_amount
+
+def money_calculate_vat(subtotal, vat_rate=15.0):
+    """The current calculate_vat implementation"""
+    subtotal = parse_halalas(subtotal)
+    vat_amount = percent_of(subtotal, vat_rate)
+    return halalas_to_decimal(vat_amount), halalas_to_decimal(subtotal + vat_amount)
+
+def report(name, seconds, baseline=None):
+    line = f"{name:<45} {seconds * 1000:9.1f} ms"
+    if baseline:
+        line += f"   {baseline / seconds:5.1f}x"
+    print(line)
+
+def best_of(fn):
+    return min(timeit.repeat(fn, number=1, repeat=REPEAT))
+
+def main():
+    random.seed(42)
+    # Amounts as NUMERIC(12, 2) columns return them
+    amounts = [Decimal(random.randint(0, 10 ** 8)).scaleb(-2) for _ in range(AMOUNT_COUNT)]
+    halalas = [parse_halalas(amount) for amount in amounts]
+    
+    print(f"{AMOUNT_COUNT} amounts, best of {REPEAT} runs\n")
+    
+    print("VAT per amount")
+    baseline = best_of(lambda: [decimal_calculate_vat(amount) for amount in amounts])
+    report("Decimal(str(x)) calculate_vat", baseline)
+    report("halala calculate_vat", best_of(lambda: [money_calculate_vat(amount) for amount in amounts]), baseline)
+    report("percent_many over halalas", best_of(lambda: percent_many(halalas, 15)), baseline)
+    
+    print("\nReport aggregation")
+    baseline = best_of(lambda: sum(float(amount) for amount in amounts))
+    report("float() accumulation", baseline)
+    report("Decimal sum", best_of(lambda: sum(amounts)), baseline)
+    report("sum_halalas over Decimals", best_of(lambda: sum_halalas(amounts)), baseline)
+    report("parse_halalas per amount", best_of(lambda: sum(parse_halalas(amount) for amount in amounts)), baseline)
+    report("sum over halalas", best_of(lambda: sum(halalas)), baseline)
+    
+    print("\nFormatting")
+    baseline = best_of(lambda: [f"{amount:.2f} SAR" for amount in amounts])
+    report("f'{Decimal:.2f} SAR'", baseline)
+    report("format_halalas", best_of(lambda: [format_halalas(value) + ' SAR' for value in halalas]), baseline)
+    report("Money.format", best_of(lambda: [Money(value).format() for value in halalas]), baseline)
+
+if __name__ == '__main__':
+    main()
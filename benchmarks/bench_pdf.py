@@ -0,0 +1,161 @@
+"""
+Invoice PDF rendering: the previous platypus implementation against the
+current engine (cached styles, canvas fast path for long item tables).
+
+Run from the project root:
+    python benchmarks/bench_pdf.py
+"""
+import os
+import random
+import sys
+import time
+from datetime import date
+from decimal import Decimal
+from io import BytesIO
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reportlab.lib.pagesizes import A4
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from pdf_engine import generate_invoice_pdf
+from utils import format_currency
+
+LINE_COUNTS = [10, 1000, 10000]
+
+# Runs per size; the slowest legacy case takes a while on its own
+REPEAT = {10: 20, 1000: 5, 10000: 1}
+
+class ItemList(list):
+    """Stands in for the dynamic Invoice.items relationship"""
+    
+    def count(self):
+        return len(self)
+
+def legacy_generate_invoice_pdf(invoice):
+    """The generate_invoice_pdf implementation before the PDF engine"""
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4)
+    styles = getSampleStyleSheet()
+    story = []
+    
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=18,
+        alignment=TA_CENTER,
+        spaceAfter=30
+    )
+    story.append(Paragraph(f"Invoice #{invoice.invoice_number}", title_style))
+    
+    details_data = [
+        ['Invoice Number:', invoice.invoice_number],
+        ['Issue Date:', invoice.issue_date.strftime('%Y-%m-%d')],
+        ['Due Date:', invoice.due_date.strftime('%Y-%m-%d') if invoice.due_date else 'N/A'],
+        ['Client:', invoice.client.name],
+        ['Status:', invoice.status],
+    ]
+    
+    details_table = Table(details_data, colWidths=[2*inch, 3*inch])
+    details_table.setStyle(TableStyle([
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+    ]))
+    story.append(details_table)
+    story.append(Spacer(1, 20))
+    
+    if invoice.items.count() > 0:
+        items_data = [['Description', 'Quantity', 'Unit Price', 'Total']]
+        for item in invoice.items:
+            items_data.append([
+                str(item.description),
+                str(item.quantity),
+                format_currency(item.unit_price),
+                format_currency(item.total_price)
+            ])
+        
+        items_table = Table(items_data, colWidths=[3*inch, 1*inch, 1.5*inch, 1.5*inch])
+        items_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black)
+        ]))
+        story.append(items_table)
+        story.append(Spacer(1, 20))
+    
+    totals_data = [
+        ['Subtotal:', format_currency(invoice.subtotal)],
+        ['VAT (15%):', format_currency(invoice.vat_amount)],
+        ['Total Amount:', format_currency(invoice.total_amount)],
+    ]
+    
+    totals_table = Table(totals_data, colWidths=[2*inch, 2*inch])
+    totals_table.setStyle(TableStyle([
+        ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
+        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+    ]))
+    story.append(totals_table)
+    
+    doc.build(story)
+    buffer.seek(0)
+    return buffer
+
+def make_invoice(line_count):
+    items = ItemList()
+    for number in range(line_count):
+        quantity = Decimal(random.randint(1, 20))
+        unit_price = Decimal(random.randint(100, 100000)).scaleb(-2)
+        items.append(SimpleNamespace(
+            description=f'Consulting services, work package {number + 1}',
+            quantity=quantity,
+            unit_price=unit_price,
+            total_price=quantity * unit_price
+        ))
+    subtotal = sum((item.total_price for item in items), Decimal('0'))
+    vat_amount = (subtotal * Decimal('0.15')).quantize(Decimal('0.01'))
+    return SimpleNamespace(
+        invoice_number=f'INV-BENCH-{line_count}',
+        issue_date=date(2025, 1, 1),
+        due_date=date(2025, 1, 31),
+        client=SimpleNamespace(name='Benchmark Trading Co.'),
+        status='Unpaid',
+        items=items,
+        subtotal=subtotal,
+        vat_amount=vat_amount,
+        total_amount=subtotal + vat_amount
+    )
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings), len(result.getvalue())
+
+def main():
+    random.seed(42)
+    print(f"{'Lines':>6}  {'legacy platypus':>16}  {'PDF engine':>12}  {'speedup':>8}")
+    for line_count in LINE_COUNTS:
+        invoice = make_invoice(line_count)
+        repeat = REPEAT[line_count]
+        legacy, legacy_size = best_of(lambda: legacy_generate_invoice_pdf(invoice), repeat)
+        current, current_size = best_of(lambda: generate_invoice_pdf(invoice), repeat)
+        print(f"{line_count:>6}  {legacy * 1000:13.1f} ms  {current * 1000:9.1f} ms  {legacy / current:7.1f}x"
+              f"   ({legacy_size // 1024} KB vs {current_size // 1024} KB)")
+
+if __name__ == '__main__':
+    main()
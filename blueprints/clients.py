@@ -1,11 +1,21 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, jsonify, send_file, Response, stream_with_context
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload, contains_eager
 from app import db
-from models import Client, ClientDocument, User
-from forms import ClientForm, DocumentUploadForm
-from utils import save_uploaded_file
+from models import Client, ClientDocument, ClientSummary, User, Invoice, Task
+from forms import ClientForm, DocumentUploadForm, ClientImportForm
+from utils import save_uploaded_file, stream_csv
+from client_io import CLIENT_EXPORT_COLUMNS, import_clients, export_client_rows, export_clients_xlsx, xlsx_supported
+from client_deletion import CLIENT_DELETING, has_issued_einvoices, request_client_deletion
+from choices import search_clients
+from money import Money
+from statements import STATEMENT_PAGE_SIZE, statement_totals, statement_page, iter_statement_lines, render_statement_pdf
+from datetime import date, datetime
+from math import ceil
 import os
+import zipfile
 
 clients_bp = Blueprint('clients', __name__)
 
@@ -15,13 +25,16 @@ def index():
     page = request.args.get('page', 1, type=int)
     search = request.args.get('search', '', type=str)
     status = request.args.get('status', '', type=str)
+    balance = request.args.get('balance', '', type=str)
+    sort = request.args.get('sort', '', type=str)
     
-    query = Client.query
+    # Counters come from the maintained summary rows, not from invoices
+    query = Client.query.outerjoin(ClientSummary).options(contains_eager(Client.summary))
     
     # Apply filters based on user role
     if current_user.role.name == 'Client':
         # Clients can only see their own data
-        query = query.filter_by(created_by=current_user.id)
+        query = query.filter(Client.created_by == current_user.id)
     
     # Apply search filter
     if search:
@@ -31,18 +44,53 @@ def index():
             Client.email.ilike(f'%{search}%')
         )
     
-    # Apply status filter
+    # Apply status filter; clients being deleted are only listed when asked for
     if status:
-        query = query.filter_by(status=status)
+        query = query.filter(Client.status == status)
+    else:
+        query = query.filter(Client.status != CLIENT_DELETING)
     
-    clients = query.order_by(Client.created_at.desc()).paginate(
+    # Apply balance filter
+    if balance == 'outstanding':
+        query = query.filter(ClientSummary.outstanding_balance > 0)
+    elif balance == 'settled':
+        query = query.filter(func.coalesce(ClientSummary.outstanding_balance, 0) == 0)
+    
+    if sort == 'balance':
+        order = [func.coalesce(ClientSummary.outstanding_balance, 0).desc(), Client.id]
+    elif sort == 'last_invoice':
+        order = [ClientSummary.last_invoice_date.desc().nullslast(), Client.id]
+    elif sort == 'name':
+        order = [Client.name, Client.id]
+    else:
+        order = [Client.created_at.desc()]
+    
+    clients = query.order_by(*order).paginate(
         page=page, per_page=20, error_out=False
     )
     
     return render_template('clients/index.html', 
                          clients=clients, 
                          search=search, 
-                         status=status)
+                         status=status,
+                         balance=balance,
+                         sort=sort)
+
+@clients_bp.route('/search')
+@login_required
+def search():
+    """Typeahead lookup of active clients for client dropdowns"""
+    if current_user.role.name not in ['Admin', 'Accountant']:
+        return jsonify({'success': False, 'error': 'Permission denied'}), 403
+    
+    term = request.args.get('q', '', type=str).strip()
+    if not term:
+        return jsonify({'success': True, 'results': []})
+    
+    return jsonify({
+        'success': True,
+        'results': [{'id': client.id, 'name': client.name} for client in search_clients(term)]
+    })
 
 @clients_bp.route('/add', methods=['GET', 'POST'])
 @login_required
@@ -73,30 +121,84 @@ def add():
     
     return render_template('clients/form.html', form=form, title='Add Client')
 
+@clients_bp.route('/import', methods=['GET', 'POST'])
+@login_required
+def import_file():
+    if current_user.role.name not in ['Admin', 'Accountant']:
+        flash('You do not have permission to import clients.', 'error')
+        return redirect(url_for('clients.index'))
+    
+    form = ClientImportForm()
+    errors = []
+    
+    if form.validate_on_submit():
+        try:
+            created, updated, skipped, errors = import_clients(form.file.data.stream, form.file.data.filename, current_user.id)
+        except (UnicodeDecodeError, zipfile.BadZipFile):
+            db.session.rollback()
+            flash('Could not read the file. Please upload a UTF-8 CSV or an Excel (.xlsx) file.', 'error')
+            return render_template('clients/import.html', form=form, errors=[], xlsx_supported=xlsx_supported())
+        
+        flash(f'{created} clients added and {updated} updated successfully!', 'success')
+        if errors:
+            shown = f' The first {len(errors)} are listed below.' if skipped > len(errors) else ''
+            flash(f'{skipped or len(errors)} rows were skipped.{shown}', 'warning')
+        else:
+            return redirect(url_for('clients.index'))
+    
+    return render_template('clients/import.html', form=form, errors=errors, xlsx_supported=xlsx_supported())
+
+@clients_bp.route('/export')
+@login_required
+def export():
+    """Stream all clients in the import format (CSV, or XLSX with format=xlsx)"""
+    if current_user.role.name not in ['Admin', 'Accountant']:
+        flash('You do not have permission to export clients.', 'error')
+        return redirect(url_for('clients.index'))
+    
+    # Clients being deleted are gone as far as the import format is concerned
+    query = Client.query.filter(Client.status != CLIENT_DELETING)
+    status = request.args.get('status', '', type=str)
+    if status:
+        query = query.filter(Client.status == status)
+    
+    filename = f"clients_{date.today().strftime('%Y-%m-%d')}"
+    if request.args.get('format') == 'xlsx':
+        if not xlsx_supported():
+            flash('Excel export is not available on this server.', 'error')
+            return redirect(url_for('clients.index'))
+        return send_file(export_clients_xlsx(export_client_rows(query)), as_attachment=True,
+                         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                         download_name=f'{filename}.xlsx')
+    
+    response = Response(stream_with_context(stream_csv(export_client_rows(query), CLIENT_EXPORT_COLUMNS)), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}.csv'
+    return response
+
 @clients_bp.route('/<int:id>')
 @login_required
 def view(id):
-    client = Client.query.get_or_404(id)
+    client = Client.query.options(joinedload(Client.created_by_user)).get_or_404(id)
     
     # Check permissions
     if current_user.role.name == 'Client' and client.created_by != current_user.id:
         flash('You do not have permission to view this client.', 'error')
         return redirect(url_for('clients.index'))
     
-    # Get client documents
-    documents = ClientDocument.query.filter_by(client_id=client.id).order_by(
+    # Every list below is a single query however much the client has on file
+    documents = ClientDocument.query.options(
+        joinedload(ClientDocument.uploader)
+    ).filter_by(client_id=client.id).order_by(
         ClientDocument.uploaded_at.desc()
     ).all()
     
-    # Get recent invoices
-    from models import Invoice
     recent_invoices = Invoice.query.filter_by(client_id=client.id).order_by(
         Invoice.created_at.desc()
     ).limit(5).all()
     
-    # Get recent tasks
-    from models import Task
-    recent_tasks = Task.query.filter_by(client_id=client.id).order_by(
+    recent_tasks = Task.query.options(
+        joinedload(Task.assigned_user)
+    ).filter_by(client_id=client.id).order_by(
         Task.created_at.desc()
     ).limit(5).all()
     
@@ -104,7 +206,92 @@ def view(id):
                          client=client,
                          documents=documents,
                          recent_invoices=recent_invoices,
-                         recent_tasks=recent_tasks)
+                         recent_tasks=recent_tasks,
+                         summary=client_summary(client.id))
+
+def client_summary(client_id):
+    """Invoice counters and open tasks for a client in one query"""
+    def counter(column):
+        return select(column).where(ClientSummary.client_id == client_id).scalar_subquery()
+    
+    open_tasks = select(func.count(Task.id)).where(
+        Task.client_id == client_id,
+        Task.status.in_(['Pending', 'In Progress'])
+    ).scalar_subquery()
+    
+    row = db.session.query(
+        counter(ClientSummary.invoice_count).label('invoice_count'),
+        counter(ClientSummary.outstanding_balance).label('open_balance'),
+        counter(ClientSummary.last_invoice_date).label('last_invoice_date'),
+        open_tasks.label('open_tasks')
+    ).one()
+    
+    return {
+        'invoice_count': row.invoice_count or 0,
+        'open_balance': Money.parse(row.open_balance or 0),
+        'last_invoice_date': row.last_invoice_date,
+        'open_tasks': row.open_tasks
+    }
+
+def _statement_period():
+    """Statement start/end from the query string, defaulting to this year so far"""
+    today = date.today()
+    start = request.args.get('start_date', type=str)
+    end = request.args.get('end_date', type=str)
+    start = datetime.strptime(start, '%Y-%m-%d').date() if start else today.replace(month=1, day=1)
+    end = datetime.strptime(end, '%Y-%m-%d').date() if end else today
+    return start, end
+
+@clients_bp.route('/<int:id>/statement')
+@login_required
+def statement(id):
+    """Statement of account: invoices and payments with a running balance"""
+    client = Client.query.get_or_404(id)
+    
+    if current_user.role.name == 'Client' and client.created_by != current_user.id:
+        flash('You do not have permission to view this client.', 'error')
+        return redirect(url_for('clients.index'))
+    
+    try:
+        start, end = _statement_period()
+    except ValueError:
+        flash('Invalid date range.', 'error')
+        return redirect(url_for('clients.statement', id=client.id))
+    
+    page = max(request.args.get('page', 1, type=int), 1)
+    totals = statement_totals(client.id, start, end)
+    lines = statement_page(client.id, start, end, totals['opening_balance'], page)
+    
+    return render_template('clients/statement.html',
+                         client=client,
+                         start_date=start.strftime('%Y-%m-%d'),
+                         end_date=end.strftime('%Y-%m-%d'),
+                         totals=totals,
+                         lines=lines,
+                         page=page,
+                         pages=max(ceil(totals['line_count'] / STATEMENT_PAGE_SIZE), 1))
+
+@clients_bp.route('/<int:id>/statement/pdf')
+@login_required
+def statement_pdf(id):
+    client = Client.query.get_or_404(id)
+    
+    if current_user.role.name == 'Client' and client.created_by != current_user.id:
+        flash('You do not have permission to view this client.', 'error')
+        return redirect(url_for('clients.index'))
+    
+    try:
+        start, end = _statement_period()
+    except ValueError:
+        flash('Invalid date range.', 'error')
+        return redirect(url_for('clients.statement', id=client.id))
+    
+    totals = statement_totals(client.id, start, end)
+    pdf_file = render_statement_pdf(client, start, end, totals,
+                                    iter_statement_lines(client.id, start, end, totals['opening_balance']))
+    
+    return send_file(pdf_file, mimetype='application/pdf', as_attachment=True,
+                     download_name=f"statement_{client.id}_{start.strftime('%Y%m%d')}_{end.strftime('%Y%m%d')}.pdf")
 
 @clients_bp.route('/<int:id>/edit', methods=['GET', 'POST'])
 @login_required
@@ -116,6 +303,10 @@ def edit(id):
         flash('You do not have permission to edit this client.', 'error')
         return redirect(url_for('clients.index'))
     
+    if client.status == CLIENT_DELETING:
+        flash('This client is being deleted.', 'error')
+        return redirect(url_for('clients.index'))
+    
     form = ClientForm(obj=client)
     if form.validate_on_submit():
         form.populate_obj(client)
@@ -135,22 +326,17 @@ def delete(id):
     
     client = Client.query.get_or_404(id)
     
-    try:
-        # Delete associated documents
-        for document in client.documents:
-            # Delete file from filesystem
-            file_path = os.path.join(current_app.root_path, 'uploads', document.filename)
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            db.session.delete(document)
-        
-        db.session.delete(client)
-        db.session.commit()
-        
-        flash('Client deleted successfully!', 'success')
-    except Exception as e:
-        db.session.rollback()
-        flash('Error deleting client. Please try again.', 'error')
+    if client.status == CLIENT_DELETING:
+        flash('This client is already being deleted.', 'info')
+        return redirect(url_for('clients.index'))
+    
+    if has_issued_einvoices(client.id):
+        flash('Clients with issued e-invoices cannot be deleted.', 'error')
+        return redirect(url_for('clients.view', id=client.id))
+    
+    # Invoices, documents and files are removed in the background
+    request_client_deletion(client)
+    flash('Client deleted successfully! Their records are being removed in the background.', 'success')
     
     return redirect(url_for('clients.index'))
 
@@ -164,6 +350,10 @@ def upload_document(id):
         flash('You do not have permission to upload documents for this client.', 'error')
         return redirect(url_for('clients.view', id=id))
     
+    if client.status == CLIENT_DELETING:
+        flash('This client is being deleted.', 'error')
+        return redirect(url_for('clients.index'))
+    
     form = DocumentUploadForm()
     if form.validate_on_submit():
         file = form.file.data
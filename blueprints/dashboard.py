@@ -1,12 +1,22 @@
-from flask import Blueprint, render_template, request
+from flask import Blueprint, render_template, request, Response, stream_with_context
 from flask_login import login_required, current_user
-from sqlalchemy import func, and_
+from sqlalchemy import func, and_, case
 from datetime import datetime, timedelta, date
 from app import db
-from models import Client, Invoice, Task, VATCalculation, ZakatCalculation
+from models import Client, ClientSummary, Invoice, InvoiceDailyRollup, Task, VATCalculation, ZakatCalculation
+from live import broker, format_event, client_scope, STAFF_SCOPE
+import queue
+import time
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
+# Each stream ends after this long and the browser reconnects, resuming
+# from Last-Event-ID. Streams run under the gevent worker, where waiting
+# on the queue parks a greenlet rather than an OS thread
+LIVE_STREAM_SECONDS = 55
+LIVE_HEARTBEAT_SECONDS = 15
+LIVE_RETRY_MS = 2000
+
 @dashboard_bp.route('/')
 @login_required
 def index():
@@ -24,6 +34,44 @@ def index():
                          upcoming_tasks=upcoming_tasks,
                          pending_calculations=pending_calculations)
 
+@dashboard_bp.route('/live')
+@login_required
+def live_updates():
+    """Server-Sent Events stream of dashboard stat deltas and activity"""
+    if current_user.role.name == 'Client':
+        client = Client.query.filter_by(created_by=current_user.id).first()
+        scope = client_scope(client.id if client else -1)
+    else:
+        scope = STAFF_SCOPE
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    
+    # Nothing below touches the database, so give the connection back now
+    db.session.remove()
+    
+    def generate():
+        subscriber = broker.subscribe(scope, last_event_id)
+        try:
+            yield f"retry: {LIVE_RETRY_MS}\n\n"
+            deadline = time.monotonic() + LIVE_STREAM_SECONDS
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    message = subscriber.get(timeout=min(LIVE_HEARTBEAT_SECONDS, remaining))
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_event(message)
+        finally:
+            broker.unsubscribe(scope, subscriber)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 def get_dashboard_stats():
     """Get dashboard statistics"""
     today = date.today()
@@ -43,10 +91,14 @@ def get_dashboard_stats():
                 'unpaid_amount': 0
             }
         client_filter = Invoice.client_id == client.id
+        rollup_filter = InvoiceDailyRollup.client_id == client.id
+        summary_filter = ClientSummary.client_id == client.id
         task_client_filter = Task.client_id == client.id
     else:
         # Admin and Accountant can see all data
         client_filter = True
+        rollup_filter = True
+        summary_filter = True
         task_client_filter = True
     
     # Total clients
@@ -55,17 +107,18 @@ def get_dashboard_stats():
     else:
         total_clients = Client.query.count()
     
-    # Total invoices
-    total_invoices = Invoice.query.filter(client_filter).count()
+    # Invoice count and current month revenue in one rollup scan
+    total_invoices, monthly_revenue = db.session.query(
+        func.sum(InvoiceDailyRollup.invoice_count),
+        func.sum(case(
+            (and_(InvoiceDailyRollup.day >= current_month, InvoiceDailyRollup.status == 'Paid'),
+             InvoiceDailyRollup.total_amount),
+            else_=0
+        ))
+    ).filter(rollup_filter).one()
     
-    # Monthly revenue (current month)
-    monthly_revenue = db.session.query(func.sum(Invoice.total_amount)).filter(
-        and_(
-            Invoice.issue_date >= current_month,
-            Invoice.status == 'Paid',
-            client_filter
-        )
-    ).scalar() or 0
+    # Unpaid amount net of partial payments, from the per-client balances
+    unpaid_amount = db.session.query(func.sum(ClientSummary.outstanding_balance)).filter(summary_filter).scalar()
     
     # Pending tasks
     pending_tasks = Task.query.filter(
@@ -84,21 +137,13 @@ def get_dashboard_stats():
         )
     ).count()
     
-    # Unpaid amount
-    unpaid_amount = db.session.query(func.sum(Invoice.total_amount)).filter(
-        and_(
-            Invoice.status != 'Paid',
-            client_filter
-        )
-    ).scalar() or 0
-    
     return {
         'total_clients': total_clients,
-        'total_invoices': total_invoices,
-        'monthly_revenue': float(monthly_revenue),
+        'total_invoices': int(total_invoices or 0),
+        'monthly_revenue': float(monthly_revenue or 0),
         'pending_tasks': pending_tasks,
         'overdue_invoices': overdue_invoices,
-        'unpaid_amount': float(unpaid_amount)
+        'unpaid_amount': float(unpaid_amount or 0)
     }
 
 def get_recent_invoices(limit=5):
@@ -1,10 +1,18 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, make_response
 from flask_login import login_required, current_user
+from sqlalchemy import func, insert
 from app import db
-from models import Invoice, InvoiceItem, InvoiceAttachment, Client
-from forms import InvoiceForm, InvoiceItemForm
-from utils import calculate_vat, generate_invoice_pdf, save_uploaded_file
+from models import Invoice, InvoiceItem, InvoiceAttachment, Client, Payment, Company
+from forms import InvoiceForm, InvoiceItemForm, PaymentForm, BankStatementImportForm
+from reconciliation import reconcile_statement, refresh_payment_status, INSERT_CHUNK_SIZE
+from rollups import move_invoices_to_status, record_bulk_payments
+from choices import client_options, client_typeahead_url, set_client_choices
+from pdf_engine import generate_invoice_pdf
+from einvoice import issue_einvoice
+from archive import invoice_source
+from utils import calculate_vat, save_uploaded_file, get_bulk_ids, get_bulk_param, bulk_response, bulk_error
 from decimal import Decimal
+from datetime import date, datetime
 import uuid
 
 invoices_bp = Blueprint('invoices', __name__)
@@ -52,14 +60,15 @@ def index():
     if current_user.role.name == 'Client':
         clients = []
     else:
-        clients = Client.query.filter_by(status='Active').order_by(Client.name).all()
+        clients = client_options(client_id)
     
     return render_template('invoices/index.html', 
                          invoices=invoices, 
                          search=search, 
                          status=status,
                          client_id=client_id,
-                         clients=clients)
+                         clients=clients,
+                         client_search_url=client_typeahead_url())
 
 @invoices_bp.route('/add', methods=['GET', 'POST'])
 @login_required
@@ -71,13 +80,12 @@ def add():
     form = InvoiceForm()
     
     # Populate client choices
-    clients = Client.query.filter_by(status='Active').order_by(Client.name).all()
-    form.client_id.choices = [(c.id, c.name) for c in clients]
+    set_client_choices(form.client_id)
     
     if form.validate_on_submit():
         # Generate unique invoice number
         invoice_number = form.invoice_number.data
-        if Invoice.query.filter_by(invoice_number=invoice_number).first():
+        if db.session.query(invoice_source()).filter_by(invoice_number=invoice_number).first():
             flash('Invoice number already exists. Please use a different number.', 'error')
             return render_template('invoices/form.html', form=form, title='Create Invoice')
         
@@ -136,17 +144,22 @@ def edit(id):
         return redirect(url_for('invoices.index'))
     
     invoice = Invoice.query.get_or_404(id)
+    
+    if invoice.einvoice is not None:
+        flash('This invoice has been issued as an e-invoice and can no longer be changed.', 'error')
+        return redirect(url_for('invoices.view', id=invoice.id))
+    
     form = InvoiceForm(obj=invoice)
     
     # Populate client choices
-    clients = Client.query.filter_by(status='Active').order_by(Client.name).all()
-    form.client_id.choices = [(c.id, c.name) for c in clients]
+    set_client_choices(form.client_id)
     
     if form.validate_on_submit():
-        # Check if invoice number is unique (excluding current invoice)
-        existing_invoice = Invoice.query.filter(
-            Invoice.invoice_number == form.invoice_number.data,
-            Invoice.id != invoice.id
+        # Check if invoice number is unique (excluding current invoice), archived ones included
+        invoices = invoice_source()
+        existing_invoice = db.session.query(invoices).filter(
+            invoices.invoice_number == form.invoice_number.data,
+            invoices.id != invoice.id
         ).first()
         
         if existing_invoice:
@@ -177,6 +190,10 @@ def delete(id):
     
     invoice = Invoice.query.get_or_404(id)
     
+    if invoice.einvoice is not None:
+        flash('This invoice has been issued as an e-invoice and can no longer be changed.', 'error')
+        return redirect(url_for('invoices.view', id=invoice.id))
+    
     try:
         db.session.delete(invoice)
         db.session.commit()
@@ -208,6 +225,11 @@ def add_item(id):
         return redirect(url_for('invoices.view', id=id))
     
     invoice = Invoice.query.get_or_404(id)
+    
+    if invoice.einvoice is not None:
+        flash('This invoice has been issued as an e-invoice and can no longer be changed.', 'error')
+        return redirect(url_for('invoices.view', id=invoice.id))
+    
     form = InvoiceItemForm()
     
     if form.validate_on_submit():
@@ -242,6 +264,11 @@ def edit_item(item_id):
     
     item = InvoiceItem.query.get_or_404(item_id)
     invoice = item.invoice
+    
+    if invoice.einvoice is not None:
+        flash('This invoice has been issued as an e-invoice and can no longer be changed.', 'error')
+        return redirect(url_for('invoices.view', id=invoice.id))
+    
     form = InvoiceItemForm(obj=item)
     
     if form.validate_on_submit():
@@ -268,6 +295,10 @@ def delete_item(item_id):
     item = InvoiceItem.query.get_or_404(item_id)
     invoice = item.invoice
     
+    if invoice.einvoice is not None:
+        flash('This invoice has been issued as an e-invoice and can no longer be changed.', 'error')
+        return redirect(url_for('invoices.view', id=invoice.id))
+    
     db.session.delete(item)
     
     # Recalculate invoice totals
@@ -290,7 +321,8 @@ def download_pdf(id):
             flash('You do not have permission to download this invoice.', 'error')
             return redirect(url_for('invoices.index'))
     
-    pdf_buffer = generate_invoice_pdf(invoice)
+    qr_payload = invoice.einvoice.qr_payload if invoice.einvoice else None
+    pdf_buffer = generate_invoice_pdf(invoice, company=Company.query.first(), qr_payload=qr_payload)
     
     response = make_response(pdf_buffer.getvalue())
     response.headers['Content-Type'] = 'application/pdf'
@@ -298,6 +330,52 @@ def download_pdf(id):
     
     return response
 
+@invoices_bp.route('/<int:id>/einvoice', methods=['POST'])
+@login_required
+def issue_einvoice_route(id):
+    """Issue the ZATCA e-invoice (XML, QR and chain hash) of an invoice"""
+    if current_user.role.name not in ['Admin', 'Accountant']:
+        flash('You do not have permission to issue e-invoices.', 'error')
+        return redirect(url_for('invoices.view', id=id))
+    
+    invoice = Invoice.query.get_or_404(id)
+    if invoice.einvoice is not None:
+        flash('This invoice has already been issued as an e-invoice.', 'info')
+        return redirect(url_for('invoices.view', id=invoice.id))
+    
+    try:
+        issue_einvoice(invoice)
+        flash('E-invoice issued successfully!', 'success')
+    except ValueError as e:
+        flash(str(e), 'error')
+    except Exception:
+        db.session.rollback()
+        flash('Error issuing e-invoice. Please try again.', 'error')
+    
+    return redirect(url_for('invoices.view', id=invoice.id))
+
+@invoices_bp.route('/<int:id>/einvoice.xml')
+@login_required
+def download_einvoice(id):
+    invoice = Invoice.query.get_or_404(id)
+    
+    # Check permissions
+    if current_user.role.name == 'Client':
+        client = Client.query.filter_by(created_by=current_user.id).first()
+        if not client or invoice.client_id != client.id:
+            flash('You do not have permission to download this invoice.', 'error')
+            return redirect(url_for('invoices.index'))
+    
+    if invoice.einvoice is None:
+        flash('This invoice has not been issued as an e-invoice yet.', 'error')
+        return redirect(url_for('invoices.view', id=invoice.id))
+    
+    response = make_response(invoice.einvoice.xml.encode('utf-8'))
+    response.headers['Content-Type'] = 'application/xml'
+    response.headers['Content-Disposition'] = f'attachment; filename=invoice_{invoice.invoice_number}.xml'
+    
+    return response
+
 @invoices_bp.route('/<int:id>/mark-paid', methods=['POST'])
 @login_required
 def mark_paid(id):
@@ -306,14 +384,174 @@ def mark_paid(id):
         return redirect(url_for('invoices.view', id=id))
     
     invoice = Invoice.query.get_or_404(id)
-    invoice.status = 'Paid'
-    invoice.payment_date = db.func.current_date()
+    if invoice.status == 'Paid':
+        flash('Invoice is already paid.', 'info')
+        return redirect(url_for('invoices.view', id=id))
+    
+    # Record the remaining balance as a payment so statements and balances see it
+    paid = db.session.query(func.coalesce(func.sum(Payment.amount), 0)).filter(
+        Payment.invoice_id == invoice.id
+    ).scalar()
+    balance = invoice.total_amount - paid
+    if balance > 0:
+        db.session.add(Payment(
+            invoice_id=invoice.id,
+            client_id=invoice.client_id,
+            amount=balance,
+            payment_date=date.today(),
+            notes='Marked as paid',
+            created_by=current_user.id
+        ))
+        db.session.flush()
+    
+    refresh_payment_status(invoice)
     
     db.session.commit()
     
     flash('Invoice marked as paid!', 'success')
     return redirect(url_for('invoices.view', id=id))
 
+@invoices_bp.route('/<int:id>/payments/add', methods=['GET', 'POST'])
+@login_required
+def add_payment(id):
+    if current_user.role.name not in ['Admin', 'Accountant']:
+        flash('You do not have permission to record payments.', 'error')
+        return redirect(url_for('invoices.view', id=id))
+    
+    invoice = Invoice.query.get_or_404(id)
+    form = PaymentForm()
+    
+    if form.validate_on_submit():
+        payment = Payment(
+            invoice_id=invoice.id,
+            client_id=invoice.client_id,
+            amount=form.amount.data,
+            payment_date=form.payment_date.data,
+            method=form.method.data,
+            reference=form.reference.data,
+            notes=form.notes.data,
+            created_by=current_user.id
+        )
+        
+        db.session.add(payment)
+        db.session.flush()
+        
+        refresh_payment_status(invoice)
+        
+        db.session.commit()
+        
+        flash('Payment recorded successfully!', 'success')
+        return redirect(url_for('invoices.view', id=invoice.id))
+    
+    return render_template('invoices/payment_form.html', form=form, invoice=invoice, title='Record Payment')
+
+@invoices_bp.route('/payments/reconcile', methods=['GET', 'POST'])
+@login_required
+def reconcile():
+    if current_user.role.name not in ['Admin', 'Accountant']:
+        flash('You do not have permission to reconcile bank statements.', 'error')
+        return redirect(url_for('invoices.index'))
+    
+    form = BankStatementImportForm()
+    summary = None
+    
+    if form.validate_on_submit():
+        # Preview matches without writing unless the user confirms
+        apply = request.form.get('apply') == '1'
+        try:
+            summary = reconcile_statement(form.file.data.stream, current_user.id, apply=apply)
+        except (UnicodeDecodeError, ValueError):
+            db.session.rollback()
+            flash('Could not read the bank statement. Please upload a UTF-8 CSV file.', 'error')
+            return render_template('invoices/reconcile.html', form=form, summary=None)
+        
+        if apply:
+            flash(f"{summary['matched'] + summary['partial']} statement lines applied as payments.", 'success')
+    
+    return render_template('invoices/reconcile.html', form=form, summary=summary)
+
+@invoices_bp.route('/bulk/mark-paid', methods=['POST'])
+@login_required
+def bulk_mark_paid():
+    """Mark many invoices as paid with a single UPDATE"""
+    if current_user.role.name not in ['Admin', 'Accountant']:
+        return bulk_error(request, 'You do not have permission to mark invoices as paid.',
+                          url_for('invoices.index'), 403)
+    
+    payment_date = get_bulk_param(request, 'payment_date')
+    try:
+        payment_date = datetime.strptime(payment_date, '%Y-%m-%d').date() if payment_date else date.today()
+    except ValueError:
+        return bulk_error(request, 'Invalid payment date. Use YYYY-MM-DD.', url_for('invoices.index'))
+    
+    requested_ids, invalid_ids = get_bulk_ids(request)
+    query = db.session.query(Invoice.id, Invoice.status)
+    
+    if requested_ids or invalid_ids:
+        query = query.filter(Invoice.id.in_(requested_ids))
+    else:
+        # Fall back to a filter so a whole client or status can be settled at once
+        status = get_bulk_param(request, 'status')
+        try:
+            client_id = int(get_bulk_param(request, 'client_id') or 0)
+        except (TypeError, ValueError):
+            return bulk_error(request, 'Invalid client filter.', url_for('invoices.index'))
+        if not status and not client_id:
+            return bulk_error(request, 'Select invoices or provide a filter.', url_for('invoices.index'))
+        if status:
+            query = query.filter(Invoice.status == status)
+        if client_id:
+            query = query.filter(Invoice.client_id == client_id)
+    
+    found = {row.id: row.status for row in query.all()}
+    
+    results = {invalid_id: 'invalid_id' for invalid_id in invalid_ids}
+    update_ids = []
+    for invoice_id in (requested_ids or found.keys()):
+        if invoice_id not in found:
+            results[invoice_id] = 'not_found'
+        elif found[invoice_id] == 'Paid':
+            results[invoice_id] = 'already_paid'
+        else:
+            results[invoice_id] = 'updated'
+            update_ids.append(invoice_id)
+    
+    if update_ids:
+        # Record each remaining balance as a payment, as bank reconciliation does
+        paid = db.session.query(
+            Payment.invoice_id, func.sum(Payment.amount).label('paid')
+        ).filter(Payment.invoice_id.in_(update_ids)).group_by(Payment.invoice_id).subquery()
+        balances = db.session.query(
+            Invoice.id, Invoice.client_id, Invoice.total_amount - func.coalesce(paid.c.paid, 0)
+        ).outerjoin(paid, paid.c.invoice_id == Invoice.id).filter(Invoice.id.in_(update_ids))
+        
+        created_at = datetime.utcnow()
+        payments = [{
+            'invoice_id': invoice_id,
+            'client_id': client_id,
+            'amount': balance,
+            'payment_date': payment_date,
+            'method': 'Bank Transfer',
+            'reference': None,
+            'notes': 'Marked as paid',
+            'created_by': current_user.id,
+            'created_at': created_at
+        } for invoice_id, client_id, balance in balances if balance > 0]
+        
+        if payments:
+            record_bulk_payments(payments)
+            for start in range(0, len(payments), INSERT_CHUNK_SIZE):
+                db.session.execute(insert(Payment), payments[start:start + INSERT_CHUNK_SIZE])
+        
+        move_invoices_to_status(update_ids, 'Paid')
+        Invoice.query.filter(Invoice.id.in_(update_ids)).update(
+            {Invoice.status: 'Paid', Invoice.payment_date: payment_date},
+            synchronize_session=False
+        )
+        db.session.commit()
+    
+    return bulk_response(request, results, url_for('invoices.index'), 'invoices')
+
 def recalculate_invoice_totals(invoice):
     """Recalculate invoice subtotal, VAT, and total based on items"""
     items_total = sum(item.total_price for item in invoice.items)
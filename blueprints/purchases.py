@@ -0,0 +1,146 @@
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask_login import login_required, current_user
+from app import db
+from models import Purchase, Client
+from forms import PurchaseForm, PurchaseImportForm
+from ledger import import_purchases_csv
+from choices import client_options, client_typeahead_url, set_client_choices
+from utils import calculate_vat
+
+purchases_bp = Blueprint('purchases', __name__)
+
+@purchases_bp.route('/')
+@login_required
+def index():
+    page = request.args.get('page', 1, type=int)
+    search = request.args.get('search', '', type=str)
+    client_id = request.args.get('client_id', '', type=str)
+    
+    query = Purchase.query
+    
+    # Apply filters based on user role
+    if current_user.role.name == 'Client':
+        # Clients can only see their purchases
+        client = Client.query.filter_by(created_by=current_user.id).first()
+        if client:
+            query = query.filter_by(client_id=client.id)
+        else:
+            query = query.filter_by(client_id=-1)  # No results
+    
+    # Apply search filter
+    if search:
+        query = query.filter(
+            Purchase.supplier_name.ilike(f'%{search}%') |
+            Purchase.invoice_number.ilike(f'%{search}%') |
+            Purchase.description.ilike(f'%{search}%')
+        )
+    
+    # Apply client filter
+    if client_id:
+        query = query.filter_by(client_id=client_id)
+    
+    purchases = query.order_by(Purchase.purchase_date.desc(), Purchase.id.desc()).paginate(
+        page=page, per_page=20, error_out=False
+    )
+    
+    # Get clients for filter dropdown
+    if current_user.role.name == 'Client':
+        clients = []
+    else:
+        clients = client_options(client_id)
+    
+    return render_template('purchases/index.html',
+                         purchases=purchases,
+                         search=search,
+                         client_id=client_id,
+                         clients=clients,
+                         client_search_url=client_typeahead_url())
+
+@purchases_bp.route('/add', methods=['GET', 'POST'])
+@login_required
+def add():
+    if current_user.role.name not in ['Admin', 'Accountant']:
+        flash('You do not have permission to record purchases.', 'error')
+        return redirect(url_for('purchases.index'))
+    
+    form = PurchaseForm()
+    
+    # Populate client choices
+    set_client_choices(form.client_id)
+    
+    if form.validate_on_submit():
+        vat_amount, total_amount = calculate_vat(form.subtotal.data, form.vat_rate.data)
+        
+        purchase = Purchase(
+            client_id=form.client_id.data,
+            supplier_name=form.supplier_name.data,
+            supplier_vat_number=form.supplier_vat_number.data,
+            invoice_number=form.invoice_number.data,
+            purchase_date=form.purchase_date.data,
+            description=form.description.data,
+            category=form.category.data,
+            subtotal=form.subtotal.data,
+            vat_rate=form.vat_rate.data,
+            vat_amount=vat_amount,
+            total_amount=total_amount,
+            created_by=current_user.id
+        )
+        
+        db.session.add(purchase)
+        db.session.commit()
+        
+        flash('Purchase recorded successfully!', 'success')
+        return redirect(url_for('purchases.index'))
+    
+    return render_template('purchases/form.html', form=form, title='Record Purchase')
+
+@purchases_bp.route('/<int:id>/delete', methods=['POST'])
+@login_required
+def delete(id):
+    if current_user.role.name not in ['Admin', 'Accountant']:
+        flash('You do not have permission to delete purchases.', 'error')
+        return redirect(url_for('purchases.index'))
+    
+    purchase = Purchase.query.get_or_404(id)
+    
+    try:
+        db.session.delete(purchase)
+        db.session.commit()
+        
+        flash('Purchase deleted successfully!', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash('Error deleting purchase. Please try again.', 'error')
+    
+    return redirect(url_for('purchases.index'))
+
+@purchases_bp.route('/import', methods=['GET', 'POST'])
+@login_required
+def import_csv():
+    if current_user.role.name not in ['Admin', 'Accountant']:
+        flash('You do not have permission to import purchases.', 'error')
+        return redirect(url_for('purchases.index'))
+    
+    form = PurchaseImportForm()
+    
+    # Populate client choices
+    set_client_choices(form.client_id)
+    
+    errors = []
+    
+    if form.validate_on_submit():
+        try:
+            imported, skipped, errors = import_purchases_csv(form.file.data.stream, form.client_id.data, current_user.id)
+        except UnicodeDecodeError:
+            db.session.rollback()
+            flash('Could not read the file. Please upload a UTF-8 CSV file.', 'error')
+            return render_template('purchases/import.html', form=form, errors=[])
+        
+        flash(f'{imported} purchases imported successfully!', 'success')
+        if skipped:
+            shown = f' The first {len(errors)} are listed below.' if skipped > len(errors) else ''
+            flash(f'{skipped} rows were skipped.{shown}', 'warning')
+        else:
+            return redirect(url_for('purchases.index', client_id=form.client_id.data))
+    
+    return render_template('purchases/import.html', form=form, errors=errors)
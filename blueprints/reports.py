@@ -1,11 +1,20 @@
-from flask import Blueprint, render_template, request, make_response, jsonify
+from flask import Blueprint, render_template, request, jsonify, Response, stream_with_context, redirect, url_for, flash, send_file
 from flask_login import login_required, current_user
-from sqlalchemy import func, and_, extract
+from sqlalchemy import func, and_, or_, case
+from sqlalchemy.orm import joinedload
 from app import db
-from models import Invoice, Client, Task, VATCalculation, ZakatCalculation
-from utils import export_to_csv
+from models import Invoice, InvoiceDailyRollup, Client, Task, VATCalculation, ZakatCalculation, Payment, ReportJob
+from utils import stream_csv
+from report_jobs import ASYNC_ROW_THRESHOLD, find_or_start_job, report_export_path
+from report_cache import cached_report, cache_stats
+from archive import invoice_source, task_source
+from money import Money
+from timeseries import revenue_timeseries
+from choices import client_options, client_typeahead_url, staff_choices
+from decimal import Decimal
 from datetime import datetime, date, timedelta
 import calendar
+import json
 
 reports_bp = Blueprint('reports', __name__)
 
@@ -14,373 +23,728 @@ reports_bp = Blueprint('reports', __name__)
 def index():
     return render_template('reports/index.html')
 
-@reports_bp.route('/revenue')
-@login_required
-def revenue_report():
-    # Get date range from query parameters
+def report_scope(report):
+    """
+    The slice of data a report may show to the current user, as plain
+    values so it can travel to a background job and key stored results.
+    """
+    if current_user.role.name == 'Client':
+        client = Client.query.filter_by(created_by=current_user.id).first()
+        return {'client_id': client.id if client else -1}  # -1 means no results
+    if report == 'tasks' and current_user.role.name == 'Accountant':
+        return {'user_id': current_user.id}
+    return {}
+
+def _client_scope_filter(column, scope):
+    if 'client_id' in scope:
+        return column == scope['client_id']
+    return True
+
+def _date_range_params(default_start):
+    """Read start_date/end_date from the query string, defaulting to default_start(today)..today"""
     start_date = request.args.get('start_date', type=str)
     end_date = request.args.get('end_date', type=str)
-    client_id = request.args.get('client_id', type=int)
     
-    # Default to current month if no dates provided
     if not start_date or not end_date:
         today = date.today()
-        start_date = today.replace(day=1).strftime('%Y-%m-%d')
+        start_date = default_start(today).strftime('%Y-%m-%d')
         end_date = today.strftime('%Y-%m-%d')
     
-    start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').date()
-    end_date_obj = datetime.strptime(end_date, '%Y-%m-%d').date()
-    
-    # Base query filters based on user role
-    if current_user.role.name == 'Client':
-        client = Client.query.filter_by(created_by=current_user.id).first()
-        if client:
-            client_filter = Invoice.client_id == client.id
-        else:
-            client_filter = Invoice.client_id == -1  # No results
-    else:
-        client_filter = True
-    
-    # Build query
-    query = Invoice.query.filter(
+    return {
+        'start_date': datetime.strptime(start_date, '%Y-%m-%d').date().isoformat(),
+        'end_date': datetime.strptime(end_date, '%Y-%m-%d').date().isoformat()
+    }
+
+def _filter_choices(report):
+    """Dropdown choices for a report's filter form"""
+    if current_user.role.name not in ['Admin', 'Accountant']:
+        return {'users': []} if report == 'tasks' else {'clients': []}
+    if report == 'tasks':
+        return {'users': staff_choices()}
+    return {'clients': client_options(request.args.get('client_id')), 'client_search_url': client_typeahead_url()}
+
+# Revenue report
+
+REVENUE_EXPORT_COLUMNS = ['Invoice Number', 'Client', 'Issue Date', 'Due Date', 'Subtotal (SAR)', 'VAT (SAR)', 'Total (SAR)', 'Status', 'Payment Date']
+
+def revenue_params():
+    # Default to current month if no dates provided
+    params = _date_range_params(lambda today: today.replace(day=1))
+    params['client_id'] = request.args.get('client_id', type=int)
+    return params
+
+def revenue_detail_query(params, scope):
+    start_date = date.fromisoformat(params['start_date'])
+    end_date = date.fromisoformat(params['end_date'])
+    invoices = invoice_source(start_date, end_date)
+    query = db.session.query(invoices).options(joinedload(invoices.client)).filter(
         and_(
-            Invoice.issue_date >= start_date_obj,
-            Invoice.issue_date <= end_date_obj,
-            client_filter
+            invoices.issue_date >= start_date,
+            invoices.issue_date <= end_date,
+            _client_scope_filter(invoices.client_id, scope)
         )
     )
     
     # Apply client filter if specified
-    if client_id:
-        query = query.filter_by(client_id=client_id)
-    
-    invoices = query.order_by(Invoice.issue_date.desc()).all()
-    
-    # Calculate totals
-    total_revenue = sum(invoice.total_amount for invoice in invoices if invoice.status == 'Paid')
-    total_outstanding = sum(invoice.total_amount for invoice in invoices if invoice.status != 'Paid')
-    total_vat = sum(invoice.vat_amount for invoice in invoices if invoice.status == 'Paid')
+    if params['client_id']:
+        query = query.filter_by(client_id=params['client_id'])
     
-    # Monthly breakdown
+    return query.order_by(invoices.issue_date.desc())
+
+def revenue_summary(params, scope):
+    """Totals plus monthly and client breakdowns, built from the daily rollups"""
+    rollup_filters = [
+        InvoiceDailyRollup.day >= date.fromisoformat(params['start_date']),
+        InvoiceDailyRollup.day <= date.fromisoformat(params['end_date']),
+        _client_scope_filter(InvoiceDailyRollup.client_id, scope)
+    ]
+    if params['client_id']:
+        rollup_filters.append(InvoiceDailyRollup.client_id == params['client_id'])
+    
+    daily_totals = db.session.query(
+        InvoiceDailyRollup.client_id,
+        InvoiceDailyRollup.day,
+        InvoiceDailyRollup.status,
+        InvoiceDailyRollup.vat_amount,
+        InvoiceDailyRollup.total_amount
+    ).filter(*rollup_filters).order_by(InvoiceDailyRollup.day.desc()).all()
+    
+    # Monthly and client breakdowns are summed exactly and converted once
     monthly_data = {}
-    for invoice in invoices:
-        month_key = invoice.issue_date.strftime('%Y-%m')
+    client_data = {}
+    include_clients = 'client_id' not in scope
+    client_names = {}
+    if include_clients:
+        client_ids = {row.client_id for row in daily_totals}
+        if client_ids:
+            client_names = dict(db.session.query(Client.id, Client.name).filter(Client.id.in_(client_ids)))
+    
+    for row in daily_totals:
+        month_key = row.day.strftime('%Y-%m')
         if month_key not in monthly_data:
             monthly_data[month_key] = {
-                'month': invoice.issue_date.strftime('%B %Y'),
-                'paid': 0,
-                'unpaid': 0,
-                'vat': 0
+                'month': row.day.strftime('%B %Y'),
+                'paid': Decimal('0'),
+                'unpaid': Decimal('0'),
+                'vat': Decimal('0')
             }
+        buckets = [monthly_data[month_key]]
         
-        if invoice.status == 'Paid':
-            monthly_data[month_key]['paid'] += float(invoice.total_amount)
-            monthly_data[month_key]['vat'] += float(invoice.vat_amount)
-        else:
-            monthly_data[month_key]['unpaid'] += float(invoice.total_amount)
-    
-    # Client breakdown (for Admin/Accountant only)
-    client_data = {}
-    if current_user.role.name in ['Admin', 'Accountant']:
-        for invoice in invoices:
-            client_name = invoice.client.name
+        # Client breakdown (for Admin/Accountant only)
+        if include_clients:
+            client_name = client_names.get(row.client_id)
             if client_name not in client_data:
                 client_data[client_name] = {
-                    'paid': 0,
-                    'unpaid': 0,
-                    'vat': 0
+                    'paid': Decimal('0'),
+                    'unpaid': Decimal('0'),
+                    'vat': Decimal('0')
                 }
-            
-            if invoice.status == 'Paid':
-                client_data[client_name]['paid'] += float(invoice.total_amount)
-                client_data[client_name]['vat'] += float(invoice.vat_amount)
-            else:
-                client_data[client_name]['unpaid'] += float(invoice.total_amount)
-    
-    # Get clients for filter dropdown
-    if current_user.role.name in ['Admin', 'Accountant']:
-        clients = Client.query.filter_by(status='Active').order_by(Client.name).all()
-    else:
-        clients = []
-    
-    return render_template('reports/revenue.html',
-                         invoices=invoices,
-                         total_revenue=float(total_revenue),
-                         total_outstanding=float(total_outstanding),
-                         total_vat=float(total_vat),
-                         monthly_data=list(monthly_data.values()),
-                         client_data=client_data,
-                         start_date=start_date,
-                         end_date=end_date,
-                         client_id=client_id,
-                         clients=clients)
-
-@reports_bp.route('/vat')
-@login_required
-def vat_report():
-    # Get date range from query parameters
-    start_date = request.args.get('start_date', type=str)
-    end_date = request.args.get('end_date', type=str)
-    client_id = request.args.get('client_id', type=int)
-    
-    # Default to current year if no dates provided
-    if not start_date or not end_date:
-        today = date.today()
-        start_date = today.replace(month=1, day=1).strftime('%Y-%m-%d')
-        end_date = today.strftime('%Y-%m-%d')
-    
-    start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').date()
-    end_date_obj = datetime.strptime(end_date, '%Y-%m-%d').date()
-    
-    # Base query filters based on user role
-    if current_user.role.name == 'Client':
-        client = Client.query.filter_by(created_by=current_user.id).first()
-        if client:
-            client_filter = VATCalculation.client_id == client.id
+            buckets.append(client_data[client_name])
+        
+        if row.status == 'Paid':
+            for bucket in buckets:
+                bucket['paid'] += row.total_amount
+                bucket['vat'] += row.vat_amount
         else:
-            client_filter = VATCalculation.client_id == -1  # No results
-    else:
-        client_filter = True
-    
-    # Build query
-    query = VATCalculation.query.filter(
-        and_(
-            VATCalculation.period_start >= start_date_obj,
-            VATCalculation.period_end <= end_date_obj,
-            client_filter
-        )
-    )
-    
-    # Apply client filter if specified
-    if client_id:
-        query = query.filter_by(client_id=client_id)
-    
-    vat_calculations = query.order_by(VATCalculation.period_start.desc()).all()
+            for bucket in buckets:
+                bucket['unpaid'] += row.total_amount
     
     # Calculate totals
-    total_output_vat = sum(calc.output_vat for calc in vat_calculations)
-    total_input_vat = sum(calc.input_vat for calc in vat_calculations)
-    total_net_vat = sum(calc.net_vat for calc in vat_calculations)
-    
-    # Get clients for filter dropdown
-    if current_user.role.name in ['Admin', 'Accountant']:
-        clients = Client.query.filter_by(status='Active').order_by(Client.name).all()
-    else:
-        clients = []
-    
-    return render_template('reports/vat.html',
-                         vat_calculations=vat_calculations,
-                         total_output_vat=float(total_output_vat),
-                         total_input_vat=float(total_input_vat),
-                         total_net_vat=float(total_net_vat),
-                         start_date=start_date,
-                         end_date=end_date,
-                         client_id=client_id,
-                         clients=clients)
+    total_revenue = Money.sum(bucket['paid'] for bucket in monthly_data.values())
+    total_outstanding = Money.sum(bucket['unpaid'] for bucket in monthly_data.values())
+    total_vat = Money.sum(bucket['vat'] for bucket in monthly_data.values())
+    
+    # Convert to riyals once for the charts
+    for bucket in list(monthly_data.values()) + list(client_data.values()):
+        for key in ['paid', 'unpaid', 'vat']:
+            bucket[key] = float(Money.parse(bucket[key]))
+    
+    return {
+        'total_revenue': float(total_revenue),
+        'total_outstanding': float(total_outstanding),
+        'total_vat': float(total_vat),
+        'monthly_data': list(monthly_data.values()),
+        'client_data': client_data
+    }
 
-@reports_bp.route('/zakat')
-@login_required
-def zakat_report():
-    # Get Hijri year from query parameters
+def revenue_export_row(invoice):
+    return [
+        invoice.invoice_number,
+        invoice.client.name,
+        invoice.issue_date.strftime('%Y-%m-%d'),
+        invoice.due_date.strftime('%Y-%m-%d') if invoice.due_date else '',
+        f"{invoice.subtotal:.2f}",
+        f"{invoice.vat_amount:.2f}",
+        f"{invoice.total_amount:.2f}",
+        invoice.status,
+        invoice.payment_date.strftime('%Y-%m-%d') if invoice.payment_date else ''
+    ]
+
+# VAT report
+
+VAT_EXPORT_COLUMNS = ['Client', 'Period Start', 'Period End', 'Total Sales (SAR)', 'Total Purchases (SAR)', 'Output VAT (SAR)', 'Input VAT (SAR)', 'Net VAT (SAR)', 'Status']
+
+def vat_params():
+    # Default to current year if no dates provided
+    params = _date_range_params(lambda today: today.replace(month=1, day=1))
+    params['client_id'] = request.args.get('client_id', type=int)
+    return params
+
+def _vat_filters(params, scope):
+    filters = [
+        VATCalculation.period_start >= date.fromisoformat(params['start_date']),
+        VATCalculation.period_end <= date.fromisoformat(params['end_date']),
+        _client_scope_filter(VATCalculation.client_id, scope)
+    ]
+    if params['client_id']:
+        filters.append(VATCalculation.client_id == params['client_id'])
+    return filters
+
+def vat_detail_query(params, scope):
+    return VATCalculation.query.options(joinedload(VATCalculation.client)).filter(
+        *_vat_filters(params, scope)
+    ).order_by(VATCalculation.period_start.desc())
+
+def vat_summary(params, scope):
+    totals = db.session.query(
+        func.sum(VATCalculation.output_vat),
+        func.sum(VATCalculation.input_vat),
+        func.sum(VATCalculation.net_vat)
+    ).filter(*_vat_filters(params, scope)).one()
+    
+    return {
+        'total_output_vat': float(Money.parse(totals[0])),
+        'total_input_vat': float(Money.parse(totals[1])),
+        'total_net_vat': float(Money.parse(totals[2]))
+    }
+
+def vat_export_row(calculation):
+    return [
+        calculation.client.name if calculation.client else '',
+        calculation.period_start.strftime('%Y-%m-%d'),
+        calculation.period_end.strftime('%Y-%m-%d'),
+        f"{calculation.total_sales:.2f}",
+        f"{calculation.total_purchases:.2f}",
+        f"{calculation.output_vat:.2f}",
+        f"{calculation.input_vat:.2f}",
+        f"{calculation.net_vat:.2f}",
+        calculation.status
+    ]
+
+# Zakat report
+
+ZAKAT_EXPORT_COLUMNS = ['Client', 'Hijri Year', 'Total Assets (SAR)', 'Liabilities (SAR)', 'Net Wealth (SAR)', 'Zakat Due (SAR)', 'Status']
+
+def zakat_params():
     hijri_year = request.args.get('hijri_year', type=str)
-    client_id = request.args.get('client_id', type=int)
     
     # Default to current Hijri year if not provided
     if not hijri_year:
         current_year = datetime.now().year
         hijri_year = f"{current_year - 622 + 1}H"
     
-    # Base query filters based on user role
-    if current_user.role.name == 'Client':
-        client = Client.query.filter_by(created_by=current_user.id).first()
-        if client:
-            client_filter = ZakatCalculation.client_id == client.id
-        else:
-            client_filter = ZakatCalculation.client_id == -1  # No results
-    else:
-        client_filter = True
-    
-    # Build query
-    query = ZakatCalculation.query.filter(
-        and_(
-            ZakatCalculation.hijri_year == hijri_year,
-            client_filter
-        )
+    return {'hijri_year': hijri_year, 'client_id': request.args.get('client_id', type=int)}
+
+def _zakat_filters(params, scope):
+    filters = [
+        ZakatCalculation.hijri_year == params['hijri_year'],
+        _client_scope_filter(ZakatCalculation.client_id, scope)
+    ]
+    if params['client_id']:
+        filters.append(ZakatCalculation.client_id == params['client_id'])
+    return filters
+
+def zakat_detail_query(params, scope):
+    return ZakatCalculation.query.options(joinedload(ZakatCalculation.client)).filter(
+        *_zakat_filters(params, scope)
+    ).order_by(ZakatCalculation.created_at.desc())
+
+def zakat_summary(params, scope):
+    totals = db.session.query(
+        func.sum(ZakatCalculation.total_assets),
+        func.sum(ZakatCalculation.liabilities),
+        func.sum(ZakatCalculation.net_wealth),
+        func.sum(ZakatCalculation.zakat_due)
+    ).filter(*_zakat_filters(params, scope)).one()
+    
+    return {
+        'total_assets': float(Money.parse(totals[0])),
+        'total_liabilities': float(Money.parse(totals[1])),
+        'total_net_wealth': float(Money.parse(totals[2])),
+        'total_zakat_due': float(Money.parse(totals[3]))
+    }
+
+def zakat_export_row(calculation):
+    return [
+        calculation.client.name if calculation.client else '',
+        calculation.hijri_year,
+        f"{calculation.total_assets:.2f}",
+        f"{calculation.liabilities or 0:.2f}",
+        f"{calculation.net_wealth:.2f}",
+        f"{calculation.zakat_due:.2f}",
+        calculation.status
+    ]
+
+# Tasks report
+
+TASK_EXPORT_COLUMNS = ['Title', 'Client', 'Type', 'Priority', 'Status', 'Due Date', 'Assigned To', 'Created']
+
+def tasks_params():
+    # Default to current month if no dates provided
+    params = _date_range_params(lambda today: today.replace(day=1))
+    params['status'] = request.args.get('status', type=str)
+    params['assigned_to'] = request.args.get('assigned_to', type=int)
+    return params
+
+def _task_source(params):
+    return task_source(date.fromisoformat(params['start_date']), date.fromisoformat(params['end_date']))
+
+def _task_filters(tasks, params, scope):
+    filters = [
+        tasks.created_at >= datetime.combine(date.fromisoformat(params['start_date']), datetime.min.time()),
+        tasks.created_at <= datetime.combine(date.fromisoformat(params['end_date']), datetime.max.time())
+    ]
+    
+    # Clients see their own tasks; accountants those assigned to or created by them
+    if 'client_id' in scope:
+        filters.append(tasks.client_id == scope['client_id'])
+    elif 'user_id' in scope:
+        filters.append((tasks.assigned_to == scope['user_id']) | (tasks.created_by == scope['user_id']))
+    
+    if params['status']:
+        filters.append(tasks.status == params['status'])
+    if params['assigned_to']:
+        filters.append(tasks.assigned_to == params['assigned_to'])
+    return filters
+
+def tasks_detail_query(params, scope):
+    tasks = _task_source(params)
+    return db.session.query(tasks).options(
+        joinedload(tasks.client),
+        joinedload(tasks.assigned_user)
+    ).filter(*_task_filters(tasks, params, scope)).order_by(tasks.created_at.desc(), tasks.id.desc())
+
+def tasks_summary(params, scope):
+    """Status counts, overdue count and type breakdown from one grouped query"""
+    tasks = _task_source(params)
+    overdue = case(
+        (and_(tasks.due_date < date.today(), or_(tasks.status.is_(None), tasks.status != 'Completed')), 1),
+        else_=0
     )
     
-    # Apply client filter if specified
-    if client_id:
-        query = query.filter_by(client_id=client_id)
-    
-    zakat_calculations = query.order_by(ZakatCalculation.created_at.desc()).all()
+    rows = db.session.query(
+        tasks.status,
+        tasks.task_type,
+        func.count(tasks.id),
+        func.sum(overdue)
+    ).filter(*_task_filters(tasks, params, scope)).group_by(tasks.status, tasks.task_type)
     
-    # Calculate totals
-    total_assets = sum(calc.total_assets for calc in zakat_calculations)
-    total_liabilities = sum(calc.liabilities for calc in zakat_calculations)
-    total_net_wealth = sum(calc.net_wealth for calc in zakat_calculations)
-    total_zakat_due = sum(calc.zakat_due for calc in zakat_calculations)
-    
-    # Get clients for filter dropdown
-    if current_user.role.name in ['Admin', 'Accountant']:
-        clients = Client.query.filter_by(status='Active').order_by(Client.name).all()
-    else:
-        clients = []
-    
-    return render_template('reports/zakat.html',
-                         zakat_calculations=zakat_calculations,
-                         total_assets=float(total_assets),
-                         total_liabilities=float(total_liabilities),
-                         total_net_wealth=float(total_net_wealth),
-                         total_zakat_due=float(total_zakat_due),
-                         hijri_year=hijri_year,
-                         client_id=client_id,
-                         clients=clients)
+    status_counts = {}
+    task_type_data = {}
+    overdue_tasks = 0
+    for status, task_type, count, overdue_count in rows:
+        status_counts[status] = status_counts.get(status, 0) + count
+        overdue_tasks += int(overdue_count or 0)
+        
+        # Task type breakdown
+        task_type = task_type or 'General'
+        task_type_data[task_type] = task_type_data.get(task_type, 0) + count
+    
+    return {
+        'total_tasks': sum(status_counts.values()),
+        'completed_tasks': status_counts.get('Completed', 0),
+        'pending_tasks': status_counts.get('Pending', 0),
+        'in_progress_tasks': status_counts.get('In Progress', 0),
+        'overdue_tasks': overdue_tasks,
+        'task_type_data': task_type_data
+    }
+
+def task_export_row(task):
+    return [
+        task.title,
+        task.client.name if task.client else '',
+        task.task_type or 'General',
+        task.priority,
+        task.status,
+        task.due_date.strftime('%Y-%m-%d') if task.due_date else '',
+        f"{task.assigned_user.first_name} {task.assigned_user.last_name}" if task.assigned_user else '',
+        task.created_at.strftime('%Y-%m-%d')
+    ]
+
+# Report name -> how to render, summarise and export it; reports with
+# per_page show their detail rows a page at a time
+REPORTS = {
+    'revenue': {
+        'template': 'reports/revenue.html',
+        'detail': 'invoices',
+        'query': revenue_detail_query,
+        'summary': revenue_summary,
+        'depends_on': ('invoices', 'clients'),
+        'columns': REVENUE_EXPORT_COLUMNS,
+        'row': revenue_export_row
+    },
+    'vat': {
+        'template': 'reports/vat.html',
+        'detail': 'vat_calculations',
+        'query': vat_detail_query,
+        'summary': vat_summary,
+        'depends_on': ('vat', 'clients'),
+        'columns': VAT_EXPORT_COLUMNS,
+        'row': vat_export_row
+    },
+    'zakat': {
+        'template': 'reports/zakat.html',
+        'detail': 'zakat_calculations',
+        'query': zakat_detail_query,
+        'summary': zakat_summary,
+        'depends_on': ('zakat', 'clients'),
+        'columns': ZAKAT_EXPORT_COLUMNS,
+        'row': zakat_export_row
+    },
+    'tasks': {
+        'template': 'reports/tasks.html',
+        'detail': 'tasks',
+        'per_page': 50,
+        'query': tasks_detail_query,
+        'summary': tasks_summary,
+        'depends_on': ('tasks', 'clients'),
+        'columns': TASK_EXPORT_COLUMNS,
+        'row': task_export_row
+    }
+}
+
+def compute_report(report, params, scope):
+    """Summary and streamed export rows for a report; runs without a request"""
+    definition = REPORTS[report]
+    rows = (definition['row'](item) for item in definition['query'](params, scope).yield_per(1000))
+    return definition['summary'](params, scope), definition['columns'], rows
+
+def report_detail(definition, query):
+    """The detail rows for a report page: one page of them, or all"""
+    if definition.get('per_page'):
+        page = request.args.get('page', 1, type=int)
+        return query.paginate(page=page, per_page=definition['per_page'], error_out=False)
+    return query.all()
+
+def render_report(report, params):
+    """Render a report inline, or hand a large one to a background job"""
+    definition = REPORTS[report]
+    scope = report_scope(report)
+    query = definition['query'](params, scope)
+    
+    row_count = cached_report(f'{report}:count', params, scope, definition['depends_on'],
+                              lambda: query.order_by(None).count())
+    if request.args.get('mode') == 'async' or row_count > ASYNC_ROW_THRESHOLD:
+        job = find_or_start_job(report, params, scope, compute_report, current_user.id)
+        return redirect(url_for('reports.report_job', job_id=job.id))
+    
+    # Copy, as the cached summary may be shared with other requests
+    context = dict(cached_report(report, params, scope, definition['depends_on'],
+                                 lambda: definition['summary'](params, scope)))
+    context[definition['detail']] = report_detail(definition, query)
+    context.update(params)
+    context.update(_filter_choices(report))
+    
+    return render_template(definition['template'], **context)
+
+@reports_bp.route('/revenue')
+@login_required
+def revenue_report():
+    return render_report('revenue', revenue_params())
+
+@reports_bp.route('/vat')
+@login_required
+def vat_report():
+    return render_report('vat', vat_params())
+
+@reports_bp.route('/zakat')
+@login_required
+def zakat_report():
+    return render_report('zakat', zakat_params())
 
 @reports_bp.route('/tasks')
 @login_required
 def tasks_report():
-    # Get date range from query parameters
-    start_date = request.args.get('start_date', type=str)
-    end_date = request.args.get('end_date', type=str)
-    status = request.args.get('status', type=str)
-    assigned_to = request.args.get('assigned_to', type=int)
-    
-    # Default to current month if no dates provided
-    if not start_date or not end_date:
-        today = date.today()
-        start_date = today.replace(day=1).strftime('%Y-%m-%d')
-        end_date = today.strftime('%Y-%m-%d')
-    
-    start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').date()
-    end_date_obj = datetime.strptime(end_date, '%Y-%m-%d').date()
-    
-    # Base query filters based on user role
-    if current_user.role.name == 'Client':
-        client = Client.query.filter_by(created_by=current_user.id).first()
-        if client:
-            task_filter = Task.client_id == client.id
-        else:
-            task_filter = Task.client_id == -1  # No results
-    elif current_user.role.name == 'Accountant':
-        task_filter = (Task.assigned_to == current_user.id) | (Task.created_by == current_user.id)
-    else:
-        task_filter = True
-    
-    # Build query
-    query = Task.query.filter(
-        and_(
-            Task.created_at >= datetime.combine(start_date_obj, datetime.min.time()),
-            Task.created_at <= datetime.combine(end_date_obj, datetime.max.time()),
-            task_filter
-        )
-    )
+    return render_report('tasks', tasks_params())
+
+def get_report_job(job_id):
+    """A job the current user may see, or None if it is unknown, expired or out of scope"""
+    if not job_id.isalnum():
+        return None
+    job = db.session.get(ReportJob, job_id)
+    if not job or job.expires_at <= datetime.utcnow():
+        return None
+    if json.loads(job.scope) != report_scope(job.report):
+        return None
+    return job
+
+@reports_bp.route('/jobs/<job_id>')
+@login_required
+def report_job(job_id):
+    job = get_report_job(job_id)
     
-    # Apply filters
-    if status:
-        query = query.filter_by(status=status)
+    if request.args.get('format') == 'json':
+        # Polled by the pending page until the report is ready
+        if not job:
+            return jsonify({'success': False, 'error': 'Report not found or expired.'}), 404
+        return jsonify({
+            'success': True,
+            'status': job.status,
+            'ready': job.status == 'Ready',
+            'row_count': job.row_count,
+            'error': job.error,
+            'view_url': url_for('reports.report_job', job_id=job.id),
+            'export_url': url_for('reports.report_job_export', job_id=job.id)
+        })
     
-    if assigned_to:
-        query = query.filter_by(assigned_to=assigned_to)
+    if not job:
+        flash('Report not found or expired. Please run it again.', 'error')
+        return redirect(url_for('reports.index'))
     
-    tasks = query.order_by(Task.created_at.desc()).all()
+    if job.status == 'Failed':
+        flash('The report could not be generated. Please try again.', 'error')
+        return redirect(url_for('reports.index'))
     
-    # Calculate statistics
-    total_tasks = len(tasks)
-    completed_tasks = len([t for t in tasks if t.status == 'Completed'])
-    pending_tasks = len([t for t in tasks if t.status == 'Pending'])
-    in_progress_tasks = len([t for t in tasks if t.status == 'In Progress'])
-    overdue_tasks = len([t for t in tasks if t.due_date and t.due_date < date.today() and t.status != 'Completed'])
+    if job.status != 'Ready':
+        return render_template('reports/job_pending.html', job=job)
     
-    # Task type breakdown
-    task_type_data = {}
-    for task in tasks:
-        task_type = task.task_type or 'General'
-        if task_type not in task_type_data:
-            task_type_data[task_type] = 0
-        task_type_data[task_type] += 1
-    
-    # Get users for filter dropdown
-    if current_user.role.name in ['Admin', 'Accountant']:
-        from models import User
-        users = User.query.filter(User.role.has(name__in=['Admin', 'Accountant'])).order_by(User.first_name).all()
+    # Large reports show their summary, and a page of rows when paged;
+    # the full detail is in the export
+    definition = REPORTS[job.report]
+    context = json.loads(job.result)
+    if definition.get('per_page'):
+        context[definition['detail']] = report_detail(
+            definition, definition['query'](json.loads(job.params), json.loads(job.scope))
+        )
     else:
-        users = []
-    
-    return render_template('reports/tasks.html',
-                         tasks=tasks,
-                         total_tasks=total_tasks,
-                         completed_tasks=completed_tasks,
-                         pending_tasks=pending_tasks,
-                         in_progress_tasks=in_progress_tasks,
-                         overdue_tasks=overdue_tasks,
-                         task_type_data=task_type_data,
-                         start_date=start_date,
-                         end_date=end_date,
-                         status=status,
-                         assigned_to=assigned_to,
-                         users=users)
+        context[definition['detail']] = []
+    context.update(json.loads(job.params))
+    context.update(_filter_choices(job.report))
+    
+    return render_template(definition['template'], job=job, **context)
+
+@reports_bp.route('/jobs/<job_id>/export')
+@login_required
+def report_job_export(job_id):
+    job = get_report_job(job_id)
+    if not job or job.status != 'Ready':
+        flash('Report not found or not ready yet.', 'error')
+        return redirect(url_for('reports.index'))
+    
+    return send_file(report_export_path(job.id), mimetype='text/csv', as_attachment=True,
+                     download_name=f'{job.report}_report_{job.id}.csv')
 
 @reports_bp.route('/export/revenue')
 @login_required
 def export_revenue_csv():
-    # Get same parameters as revenue report
-    start_date = request.args.get('start_date', type=str)
-    end_date = request.args.get('end_date', type=str)
-    client_id = request.args.get('client_id', type=int)
+    # Same parameters and scope as the revenue report
+    params = revenue_params()
+    query = revenue_detail_query(params, report_scope('revenue'))
+    rows = (revenue_export_row(invoice) for invoice in query.yield_per(1000))
     
-    if not start_date or not end_date:
-        today = date.today()
-        start_date = today.replace(day=1).strftime('%Y-%m-%d')
-        end_date = today.strftime('%Y-%m-%d')
+    response = Response(stream_with_context(stream_csv(rows, REVENUE_EXPORT_COLUMNS)), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename=revenue_report_{params["start_date"]}_to_{params["end_date"]}.csv'
     
-    start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').date()
-    end_date_obj = datetime.strptime(end_date, '%Y-%m-%d').date()
+    return response
+
+# Receivables aging buckets: (key, label, first day overdue, last day overdue)
+AGING_BUCKETS = [
+    ('current', 'Current', None, 0),
+    ('days_1_30', '1-30 Days', 1, 30),
+    ('days_31_60', '31-60 Days', 31, 60),
+    ('days_61_90', '61-90 Days', 61, 90),
+    ('days_over_90', '90+ Days', 91, None),
+]
+
+# Invoices per page when drilling into an aging bucket
+AGING_PAGE_SIZE = 50
+
+def aging_bucket_condition(key, as_of):
+    """Range predicate on due_date for an aging bucket, usable with the due_date index"""
+    for bucket_key, label, first_day, last_day in AGING_BUCKETS:
+        if bucket_key != key:
+            continue
+        if first_day is None:
+            # Not yet due, or no due date at all
+            return or_(Invoice.due_date.is_(None), Invoice.due_date >= as_of)
+        condition = Invoice.due_date <= as_of - timedelta(days=first_day)
+        if last_day is not None:
+            condition = and_(condition, Invoice.due_date >= as_of - timedelta(days=last_day))
+        return condition
+    return None
+
+def open_invoice_query():
+    """
+    Unpaid invoices joined to their client and payments, scoped to the
+    current user's role. Returns the query and the open balance expression;
+    callers pick their columns with with_entities().
+    """
+    paid = db.session.query(
+        Payment.invoice_id,
+        func.sum(Payment.amount).label('paid')
+    ).group_by(Payment.invoice_id).subquery()
+    
+    open_amount = Invoice.total_amount - func.coalesce(paid.c.paid, 0)
+    
+    query = db.session.query(Invoice.id).join(
+        Client, Client.id == Invoice.client_id
+    ).outerjoin(
+        paid, paid.c.invoice_id == Invoice.id
+    ).filter(Invoice.status != 'Paid')
     
     # Base query filters based on user role
     if current_user.role.name == 'Client':
         client = Client.query.filter_by(created_by=current_user.id).first()
         if client:
-            client_filter = Invoice.client_id == client.id
+            query = query.filter(Invoice.client_id == client.id)
         else:
-            client_filter = Invoice.client_id == -1
+            query = query.filter(Invoice.client_id == -1)  # No results
     else:
-        client_filter = True
-    
-    query = Invoice.query.filter(
-        and_(
-            Invoice.issue_date >= start_date_obj,
-            Invoice.issue_date <= end_date_obj,
-            client_filter
-        )
-    )
+        client_id = request.args.get('client_id', type=int)
+        if client_id:
+            query = query.filter(Invoice.client_id == client_id)
     
-    if client_id:
-        query = query.filter_by(client_id=client_id)
-    
-    invoices = query.order_by(Invoice.issue_date.desc()).all()
-    
-    # Prepare data for CSV
-    columns = ['Invoice Number', 'Client', 'Issue Date', 'Due Date', 'Subtotal (SAR)', 'VAT (SAR)', 'Total (SAR)', 'Status', 'Payment Date']
-    data = []
-    
-    for invoice in invoices:
-        data.append([
-            invoice.invoice_number,
-            invoice.client.name,
-            invoice.issue_date.strftime('%Y-%m-%d'),
-            invoice.due_date.strftime('%Y-%m-%d') if invoice.due_date else '',
-            f"{invoice.subtotal:.2f}",
-            f"{invoice.vat_amount:.2f}",
-            f"{invoice.total_amount:.2f}",
-            invoice.status,
-            invoice.payment_date.strftime('%Y-%m-%d') if invoice.payment_date else ''
-        ])
+    return query, open_amount
+
+def get_aging_date():
+    as_of = request.args.get('as_of', type=str)
+    if as_of:
+        try:
+            return datetime.strptime(as_of, '%Y-%m-%d').date()
+        except ValueError:
+            pass
+    return date.today()
+
+@reports_bp.route('/aging')
+@login_required
+def aging_report():
+    as_of = get_aging_date()
+    
+    query, open_amount = open_invoice_query()
+    
+    # One grouped scan with a conditional sum per bucket
+    bucket_columns = [
+        func.sum(case((aging_bucket_condition(key, as_of), open_amount), else_=0)).label(key)
+        for key, label, first_day, last_day in AGING_BUCKETS
+    ]
+    
+    rows = query.with_entities(
+        Invoice.client_id,
+        Client.name.label('client_name'),
+        func.count(Invoice.id).label('invoice_count'),
+        func.sum(open_amount).label('total'),
+        *bucket_columns
+    ).group_by(Invoice.client_id, Client.name).order_by(Client.name).all()
+    
+    aging_data = []
+    totals = {key: 0.0 for key, label, first_day, last_day in AGING_BUCKETS}
+    totals['total'] = 0.0
+    for row in rows:
+        entry = {
+            'client_id': row.client_id,
+            'client_name': row.client_name,
+            'invoice_count': row.invoice_count,
+            'total': float(row.total or 0)
+        }
+        for key, label, first_day, last_day in AGING_BUCKETS:
+            entry[key] = float(getattr(row, key) or 0)
+            totals[key] += entry[key]
+        totals['total'] += entry['total']
+        aging_data.append(entry)
     
-    csv_content = export_to_csv(data, columns)
+    # Get clients for filter dropdown
+    if current_user.role.name in ['Admin', 'Accountant']:
+        clients = client_options(request.args.get('client_id', type=int))
+    else:
+        clients = []
     
-    response = make_response(csv_content)
-    response.headers['Content-Type'] = 'text/csv'
-    response.headers['Content-Disposition'] = f'attachment; filename=revenue_report_{start_date}_to_{end_date}.csv'
+    return render_template('reports/aging.html',
+                         aging_data=aging_data,
+                         totals=totals,
+                         buckets=AGING_BUCKETS,
+                         as_of=as_of.strftime('%Y-%m-%d'),
+                         client_id=request.args.get('client_id', type=int),
+                         clients=clients,
+                         client_search_url=client_typeahead_url())
+
+@reports_bp.route('/aging/<bucket>')
+@login_required
+def aging_bucket(bucket):
+    """Drill into one aging bucket with keyset pagination on invoice id"""
+    as_of = get_aging_date()
+    condition = aging_bucket_condition(bucket, as_of)
+    if condition is None:
+        flash('Unknown aging bucket.', 'error')
+        return redirect(url_for('reports.aging_report'))
+    
+    after = request.args.get('after', 0, type=int)
+    
+    query, open_amount = open_invoice_query()
+    
+    rows = query.with_entities(
+        Invoice.id,
+        Invoice.invoice_number,
+        Invoice.issue_date,
+        Invoice.due_date,
+        Invoice.total_amount,
+        Invoice.status,
+        Client.name.label('client_name'),
+        open_amount.label('open_amount')
+    ).filter(
+        condition,
+        Invoice.id > after
+    ).order_by(Invoice.id).limit(AGING_PAGE_SIZE + 1).all()
+    
+    has_more = len(rows) > AGING_PAGE_SIZE
+    invoices = rows[:AGING_PAGE_SIZE]
+    
+    return render_template('reports/aging_bucket.html',
+                         invoices=invoices,
+                         bucket=bucket,
+                         bucket_label=dict((key, label) for key, label, first_day, last_day in AGING_BUCKETS)[bucket],
+                         as_of=as_of.strftime('%Y-%m-%d'),
+                         client_id=request.args.get('client_id', type=int),
+                         next_after=invoices[-1].id if has_more else None)
+
+@reports_bp.route('/export/aging')
+@login_required
+def export_aging_csv():
+    as_of = get_aging_date()
+    
+    query, open_amount = open_invoice_query()
+    
+    rows = query.with_entities(
+        Invoice.invoice_number,
+        Client.name.label('client_name'),
+        Invoice.issue_date,
+        Invoice.due_date,
+        open_amount.label('open_amount')
+    ).order_by(Client.name, Invoice.due_date).yield_per(1000)
+    
+    def aging_rows():
+        for row in rows:
+            days_overdue = (as_of - row.due_date).days if row.due_date else 0
+            if days_overdue <= 0:
+                label = AGING_BUCKETS[0][1]
+            else:
+                label = next(
+                    label for key, label, first_day, last_day in AGING_BUCKETS[1:]
+                    if last_day is None or days_overdue <= last_day
+                )
+            yield [
+                row.invoice_number,
+                row.client_name,
+                row.issue_date.strftime('%Y-%m-%d'),
+                row.due_date.strftime('%Y-%m-%d') if row.due_date else '',
+                max(days_overdue, 0),
+                label,
+                f"{row.open_amount:.2f}"
+            ]
+    
+    columns = ['Invoice Number', 'Client', 'Issue Date', 'Due Date', 'Days Overdue', 'Bucket', 'Open Amount (SAR)']
+    
+    response = Response(stream_with_context(stream_csv(aging_rows(), columns)), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename=aging_report_{as_of.strftime("%Y-%m-%d")}.csv'
     
     return response
 
@@ -397,39 +761,38 @@ def api_dashboard_data():
         if current_user.role.name == 'Client':
             client = Client.query.filter_by(created_by=current_user.id).first()
             if client:
-                client_filter = Invoice.client_id == client.id
+                rollup_filter = InvoiceDailyRollup.client_id == client.id
             else:
-                client_filter = Invoice.client_id == -1
+                rollup_filter = InvoiceDailyRollup.client_id == -1
         else:
-            client_filter = True
+            rollup_filter = True
         
-        # Get monthly revenue data
-        monthly_revenue = db.session.query(
-            extract('year', Invoice.issue_date).label('year'),
-            extract('month', Invoice.issue_date).label('month'),
-            func.sum(Invoice.total_amount).label('total')
+        # Monthly revenue from the daily rollups
+        
+        daily_revenue = db.session.query(
+            InvoiceDailyRollup.day,
+            func.sum(InvoiceDailyRollup.total_amount).label('total')
         ).filter(
             and_(
-                Invoice.issue_date >= six_months_ago,
-                Invoice.status == 'Paid',
-                client_filter
+                InvoiceDailyRollup.day >= six_months_ago,
+                InvoiceDailyRollup.status == 'Paid',
+                rollup_filter
             )
-        ).group_by(
-            extract('year', Invoice.issue_date),
-            extract('month', Invoice.issue_date)
-        ).order_by(
-            extract('year', Invoice.issue_date),
-            extract('month', Invoice.issue_date)
-        ).all()
+        ).group_by(InvoiceDailyRollup.day).order_by(InvoiceDailyRollup.day).all()
+        
+        monthly_revenue = {}
+        for item in daily_revenue:
+            month_key = (item.day.year, item.day.month)
+            monthly_revenue[month_key] = monthly_revenue.get(month_key, Decimal('0')) + item.total
         
         # Format data for charts
         revenue_labels = []
         revenue_data = []
         
-        for item in monthly_revenue:
-            month_name = calendar.month_abbr[int(item.month)]
-            revenue_labels.append(f"{month_name} {int(item.year)}")
-            revenue_data.append(float(item.total or 0))
+        for (year, month), total in monthly_revenue.items():
+            month_name = calendar.month_abbr[month]
+            revenue_labels.append(f"{month_name} {year}")
+            revenue_data.append(float(Money.parse(total)))
         
         # Task status distribution
         if current_user.role.name == 'Client':
@@ -466,9 +829,54 @@ def api_dashboard_data():
                 'data': task_data
             }
         })
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@reports_bp.route('/api/revenue-timeseries')
+@login_required
+def api_revenue_timeseries():
+    """Gap-filled revenue series for charts at a chosen granularity"""
+    try:
+        today = date.today()
+        end_date = request.args.get('end', type=str)
+        start_date = request.args.get('start', type=str)
+        end_date = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else today
+        start_date = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else end_date - timedelta(days=180)
         
+        granularity = request.args.get('granularity', 'month', type=str)
+        metrics = [metric.strip() for metric in request.args.get('metrics', 'paid', type=str).split(',') if metric.strip()]
+        
+        # Clients only see their own series; staff may narrow to one client
+        if current_user.role.name == 'Client':
+            client = Client.query.filter_by(created_by=current_user.id).first()
+            client_id = client.id if client else -1
+        else:
+            client_id = request.args.get('client_id', type=int)
+        
+        result = revenue_timeseries(start_date, end_date, granularity, metrics or ['paid'], client_id)
+        
+        return jsonify({
+            'success': True,
+            'start': start_date.isoformat(),
+            'end': end_date.isoformat(),
+            **result
+        })
+    
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 400
+
+@reports_bp.route('/api/cache-stats')
+@login_required
+def api_cache_stats():
+    """Report cache hit/miss counters for this process"""
+    if current_user.role.name != 'Admin':
+        return jsonify({'success': False, 'error': 'You do not have permission to view cache statistics.'}), 403
+    
+    return jsonify({'success': True, **cache_stats()})
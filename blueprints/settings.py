@@ -1,10 +1,13 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, Response, stream_with_context
 from flask_login import login_required, current_user
 from app import db
-from models import Company
-from forms import CompanySettingsForm
+from models import Company, BackupSnapshot
+from forms import CompanySettingsForm, BackupRestoreForm
 from utils import save_uploaded_file
+from backup import start_backup, stream_backup, restore_backup, last_snapshot
+from datetime import date
 import os
+import tarfile
 
 settings_bp = Blueprint('settings', __name__)
 
@@ -139,7 +142,57 @@ def backup():
         flash('You do not have permission to access backup settings.', 'error')
         return redirect(url_for('settings.index'))
     
-    return render_template('settings/backup.html')
+    snapshots = BackupSnapshot.query.order_by(BackupSnapshot.started_at.desc().nullslast()).limit(20).all()
+    return render_template('settings/backup.html',
+                         snapshots=snapshots,
+                         last_snapshot=last_snapshot(),
+                         form=BackupRestoreForm())
+
+@settings_bp.route('/backup/download')
+@login_required
+def download_backup():
+    """Stream a full backup, or an incremental one with incremental=1"""
+    if current_user.role.name != 'Admin':
+        flash('You do not have permission to access backup settings.', 'error')
+        return redirect(url_for('settings.index'))
+    
+    incremental = request.args.get('incremental', 0, type=int) == 1
+    try:
+        snapshot_id = start_backup(incremental)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('settings.backup'))
+    
+    kind = 'incremental' if incremental else 'full'
+    response = Response(stream_with_context(stream_backup(snapshot_id)), mimetype='application/x-tar')
+    response.headers['Content-Disposition'] = f"attachment; filename=backup_{date.today().strftime('%Y-%m-%d')}_{kind}_{snapshot_id[:8]}.tar"
+    
+    return response
+
+@settings_bp.route('/backup/restore', methods=['POST'])
+@login_required
+def restore():
+    if current_user.role.name != 'Admin':
+        flash('You do not have permission to access backup settings.', 'error')
+        return redirect(url_for('settings.index'))
+    
+    # Backups are far larger than ordinary uploads; the file is spooled to disk
+    request.max_content_length = current_app.config['BACKUP_MAX_CONTENT_LENGTH']
+    
+    form = BackupRestoreForm()
+    if not form.validate_on_submit():
+        flash('Please choose a backup file and confirm the restore.', 'error')
+        return redirect(url_for('settings.backup'))
+    
+    try:
+        snapshot_id, row_count, file_count = restore_backup(form.file.data.stream)
+    except (ValueError, tarfile.TarError, EOFError) as e:
+        message = str(e) if isinstance(e, ValueError) else 'The backup file could not be read.'
+        flash(message, 'error')
+        return redirect(url_for('settings.backup'))
+    
+    flash(f'Backup restored successfully! {row_count} rows and {file_count} files were loaded.', 'success')
+    return redirect(url_for('settings.backup'))
 
 @settings_bp.route('/notifications')
 @login_required
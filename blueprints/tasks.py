@@ -1,9 +1,13 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
 from app import db
-from models import Task, Client, User
+from models import Task, Client, User, Role
 from forms import TaskForm
-from datetime import date, datetime, timedelta
+from utils import get_bulk_ids, get_bulk_param, bulk_response, bulk_error
+from live import queue_task_status_changes
+from choices import staff_choices, set_staff_choices, set_client_choices
+from task_dashboard import BUCKETS, task_dashboard, task_dashboard_page
+from datetime import datetime
 
 tasks_bp = Blueprint('tasks', __name__)
 
@@ -55,7 +59,7 @@ def index():
     
     # Get users for filter dropdown (only for Admin/Accountant)
     if current_user.role.name in ['Admin', 'Accountant']:
-        users = User.query.filter(User.role.has(name__in=['Admin', 'Accountant'])).order_by(User.first_name).all()
+        users = staff_choices()
     else:
         users = []
     
@@ -77,11 +81,8 @@ def add():
     form = TaskForm()
     
     # Populate choices
-    users = User.query.filter(User.role.has(name__in=['Admin', 'Accountant'])).order_by(User.first_name).all()
-    form.assigned_to.choices = [('', 'Unassigned')] + [(u.id, f"{u.first_name} {u.last_name}") for u in users]
-    
-    clients = Client.query.filter_by(status='Active').order_by(Client.name).all()
-    form.client_id.choices = [('', 'No Client')] + [(c.id, c.name) for c in clients]
+    set_staff_choices(form.assigned_to, blank=('', 'Unassigned'))
+    set_client_choices(form.client_id, blank=('', 'No Client'))
     
     if form.validate_on_submit():
         task = Task(
@@ -138,11 +139,8 @@ def edit(id):
     form = TaskForm(obj=task)
     
     # Populate choices
-    users = User.query.filter(User.role.has(name__in=['Admin', 'Accountant'])).order_by(User.first_name).all()
-    form.assigned_to.choices = [('', 'Unassigned')] + [(u.id, f"{u.first_name} {u.last_name}") for u in users]
-    
-    clients = Client.query.filter_by(status='Active').order_by(Client.name).all()
-    form.client_id.choices = [('', 'No Client')] + [(c.id, c.name) for c in clients]
+    set_staff_choices(form.assigned_to, blank=('', 'Unassigned'))
+    set_client_choices(form.client_id, blank=('', 'No Client'))
     
     if form.validate_on_submit():
         form.populate_obj(task)
@@ -210,56 +208,166 @@ def mark_complete(id):
     flash('Task marked as completed!', 'success')
     return redirect(url_for('tasks.view', id=id))
 
+# Bulk filters that hold record ids, with the name used in error messages
+BULK_ID_FILTERS = {'client_id': 'client', 'assigned_to': 'assignee'}
+
+def _bulk_update_tasks(values, owner_only=False, skip_status=None):
+    """Apply one scoped UPDATE to the selected tasks and report per-id results.
+    
+    Accountants may only touch tasks assigned to or created by them, or only
+    tasks they created when owner_only is set (the same rule as edit/delete).
+    Raises ValueError when neither ids nor a valid filter are given.
+    """
+    requested_ids, invalid_ids = get_bulk_ids(request)
+    query = db.session.query(Task.id, Task.title, Task.status, Task.client_id, Task.assigned_to, Task.created_by)
+    
+    if requested_ids or invalid_ids:
+        query = query.filter(Task.id.in_(requested_ids))
+    else:
+        # Fall back to a filter so a whole batch of filings can be closed at once
+        filters = {}
+        for name in ['status', 'priority', 'task_type', 'client_id', 'assigned_to']:
+            value = get_bulk_param(request, name)
+            if not value:
+                continue
+            if name in BULK_ID_FILTERS:
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    raise ValueError(f'Invalid {BULK_ID_FILTERS[name]} filter.')
+            filters[name] = value
+        if not filters:
+            raise ValueError('Select tasks or provide a filter.')
+        query = query.filter_by(**filters)
+    
+    found = {row.id: row for row in query.all()}
+    
+    results = {invalid_id: 'invalid_id' for invalid_id in invalid_ids}
+    update_ids = []
+    for task_id in (requested_ids or found.keys()):
+        task = found.get(task_id)
+        if task is None:
+            results[task_id] = 'not_found'
+        elif current_user.role.name == 'Accountant' and (
+            task.created_by != current_user.id if owner_only
+            else current_user.id not in (task.assigned_to, task.created_by)
+        ):
+            results[task_id] = 'forbidden'
+        elif skip_status and task.status == skip_status:
+            results[task_id] = 'unchanged'
+        else:
+            results[task_id] = 'updated'
+            update_ids.append(task_id)
+    
+    if update_ids:
+        if Task.status in values:
+            queue_task_status_changes(db.session, [found[task_id] for task_id in update_ids], values[Task.status])
+        Task.query.filter(Task.id.in_(update_ids)).update(values, synchronize_session=False)
+        db.session.commit()
+    
+    return results
+
+@tasks_bp.route('/bulk/complete', methods=['POST'])
+@login_required
+def bulk_complete():
+    if current_user.role.name not in ['Admin', 'Accountant']:
+        return bulk_error(request, 'You do not have permission to complete tasks.',
+                          url_for('tasks.index'), 403)
+    
+    try:
+        results = _bulk_update_tasks(
+            {Task.status: 'Completed', Task.completed_at: datetime.utcnow()},
+            skip_status='Completed'
+        )
+    except ValueError as e:
+        return bulk_error(request, str(e), url_for('tasks.index'))
+    
+    return bulk_response(request, results, url_for('tasks.index'), 'tasks')
+
+@tasks_bp.route('/bulk/reassign', methods=['POST'])
+@login_required
+def bulk_reassign():
+    if current_user.role.name not in ['Admin', 'Accountant']:
+        return bulk_error(request, 'You do not have permission to reassign tasks.',
+                          url_for('tasks.index'), 403)
+    
+    assigned_to = get_bulk_param(request, 'assigned_to_user')
+    if assigned_to:
+        try:
+            assigned_to = int(assigned_to)
+        except (TypeError, ValueError):
+            assigned_to = None
+        assignee = User.query.filter(
+            User.id == assigned_to,
+            User.role.has(Role.name.in_(['Admin', 'Accountant']))
+        ).first() if assigned_to else None
+        if not assignee:
+            return bulk_error(request, 'Invalid user selected.', url_for('tasks.index'))
+    else:
+        # An empty assignee unassigns the tasks, like the edit form
+        assigned_to = None
+    
+    try:
+        results = _bulk_update_tasks({Task.assigned_to: assigned_to}, owner_only=True)
+    except ValueError as e:
+        return bulk_error(request, str(e), url_for('tasks.index'))
+    
+    return bulk_response(request, results, url_for('tasks.index'), 'tasks')
+
+@tasks_bp.route('/bulk/priority', methods=['POST'])
+@login_required
+def bulk_priority():
+    if current_user.role.name not in ['Admin', 'Accountant']:
+        return bulk_error(request, 'You do not have permission to edit tasks.',
+                          url_for('tasks.index'), 403)
+    
+    new_priority = get_bulk_param(request, 'new_priority')
+    if new_priority not in ['High', 'Medium', 'Low']:
+        return bulk_error(request, 'Invalid priority selected.', url_for('tasks.index'))
+    
+    try:
+        results = _bulk_update_tasks({Task.priority: new_priority}, owner_only=True)
+    except ValueError as e:
+        return bulk_error(request, str(e), url_for('tasks.index'))
+    
+    return bulk_response(request, results, url_for('tasks.index'), 'tasks')
+
 @tasks_bp.route('/dashboard')
 @login_required
 def dashboard():
     """Task dashboard with upcoming deadlines and overdue tasks"""
-    today = date.today()
+    sections = task_dashboard(dashboard_scope())
     
-    # Base query filters based on user role
+    return render_template('tasks/dashboard.html',
+                         sections=sections,
+                         overdue_tasks=sections['overdue']['tasks'],
+                         due_today=sections['due_today']['tasks'],
+                         due_this_week=sections['due_this_week']['tasks'],
+                         high_priority=sections['high_priority']['tasks'])
+
+@tasks_bp.route('/dashboard/<bucket>')
+@login_required
+def dashboard_section(bucket):
+    """Further tasks of one dashboard section ("show more")"""
+    if bucket not in dict(BUCKETS):
+        flash('Unknown dashboard section.', 'error')
+        return redirect(url_for('tasks.dashboard'))
+    
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    page = task_dashboard_page(dashboard_scope(), bucket, offset)
+    
+    return render_template('tasks/dashboard_section.html',
+                         bucket=bucket,
+                         label=dict(BUCKETS)[bucket],
+                         tasks=page['tasks'],
+                         total=page['total'],
+                         next_offset=page['next_offset'])
+
+def dashboard_scope():
+    """Which tasks the current user sees on the dashboard"""
     if current_user.role.name == 'Client':
         client = Client.query.filter_by(created_by=current_user.id).first()
-        if client:
-            base_filter = Task.client_id == client.id
-        else:
-            base_filter = Task.client_id == -1  # No results
-    elif current_user.role.name == 'Accountant':
-        base_filter = (Task.assigned_to == current_user.id) | (Task.created_by == current_user.id)
-    else:
-        base_filter = True
-    
-    # Overdue tasks
-    overdue_tasks = Task.query.filter(
-        base_filter,
-        Task.due_date < today,
-        Task.status != 'Completed'
-    ).order_by(Task.due_date.asc()).all()
-    
-    # Due today
-    due_today = Task.query.filter(
-        base_filter,
-        Task.due_date == today,
-        Task.status != 'Completed'
-    ).order_by(Task.priority.desc()).all()
-    
-    # Due this week
-    week_end = today + timedelta(days=7)
-    due_this_week = Task.query.filter(
-        base_filter,
-        Task.due_date > today,
-        Task.due_date <= week_end,
-        Task.status != 'Completed'
-    ).order_by(Task.due_date.asc()).all()
-    
-    # High priority tasks
-    high_priority = Task.query.filter(
-        base_filter,
-        Task.priority == 'High',
-        Task.status != 'Completed'
-    ).order_by(Task.due_date.asc().nullslast()).all()
-    
-    return render_template('tasks/dashboard.html',
-                         overdue_tasks=overdue_tasks,
-                         due_today=due_today,
-                         due_this_week=due_this_week,
-                         high_priority=high_priority)
+        return {'client_id': client.id if client else -1}  # -1: no results
+    if current_user.role.name == 'Accountant':
+        return {'user_id': current_user.id}
+    return {}
@@ -1,10 +1,21 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, make_response, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, make_response, jsonify, current_app, send_file
 from flask_login import login_required, current_user
 from app import db
-from models import VATCalculation, ZakatCalculation, Client
-from forms import VATCalculationForm, ZakatCalculationForm
-from utils import calculate_vat, calculate_zakat, generate_vat_report_pdf, generate_zakat_report_pdf, get_current_hijri_year
+from models import VATCalculation, ZakatCalculation, Client, Company
+from forms import VATCalculationForm, VATReturnForm, VATBatchForm, ZakatCalculationForm
+from ledger import compute_vat_return, compute_vat_returns_batch
+from choices import set_client_choices
+from pdf_engine import generate_vat_report_pdf, generate_zakat_report_pdf
+from utils import calculate_vat, calculate_zakat, get_current_hijri_year, \
+    calculate_vat_batch, calculate_zakat_batch
+from money import parse_halalas, format_halalas
+from background import submit
+from sqlalchemy import insert
+from datetime import datetime
 from decimal import Decimal
+import os
+import uuid
+import zipfile
 
 vat_zakat_bp = Blueprint('vat_zakat', __name__)
 
@@ -39,8 +50,7 @@ def vat_calculate():
     
     # Populate client choices for Admin/Accountant
     if current_user.role.name in ['Admin', 'Accountant']:
-        clients = Client.query.filter_by(status='Active').order_by(Client.name).all()
-        form.client_id.choices = [('', 'Select Client')] + [(c.id, c.name) for c in clients]
+        set_client_choices(form.client_id, blank=('', 'Select Client'))
     else:
         # For clients, pre-select their own data
         client = Client.query.filter_by(created_by=current_user.id).first()
@@ -52,8 +62,8 @@ def vat_calculate():
     
     if form.validate_on_submit():
         # Calculate VAT amounts
-        output_vat = form.total_sales.data * Decimal('0.15')  # 15% VAT on sales
-        input_vat = form.total_purchases.data * Decimal('0.15')  # 15% VAT on purchases
+        output_vat, _ = calculate_vat(form.total_sales.data)  # 15% VAT on sales
+        input_vat, _ = calculate_vat(form.total_purchases.data)  # 15% VAT on purchases
         net_vat = output_vat - input_vat
         
         vat_calculation = VATCalculation(
@@ -77,6 +87,164 @@ def vat_calculate():
     
     return render_template('vat_zakat/vat_calculate.html', form=form)
 
+@vat_zakat_bp.route('/vat/generate', methods=['GET', 'POST'])
+@login_required
+def vat_generate():
+    """Create a VAT return from the sales and purchase ledgers"""
+    if current_user.role.name not in ['Admin', 'Accountant']:
+        flash('You do not have permission to generate VAT returns.', 'error')
+        return redirect(url_for('vat_zakat.index'))
+    
+    form = VATReturnForm()
+    
+    set_client_choices(form.client_id)
+    
+    if form.validate_on_submit():
+        if form.period_end.data < form.period_start.data:
+            flash('Period end must be after period start.', 'error')
+            return render_template('vat_zakat/vat_generate.html', form=form)
+        
+        totals = compute_vat_return(form.client_id.data, form.period_start.data, form.period_end.data)
+        
+        vat_calculation = VATCalculation(
+            client_id=form.client_id.data,
+            period_start=form.period_start.data,
+            period_end=form.period_end.data,
+            total_sales=totals['total_sales'],
+            total_purchases=totals['total_purchases'],
+            output_vat=totals['output_vat'],
+            input_vat=totals['input_vat'],
+            net_vat=totals['net_vat'],
+            notes=form.notes.data,
+            created_by=current_user.id
+        )
+        
+        db.session.add(vat_calculation)
+        db.session.commit()
+        
+        flash('VAT return generated successfully!', 'success')
+        return redirect(url_for('vat_zakat.vat_view', id=vat_calculation.id))
+    
+    return render_template('vat_zakat/vat_generate.html', form=form)
+
+@vat_zakat_bp.route('/vat/batch', methods=['GET', 'POST'])
+@login_required
+def vat_batch():
+    """Create VAT returns for many clients from the ledgers in one run"""
+    if current_user.role.name not in ['Admin', 'Accountant']:
+        flash('You do not have permission to generate VAT returns.', 'error')
+        return redirect(url_for('vat_zakat.index'))
+    
+    form = VATBatchForm()
+    
+    if form.validate_on_submit():
+        if form.period_end.data < form.period_start.data:
+            flash('Period end must be after period start.', 'error')
+            return render_template('vat_zakat/vat_batch.html', form=form)
+        
+        totals = compute_vat_returns_batch(
+            form.period_start.data,
+            form.period_end.data,
+            client_status=form.client_status.data or None
+        )
+        
+        now = datetime.utcnow()
+        rows = []
+        for client_id, client_totals in totals.items():
+            if form.skip_empty.data and not client_totals['total_sales'] and not client_totals['total_purchases']:
+                continue
+            rows.append(dict(
+                client_totals,
+                client_id=client_id,
+                period_start=form.period_start.data,
+                period_end=form.period_end.data,
+                status='Draft',
+                notes=form.notes.data,
+                created_by=current_user.id,
+                created_at=now
+            ))
+        
+        if not rows:
+            flash('No clients had activity in this period.', 'info')
+            return render_template('vat_zakat/vat_batch.html', form=form)
+        
+        calculation_ids = list(db.session.scalars(
+            insert(VATCalculation).returning(VATCalculation.id), rows
+        ))
+        db.session.commit()
+        
+        flash(f'{len(calculation_ids)} VAT returns generated successfully!', 'success')
+        
+        if form.render_pdfs.data:
+            batch_id = uuid.uuid4().hex
+            archive_path = vat_batch_path(batch_id)
+            # The partial file marks the batch as pending until the worker finishes it
+            os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+            open(f'{archive_path}.part', 'wb').close()
+            submit(render_vat_batch, batch_id, calculation_ids, archive_path)
+            flash('PDF reports are being rendered in the background.', 'info')
+            return redirect(url_for('vat_zakat.vat_batch_download', batch_id=batch_id))
+        
+        return redirect(url_for('vat_zakat.index'))
+    
+    return render_template('vat_zakat/vat_batch.html', form=form)
+
+@vat_zakat_bp.route('/vat/batch/<batch_id>')
+@login_required
+def vat_batch_download(batch_id):
+    if current_user.role.name not in ['Admin', 'Accountant']:
+        flash('You do not have permission to download VAT returns.', 'error')
+        return redirect(url_for('vat_zakat.index'))
+    
+    if not batch_id.isalnum():
+        flash('Invalid batch.', 'error')
+        return redirect(url_for('vat_zakat.index'))
+    
+    archive_path = vat_batch_path(batch_id)
+    if os.path.exists(f'{archive_path}.error'):
+        flash('The PDF reports of this batch could not be rendered. Please generate them again.', 'error')
+        return redirect(url_for('vat_zakat.index'))
+    if os.path.exists(f'{archive_path}.part'):
+        return render_template('vat_zakat/vat_batch_pending.html', batch_id=batch_id)
+    if not os.path.exists(archive_path):
+        flash('Batch not found.', 'error')
+        return redirect(url_for('vat_zakat.index'))
+    
+    return send_file(archive_path, mimetype='application/zip', as_attachment=True,
+                     download_name=f'vat_returns_{batch_id}.zip')
+
+def vat_batch_path(batch_id):
+    """Location of the rendered PDF archive for a VAT batch"""
+    return os.path.join(current_app.root_path, 'uploads', 'vat_batches', f'{batch_id}.zip')
+
+def render_vat_batch(batch_id, calculation_ids, archive_path):
+    """
+    Render every VAT return of a batch into one zip archive (runs in the
+    background). A failed render leaves an .error file in place of the archive.
+    """
+    os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+    partial_path = f'{archive_path}.part'
+    company = Company.query.first()
+    
+    try:
+        with zipfile.ZipFile(partial_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            calculations = VATCalculation.query.filter(
+                VATCalculation.id.in_(calculation_ids)
+            ).order_by(VATCalculation.id).yield_per(100)
+            
+            for calculation in calculations:
+                pdf_buffer = generate_vat_report_pdf(calculation, company)
+                archive.writestr(f'vat_report_{calculation.id}.pdf', pdf_buffer.getvalue())
+    except Exception as e:
+        with open(f'{archive_path}.error', 'w') as marker:
+            marker.write(f'{type(e).__name__}: {e}\n')
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    
+    # Only expose the archive once it is complete
+    os.replace(partial_path, archive_path)
+
 @vat_zakat_bp.route('/vat/<int:id>')
 @login_required
 def vat_view(id):
@@ -103,7 +271,7 @@ def vat_pdf(id):
             flash('You do not have permission to download this VAT report.', 'error')
             return redirect(url_for('vat_zakat.index'))
     
-    pdf_buffer = generate_vat_report_pdf(vat_calculation)
+    pdf_buffer = generate_vat_report_pdf(vat_calculation, Company.query.first())
     
     response = make_response(pdf_buffer.getvalue())
     response.headers['Content-Type'] = 'application/pdf'
@@ -133,8 +301,7 @@ def zakat_calculate():
     
     # Populate client choices for Admin/Accountant
     if current_user.role.name in ['Admin', 'Accountant']:
-        clients = Client.query.filter_by(status='Active').order_by(Client.name).all()
-        form.client_id.choices = [('', 'Select Client')] + [(c.id, c.name) for c in clients]
+        set_client_choices(form.client_id, blank=('', 'Select Client'))
     else:
         # For clients, pre-select their own data
         client = Client.query.filter_by(created_by=current_user.id).first()
@@ -211,7 +378,7 @@ def zakat_pdf(id):
             flash('You do not have permission to download this Zakat report.', 'error')
             return redirect(url_for('vat_zakat.index'))
     
-    pdf_buffer = generate_zakat_report_pdf(zakat_calculation)
+    pdf_buffer = generate_zakat_report_pdf(zakat_calculation, Company.query.first())
     
     response = make_response(pdf_buffer.getvalue())
     response.headers['Content-Type'] = 'application/pdf'
@@ -244,14 +411,14 @@ def api_vat_calculate():
         revenue = Decimal(str(data.get('revenue', 0)))
         
         # Calculate 15% VAT on revenue
-        vat_amount = revenue * Decimal('0.15')
+        vat_amount, total_with_vat = calculate_vat(revenue)
         
         return jsonify({
             'success': True,
             'revenue': float(revenue),
             'vat_rate': 15.0,
             'vat_amount': float(vat_amount),
-            'total_with_vat': float(revenue + vat_amount)
+            'total_with_vat': float(total_with_vat)
         })
     except Exception as e:
         return jsonify({
@@ -284,3 +451,135 @@ def api_zakat_calculate():
             'success': False,
             'error': str(e)
         }), 400
+
+# Largest number of items accepted by the batch calculation endpoints
+MAX_BATCH_ITEMS = 10000
+
+def _parse_batch_amounts(values, errors, field=None):
+    """
+    Convert a list of amounts to halalas, rounded like calculate_vat(),
+    recording per-index errors for values that are not numbers. With
+    field, messages are prefixed with it and joined to any earlier
+    message for the same index, so parallel lists can share one errors dict.
+    """
+    amounts = []
+    for index, value in enumerate(values):
+        try:
+            if value is None or isinstance(value, bool):
+                raise ValueError
+            amounts.append(parse_halalas(value))
+        except (ArithmeticError, ValueError):
+            message = f'Invalid amount: {value!r}'
+            message = f'{field}: {message}' if field else message
+            key = str(index)
+            errors[key] = f'{errors[key]}; {message}' if key in errors else message
+            amounts.append(None)
+    return amounts
+
+def _format_column(values):
+    return [format_halalas(value) if value is not None else None for value in values]
+
+@vat_zakat_bp.route('/api/vat/calculate-batch', methods=['POST'])
+@login_required
+def api_vat_calculate_batch():
+    """
+    API endpoint for VAT calculation over many revenues at once.
+    
+    Request: {"revenue": [1000, "250.50", ...], "vat_rate": 15}
+    Response columns are parallel to the input and hold exact two-decimal
+    strings. An item that cannot be calculated gets null in every column
+    and its index is listed in "errors"; the other items are unaffected.
+    A malformed payload or bad vat_rate fails the whole request with 400.
+    """
+    try:
+        data = request.get_json()
+        revenues = data.get('revenue')
+        if not isinstance(revenues, list):
+            raise ValueError('revenue must be a list of amounts')
+        if len(revenues) > MAX_BATCH_ITEMS:
+            raise ValueError(f'At most {MAX_BATCH_ITEMS} items are allowed per request')
+        vat_rate = data.get('vat_rate', 15.0)
+        
+        errors = {}
+        amounts = _parse_batch_amounts(revenues, errors)
+        valid = [amount for amount in amounts if amount is not None]
+        
+        vat_amounts, totals = calculate_vat_batch(valid, vat_rate)
+        
+        # Put the results back in input order, leaving gaps for failed items
+        vat_iter, total_iter = iter(vat_amounts), iter(totals)
+        vat_column = [next(vat_iter) if amount is not None else None for amount in amounts]
+        total_column = [next(total_iter) if amount is not None else None for amount in amounts]
+        
+        return jsonify({
+            'success': True,
+            'count': len(amounts),
+            'vat_rate': float(vat_rate),
+            'revenue': _format_column(amounts),
+            'vat_amount': _format_column(vat_column),
+            'total_with_vat': _format_column(total_column),
+            'errors': errors
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@vat_zakat_bp.route('/api/zakat/calculate-batch', methods=['POST'])
+@login_required
+def api_zakat_calculate_batch():
+    """
+    API endpoint for Zakat calculation over many assets/liabilities pairs.
+    
+    Request: {"assets": [...], "liabilities": [...]} with equal lengths.
+    Response columns are parallel to the input and hold exact two-decimal
+    strings, with the same per-item error semantics as the VAT batch.
+    """
+    try:
+        data = request.get_json()
+        assets = data.get('assets')
+        liabilities = data.get('liabilities')
+        if not isinstance(assets, list) or not isinstance(liabilities, list):
+            raise ValueError('assets and liabilities must be lists of amounts')
+        if len(assets) != len(liabilities):
+            raise ValueError('assets and liabilities must have the same length')
+        if len(assets) > MAX_BATCH_ITEMS:
+            raise ValueError(f'At most {MAX_BATCH_ITEMS} items are allowed per request')
+        
+        errors = {}
+        asset_amounts = _parse_batch_amounts(assets, errors, 'assets')
+        liability_amounts = _parse_batch_amounts(liabilities, errors, 'liabilities')
+        valid = [
+            index for index in range(len(asset_amounts))
+            if asset_amounts[index] is not None and liability_amounts[index] is not None
+        ]
+        
+        net_wealth, zakat_due, nisab = calculate_zakat_batch(
+            [asset_amounts[index] for index in valid],
+            [liability_amounts[index] for index in valid]
+        )
+        
+        # Put the results back in input order, leaving gaps for failed items
+        net_column = [None] * len(asset_amounts)
+        zakat_column = [None] * len(asset_amounts)
+        eligible_column = [None] * len(asset_amounts)
+        for position, index in enumerate(valid):
+            net_column[index] = net_wealth[position]
+            zakat_column[index] = zakat_due[position]
+            eligible_column[index] = net_wealth[position] >= nisab
+        
+        return jsonify({
+            'success': True,
+            'count': len(asset_amounts),
+            'nisab_threshold': format_halalas(nisab),
+            'net_wealth': _format_column(net_column),
+            'zakat_due': _format_column(zakat_column),
+            'eligible_for_zakat': eligible_column,
+            'errors': errors
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
@@ -0,0 +1,78 @@
+from collections import namedtuple
+from flask import url_for
+from sqlalchemy import or_
+from app import db
+from models import Client, User, Role
+from report_cache import cached_report
+
+Choice = namedtuple('Choice', ['id', 'name'])
+
+# Above this many active clients, dropdowns switch to the typeahead search
+CLIENT_SELECT_LIMIT = 500
+
+# Matches returned per typeahead request
+CLIENT_SEARCH_LIMIT = 20
+
+STAFF_ROLES = ['Admin', 'Accountant']
+
+def client_choices():
+    """All active clients as (id, name), cached until a client is written"""
+    rows = cached_report('choices:clients', {}, {}, ('clients',), lambda: [
+        [row.id, row.name]
+        for row in db.session.query(Client.id, Client.name).filter(
+            Client.status == 'Active'
+        ).order_by(Client.name, Client.id)
+    ])
+    return [Choice(*row) for row in rows]
+
+def staff_choices():
+    """Admins and accountants as (id, full name), cached until a user is written"""
+    rows = cached_report('choices:staff', {}, {}, ('users',), lambda: [
+        [row.id, f'{row.first_name} {row.last_name}']
+        for row in db.session.query(User.id, User.first_name, User.last_name).filter(
+            User.role.has(Role.name.in_(STAFF_ROLES))
+        ).order_by(User.first_name, User.id)
+    ])
+    return [Choice(*row) for row in rows]
+
+def client_options(selected=None):
+    """
+    Active clients for a dropdown. When there are too many for a <select>,
+    only the selected client is returned and the page searches the rest
+    through the typeahead endpoint.
+    """
+    clients = client_choices()
+    if len(clients) > CLIENT_SELECT_LIMIT:
+        return [client for client in clients if selected is not None and str(client.id) == str(selected)]
+    return clients
+
+def client_typeahead_url():
+    """Search endpoint a dropdown should use instead, or None for short lists"""
+    if len(client_choices()) > CLIENT_SELECT_LIMIT:
+        return url_for('clients.search')
+    return None
+
+def set_client_choices(field, blank=None):
+    """Populate a client SelectField, switching it to the typeahead for long lists"""
+    options = [blank] if blank else []
+    field.choices = options + [tuple(client) for client in client_options(field.data)]
+    
+    typeahead_url = client_typeahead_url()
+    if typeahead_url:
+        field.render_kw = dict(field.render_kw or {}, **{'data-typeahead': typeahead_url})
+
+def set_staff_choices(field, blank=None):
+    options = [blank] if blank else []
+    field.choices = options + [tuple(user) for user in staff_choices()]
+
+def search_clients(term, limit=CLIENT_SEARCH_LIMIT):
+    """Active clients whose name, Arabic name or VAT number match the search term"""
+    rows = db.session.query(Client.id, Client.name).filter(
+        Client.status == 'Active',
+        or_(
+            Client.name.icontains(term, autoescape=True),
+            Client.name_ar.icontains(term, autoescape=True),
+            Client.vat_number.istartswith(term, autoescape=True)
+        )
+    ).order_by(Client.name, Client.id).limit(limit)
+    return [Choice(row.id, row.name) for row in rows]
@@ -0,0 +1,144 @@
+import logging
+import os
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, delete
+from app import db
+from models import (Client, ClientDocument, ClientSummary, Invoice, InvoiceDailyRollup, InvoiceItem,
+                    InvoiceAttachment, EInvoice, Payment, Purchase, Task, VATCalculation, ZakatCalculation,
+                    invoices_archive, invoice_items_archive, invoice_attachments_archive, payments_archive,
+                    einvoices_archive, tasks_archive)
+from background import submit
+
+logger = logging.getLogger(__name__)
+
+# Status of a client whose records are being removed in the background
+CLIENT_DELETING = 'Deleting'
+
+# Rows removed per statement and transaction, so no single delete holds long locks
+DELETE_BATCH_SIZE = 500
+
+def has_issued_einvoices(client_id):
+    """Issued e-invoices are part of the ZATCA hash chain and must be kept"""
+    issued = db.session.query(
+        select(EInvoice.invoice_id).join(Invoice, EInvoice.invoice_id == Invoice.id)
+        .where(Invoice.client_id == client_id).exists()
+    ).scalar()
+    return issued or db.session.query(
+        select(einvoices_archive.c.invoice_id)
+        .join(invoices_archive, einvoices_archive.c.invoice_id == invoices_archive.c.id)
+        .where(invoices_archive.c.client_id == client_id).exists()
+    ).scalar()
+
+def request_client_deletion(client):
+    """
+    Mark a client for deletion and queue the purge of its records.
+    The client drops out of listings at once; its rows and files are
+    removed by a background worker.
+    """
+    client.status = CLIENT_DELETING
+    db.session.commit()
+    submit(purge_client, client.id)
+
+def _remove_uploads(filenames):
+    upload_path = os.path.join(current_app.root_path, 'uploads')
+    for filename in filenames:
+        try:
+            os.remove(os.path.join(upload_path, filename))
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logger.exception('Could not remove uploaded file %s', filename)
+
+def _delete_invoice_children(invoice_ids):
+    filenames = db.session.scalars(
+        select(InvoiceAttachment.filename).where(InvoiceAttachment.invoice_id.in_(invoice_ids))
+    ).all()
+    for child in (InvoiceItem, InvoiceAttachment, Payment):
+        db.session.execute(delete(child).where(child.invoice_id.in_(invoice_ids)))
+    return filenames
+
+def _document_filenames(document_ids):
+    return db.session.scalars(select(ClientDocument.filename).where(ClientDocument.id.in_(document_ids))).all()
+
+def _delete_in_batches(model, condition, before_delete=None):
+    """
+    Delete the rows matching condition a batch of ids at a time, committing
+    each batch. before_delete(ids) clears rows that reference the batch and
+    returns the uploaded files to remove once the batch is committed.
+    Returns the number of rows deleted.
+    """
+    deleted = 0
+    while True:
+        ids = db.session.scalars(
+            select(model.id).where(condition).order_by(model.id).limit(DELETE_BATCH_SIZE)
+        ).all()
+        if not ids:
+            return deleted
+        
+        filenames = before_delete(ids) if before_delete else []
+        db.session.execute(delete(model).where(model.id.in_(ids)), execution_options={'synchronize_session': False})
+        db.session.commit()
+        _remove_uploads(filenames)
+        deleted += len(ids)
+
+def _delete_archived_invoices(client_id):
+    """Archived invoices of a client with their archived rows and files, in batches"""
+    while True:
+        ids = db.session.scalars(
+            select(invoices_archive.c.id).where(invoices_archive.c.client_id == client_id)
+            .order_by(invoices_archive.c.id).limit(DELETE_BATCH_SIZE)
+        ).all()
+        if not ids:
+            return
+        
+        filenames = db.session.scalars(
+            select(invoice_attachments_archive.c.filename).where(invoice_attachments_archive.c.invoice_id.in_(ids))
+        ).all()
+        for table in (invoice_items_archive, invoice_attachments_archive, payments_archive):
+            db.session.execute(delete(table).where(table.c.invoice_id.in_(ids)))
+        db.session.execute(delete(invoices_archive).where(invoices_archive.c.id.in_(ids)))
+        db.session.commit()
+        _remove_uploads(filenames)
+
+def purge_client(client_id):
+    """
+    Remove a client marked for deletion together with everything that
+    references it (runs in the background). Each dependent table is cleared
+    with set-based deletes in committed batches, so an interrupted purge
+    resumes where it stopped when run again.
+    """
+    client = db.session.get(Client, client_id)
+    if client is None or client.status != CLIENT_DELETING:
+        return False
+    if has_issued_einvoices(client_id):
+        logger.error('Client %s has issued e-invoices and cannot be purged', client_id)
+        return False
+    
+    _delete_in_batches(Invoice, Invoice.client_id == client_id, _delete_invoice_children)
+    _delete_in_batches(ClientDocument, ClientDocument.client_id == client_id, _document_filenames)
+    for model in (Payment, Purchase, Task, VATCalculation, ZakatCalculation):
+        _delete_in_batches(model, model.client_id == client_id)
+    _delete_archived_invoices(client_id)
+    db.session.execute(delete(tasks_archive).where(tasks_archive.c.client_id == client_id))
+    
+    # The maintained counters go with the client in one final transaction
+    db.session.execute(delete(InvoiceDailyRollup).where(InvoiceDailyRollup.client_id == client_id))
+    db.session.execute(delete(ClientSummary).where(ClientSummary.client_id == client_id))
+    db.session.execute(delete(Client).where(Client.id == client_id), execution_options={'synchronize_session': False})
+    db.session.commit()
+    logger.info('Purged client %s', client_id)
+    return True
+
+def purge_deleted_clients():
+    """Finish every client deletion that was requested but not completed"""
+    client_ids = db.session.scalars(select(Client.id).where(Client.status == CLIENT_DELETING).order_by(Client.id)).all()
+    return sum(1 for client_id in client_ids if purge_client(client_id))
+
+@click.command('purge-deleted-clients')
+@with_appcontext
+def purge_deleted_clients_command():
+    """Resume client deletions interrupted by a restart."""
+    purged = purge_deleted_clients()
+    click.echo(f'Purged {purged} clients.')
@@ -0,0 +1,235 @@
+import csv
+import logging
+import os
+import tempfile
+from datetime import datetime
+from io import TextIOWrapper
+from email_validator import validate_email, EmailNotValidError
+from sqlalchemy import insert, update, or_
+from app import db
+from models import Client
+from client_deletion import CLIENT_DELETING
+from utils import pick_csv_value
+
+logger = logging.getLogger(__name__)
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+    logger.warning('openpyxl is not installed; client import/export is limited to CSV')
+
+# Rows validated, matched and written per round of statements
+IMPORT_CHUNK_SIZE = 500
+
+# Rows fetched per round trip while exporting
+EXPORT_FETCH_SIZE = 1000
+
+# Only the first errors are reported back to the user
+MAX_REPORTED_ERRORS = 100
+
+CLIENT_STATUSES = ('Active', 'Closed', 'Archived')
+
+# Client columns with their export header, the other headers accepted on
+# import (compared lower-cased) and the maximum length
+CLIENT_FIELDS = [
+    ('name', 'Name', ('client name', 'company name', 'name (english)'), 255),
+    ('name_ar', 'Name (Arabic)', ('arabic name', 'name_ar'), 255),
+    ('email', 'Email', ('email address',), 120),
+    ('phone', 'Phone', ('mobile', 'phone number'), 20),
+    ('cr_number', 'CR Number', ('cr', 'commercial registration'), 50),
+    ('vat_number', 'VAT Number', ('vat', 'tax number'), 50),
+    ('address', 'Address', ('address (english)',), None),
+    ('address_ar', 'Address (Arabic)', ('arabic address', 'address_ar'), None),
+    ('status', 'Status', (), None),
+]
+
+CLIENT_EXPORT_COLUMNS = [label for _, label, _, _ in CLIENT_FIELDS]
+
+def xlsx_supported():
+    return openpyxl is not None
+
+def _cell_text(value):
+    # Spreadsheets hand back VAT and CR numbers as numbers
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+def _csv_rows(stream):
+    if not isinstance(stream, TextIOWrapper):
+        stream = TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    return csv.reader(stream)
+
+def _xlsx_rows(stream):
+    workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    try:
+        for values in workbook.active.iter_rows(values_only=True):
+            yield [_cell_text(value) for value in values]
+    finally:
+        workbook.close()
+
+def _validate(row):
+    """Client columns of one row, or raise ValueError with the reason"""
+    values = {}
+    for field, label, aliases, max_length in CLIENT_FIELDS:
+        value = pick_csv_value(row, (label.lower(),) + aliases)
+        if max_length and len(value) > max_length:
+            raise ValueError(f'{label} is longer than {max_length} characters.')
+        values[field] = value or None
+    
+    if not values['name']:
+        raise ValueError('Missing client name.')
+    if values['email']:
+        try:
+            validate_email(values['email'], check_deliverability=False)
+        except EmailNotValidError:
+            raise ValueError('Invalid email address.')
+    if values['status'] and values['status'].capitalize() not in CLIENT_STATUSES:
+        raise ValueError(f"Unknown status '{values['status']}'.")
+    if values['status']:
+        values['status'] = values['status'].capitalize()
+    return values
+
+class _ClientImport:
+    """Accumulates validated rows and writes them a chunk at a time"""
+    
+    def __init__(self, created_by):
+        self.created_by = created_by
+        self.created = 0
+        self.updated = 0
+        self.errors = []
+        self.pending = []
+        # Line on which each VAT/CR number was first seen, to catch duplicates in the file
+        self.seen = {}
+    
+    def add(self, line_number, values):
+        keys = [('vat', values['vat_number']), ('cr', values['cr_number'])]
+        for key in keys:
+            if key[1] and key in self.seen:
+                self.errors.append((line_number, f'Duplicate of line {self.seen[key]}.'))
+                return
+        for key in keys:
+            if key[1]:
+                self.seen[key] = line_number
+        
+        self.pending.append((line_number, values))
+        if len(self.pending) >= IMPORT_CHUNK_SIZE:
+            self.flush()
+    
+    def _existing(self):
+        # One lookup for the whole chunk: ids by VAT number and by CR number,
+        # and which of them are being deleted
+        vat_numbers = {values['vat_number'] for _, values in self.pending if values['vat_number']}
+        cr_numbers = {values['cr_number'] for _, values in self.pending if values['cr_number']}
+        by_vat, by_cr, deleting = {}, {}, set()
+        if vat_numbers or cr_numbers:
+            rows = db.session.query(Client.id, Client.vat_number, Client.cr_number, Client.status).filter(or_(
+                Client.vat_number.in_(vat_numbers),
+                Client.cr_number.in_(cr_numbers)
+            ))
+            for row in rows:
+                if row.vat_number in vat_numbers:
+                    by_vat.setdefault(row.vat_number, set()).add(row.id)
+                if row.cr_number in cr_numbers:
+                    by_cr.setdefault(row.cr_number, set()).add(row.id)
+                if row.status == CLIENT_DELETING:
+                    deleting.add(row.id)
+        return by_vat, by_cr, deleting
+    
+    def flush(self):
+        if not self.pending:
+            return
+        by_vat, by_cr, deleting = self._existing()
+        now = datetime.utcnow()
+        inserts, updates = [], []
+        
+        for line_number, values in self.pending:
+            matches = by_vat.get(values['vat_number'], set()) | by_cr.get(values['cr_number'], set())
+            if len(matches) > 1:
+                self.errors.append((line_number, 'VAT and CR numbers match more than one existing client.'))
+            elif matches & deleting:
+                self.errors.append((line_number, 'The matching client is being deleted.'))
+            elif matches:
+                # Blank cells leave the stored value unchanged
+                changes = {field: value for field, value in values.items() if value is not None}
+                changes.update(id=matches.pop(), updated_at=now)
+                updates.append(changes)
+            else:
+                inserts.append(dict(values, status=values['status'] or 'Active',
+                                    created_by=self.created_by, created_at=now, updated_at=now))
+        
+        if inserts:
+            db.session.execute(insert(Client), inserts)
+            self.created += len(inserts)
+        if updates:
+            db.session.execute(update(Client), updates)
+            self.updated += len(updates)
+        self.pending = []
+
+def import_clients(stream, filename, created_by):
+    """
+    Stream a CSV or XLSX client list into the clients table. Rows are
+    validated as they are read and written in chunks: each chunk looks up
+    existing clients by VAT or CR number in one query, then updates the
+    matches and inserts the rest with one batched statement each.
+    Returns (created_count, updated_count, skipped_count, errors) where
+    errors are (line, message) pairs for the first MAX_REPORTED_ERRORS
+    skipped rows.
+    """
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension == '.xlsx':
+        if openpyxl is None:
+            return 0, 0, 0, [(1, 'Excel files are not supported on this server. Please upload a CSV file.')]
+        rows = _xlsx_rows(stream)
+    else:
+        rows = _csv_rows(stream)
+    
+    header = next(rows, None)
+    if not header:
+        return 0, 0, 0, [(1, 'File is empty.')]
+    header = [column.strip().lower() for column in header]
+    
+    client_import = _ClientImport(created_by)
+    for line_number, cells in enumerate(rows, start=2):
+        if not any(cell.strip() for cell in cells):
+            continue
+        try:
+            values = _validate(dict(zip(header, cells)))
+        except ValueError as e:
+            client_import.errors.append((line_number, str(e)))
+            continue
+        client_import.add(line_number, values)
+    client_import.flush()
+    
+    db.session.commit()
+    
+    errors = sorted(client_import.errors)
+    return client_import.created, client_import.updated, len(errors), errors[:MAX_REPORTED_ERRORS]
+
+def export_client_rows(query=None):
+    """Client rows in CLIENT_EXPORT_COLUMNS order, fetched in batches"""
+    query = query if query is not None else db.session.query(Client)
+    rows = query.with_entities(
+        Client.name, Client.name_ar, Client.email, Client.phone, Client.cr_number,
+        Client.vat_number, Client.address, Client.address_ar, Client.status
+    ).order_by(Client.id).execution_options(yield_per=EXPORT_FETCH_SIZE)
+    for row in rows:
+        yield ['' if value is None else value for value in row]
+
+def export_clients_xlsx(rows):
+    """
+    Write client rows to an XLSX workbook in a temporary file and return
+    it, rewound. The write-only workbook keeps rows on disk, not in memory.
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Clients')
+    sheet.append(CLIENT_EXPORT_COLUMNS)
+    for row in rows:
+        sheet.append(row)
+    
+    output = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    workbook.save(output)
+    output.seek(0)
+    return output
@@ -0,0 +1,193 @@
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import insert
+from app import db
+from models import Invoice, InvoiceItem, Client, Company, EInvoice, einvoices_archive
+from client_deletion import CLIENT_DELETING
+from zatca import INITIAL_PREVIOUS_HASH, serialize_invoice, link_invoice
+
+# Invoices fetched, serialized and committed per round in batch mode
+EINVOICE_BATCH_SIZE = 500
+
+# Invoices handed to a worker process at a time
+EINVOICE_POOL_CHUNK = 25
+
+def seller_party(company):
+    if company is None:
+        raise ValueError('Company settings are required before issuing e-invoices.')
+    return {
+        'name': company.name,
+        'vat_number': company.vat_number,
+        'cr_number': company.cr_number,
+        'address': company.address
+    }
+
+def chain_head():
+    """Counter and hash of the last issued e-invoice, locked until commit"""
+    head = db.session.query(EInvoice.counter, EInvoice.invoice_hash).order_by(
+        EInvoice.counter.desc()
+    ).limit(1).with_for_update().first()
+    # Archived e-invoices are older, unless every later one is archived too
+    archived_head = db.session.query(einvoices_archive.c.counter, einvoices_archive.c.invoice_hash).order_by(
+        einvoices_archive.c.counter.desc()
+    ).limit(1).first()
+    if archived_head is not None and (head is None or archived_head.counter > head.counter):
+        head = archived_head
+    if head is None:
+        return 0, INITIAL_PREVIOUS_HASH
+    return head.counter, head.invoice_hash
+
+def _invoice_rows(*conditions, limit=None):
+    # Plain rows rather than ORM objects, so a batch stays cheap to hold and pickle
+    query = db.session.query(
+        Invoice.id,
+        Invoice.invoice_number,
+        Invoice.issue_date,
+        Invoice.created_at,
+        Invoice.description,
+        Invoice.subtotal,
+        Invoice.vat_rate,
+        Invoice.vat_amount,
+        Invoice.total_amount,
+        Client.name.label('client_name'),
+        Client.vat_number.label('client_vat_number'),
+        Client.cr_number.label('client_cr_number'),
+        Client.address.label('client_address')
+    ).join(Client, Invoice.client_id == Client.id).outerjoin(
+        EInvoice, EInvoice.invoice_id == Invoice.id
+    ).filter(
+        EInvoice.invoice_id.is_(None),
+        Client.status != CLIENT_DELETING,
+        *conditions
+    ).order_by(Invoice.id)
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+def _items_by_invoice(invoice_ids):
+    items = {invoice_id: [] for invoice_id in invoice_ids}
+    rows = db.session.query(
+        InvoiceItem.invoice_id,
+        InvoiceItem.description,
+        InvoiceItem.quantity,
+        InvoiceItem.unit_price,
+        InvoiceItem.total_price
+    ).filter(InvoiceItem.invoice_id.in_(invoice_ids)).order_by(InvoiceItem.invoice_id, InvoiceItem.id)
+    for row in rows:
+        items[row.invoice_id].append({
+            'description': row.description,
+            'quantity': str(row.quantity),
+            'unit_price': str(row.unit_price),
+            'total_price': str(row.total_price)
+        })
+    return items
+
+def _invoice_data(row, items, seller, counter):
+    issued = row.created_at or datetime.utcnow()
+    return {
+        'invoice_id': row.id,
+        'invoice_number': row.invoice_number,
+        'uuid': str(uuid.uuid4()),
+        'counter': counter,
+        'issue_date': row.issue_date.isoformat(),
+        'issue_time': issued.strftime('%H:%M:%S'),
+        'description': row.description,
+        'subtotal': str(row.subtotal),
+        'vat_rate': str(row.vat_rate if row.vat_rate is not None else 15),
+        'vat_amount': str(row.vat_amount),
+        'total_amount': str(row.total_amount),
+        'seller': seller,
+        'buyer': {
+            'name': row.client_name,
+            'vat_number': row.client_vat_number,
+            'cr_number': row.client_cr_number,
+            'address': row.client_address
+        },
+        'items': items
+    }
+
+def _issue_rows(rows, seller, pool=None):
+    """Serialize rows (in parallel with a pool), chain them in order and store them"""
+    counter, previous_hash = chain_head()
+    items = _items_by_invoice([row.id for row in rows])
+    batch = [
+        _invoice_data(row, items[row.id], seller, counter + number)
+        for number, row in enumerate(rows, 1)
+    ]
+    
+    if pool is None:
+        serialized = map(serialize_invoice, batch)
+    else:
+        serialized = pool.map(serialize_invoice, batch, chunksize=EINVOICE_POOL_CHUNK)
+    
+    records = []
+    issued_at = datetime.utcnow()
+    for data, result in zip(batch, serialized):
+        invoice_hash, qr_payload, xml = link_invoice(result, previous_hash)
+        records.append({
+            'invoice_id': data['invoice_id'],
+            'uuid': data['uuid'],
+            'counter': data['counter'],
+            'invoice_hash': invoice_hash,
+            'previous_hash': previous_hash,
+            'qr_payload': qr_payload,
+            'xml': xml,
+            'issued_at': issued_at
+        })
+        previous_hash = invoice_hash
+    
+    if records:
+        db.session.execute(insert(EInvoice), records)
+    db.session.commit()
+    return len(records)
+
+def issue_einvoice(invoice):
+    """Issue the e-invoice of one invoice, chained after the last one issued"""
+    if invoice.einvoice is not None:
+        return invoice.einvoice
+    if invoice.client.status == CLIENT_DELETING:
+        raise ValueError('The client of this invoice is being deleted.')
+    seller = seller_party(Company.query.first())
+    _issue_rows(_invoice_rows(Invoice.id == invoice.id), seller)
+    db.session.expire(invoice, ['einvoice'])
+    return invoice.einvoice
+
+def issue_pending_einvoices(workers=None, batch_size=EINVOICE_BATCH_SIZE, limit=None):
+    """
+    Issue e-invoices for every invoice that has none, oldest first. Rows
+    are fetched and committed in batches, each batch continuing the
+    chain; serialization is spread over worker processes.
+    Returns the number of e-invoices issued.
+    """
+    seller = seller_party(Company.query.first())
+    workers = workers or os.cpu_count() or 1
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    
+    issued = 0
+    last_id = 0
+    try:
+        while limit is None or issued < limit:
+            size = batch_size if limit is None else min(batch_size, limit - issued)
+            rows = _invoice_rows(Invoice.id > last_id, limit=size)
+            if not rows:
+                break
+            issued += _issue_rows(rows, seller, pool)
+            last_id = rows[-1].id
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return issued
+
+@click.command('issue-einvoices')
+@click.option('--workers', type=int, default=None, help='Worker processes (defaults to the CPU count).')
+@click.option('--batch-size', type=int, default=EINVOICE_BATCH_SIZE, show_default=True)
+@click.option('--limit', type=int, default=None, help='Stop after this many invoices.')
+@with_appcontext
+def issue_einvoices_command(workers, batch_size, limit):
+    """Issue ZATCA e-invoices for all invoices that do not have one yet."""
+    issued = issue_pending_einvoices(workers, batch_size, limit)
+    click.echo(f'Issued {issued} e-invoices.')
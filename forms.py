@@ -38,7 +38,7 @@ class InvoiceForm(FlaskForm):
     description = TextAreaField('Description', validators=[Optional()])
     subtotal = DecimalField('Subtotal (SAR)', validators=[DataRequired(), NumberRange(min=0)], places=2)
     vat_rate = DecimalField('VAT Rate (%)', validators=[DataRequired(), NumberRange(min=0, max=100)], default=Decimal('15.00'), places=2)
-    status = SelectField('Status', choices=[('Unpaid', 'Unpaid'), ('Paid', 'Paid'), ('Overdue', 'Overdue')], default='Unpaid')
+    status = SelectField('Status', choices=[('Unpaid', 'Unpaid'), ('Partially Paid', 'Partially Paid'), ('Paid', 'Paid'), ('Overdue', 'Overdue')], default='Unpaid')
     payment_date = DateField('Payment Date', validators=[Optional()])
     notes = TextAreaField('Notes', validators=[Optional()])
 
@@ -47,6 +47,16 @@ class InvoiceItemForm(FlaskForm):
     quantity = DecimalField('Quantity', validators=[DataRequired(), NumberRange(min=0)], places=2)
     unit_price = DecimalField('Unit Price (SAR)', validators=[DataRequired(), NumberRange(min=0)], places=2)
 
+class PaymentForm(FlaskForm):
+    amount = DecimalField('Amount (SAR)', validators=[DataRequired(), NumberRange(min=0.01)], places=2)
+    payment_date = DateField('Payment Date', validators=[DataRequired()], default=date.today)
+    method = SelectField('Method', choices=[('Bank Transfer', 'Bank Transfer'), ('Cash', 'Cash'), ('Cheque', 'Cheque')], default='Bank Transfer')
+    reference = StringField('Reference', validators=[Optional(), Length(max=255)])
+    notes = TextAreaField('Notes', validators=[Optional()])
+
+class BankStatementImportForm(FlaskForm):
+    file = FileField('Bank Statement (CSV)', validators=[DataRequired(), FileAllowed(['csv'], 'CSV files only!')])
+
 class TaskForm(FlaskForm):
     title = StringField('Task Title', validators=[DataRequired(), Length(max=255)])
     description = TextAreaField('Description', validators=[Optional()])
@@ -65,6 +75,42 @@ class VATCalculationForm(FlaskForm):
     total_purchases = DecimalField('Total Purchases (SAR)', validators=[DataRequired(), NumberRange(min=0)], places=2)
     notes = TextAreaField('Notes', validators=[Optional()])
 
+class VATReturnForm(FlaskForm):
+    client_id = SelectField('Client', coerce=int, validators=[DataRequired()])
+    period_start = DateField('Period Start', validators=[DataRequired()])
+    period_end = DateField('Period End', validators=[DataRequired()])
+    notes = TextAreaField('Notes', validators=[Optional()])
+
+class VATBatchForm(FlaskForm):
+    period_start = DateField('Period Start', validators=[DataRequired()])
+    period_end = DateField('Period End', validators=[DataRequired()])
+    client_status = SelectField('Clients', choices=[('Active', 'Active clients'), ('', 'All clients')], default='Active')
+    skip_empty = BooleanField('Skip clients with no sales or purchases', default=True)
+    render_pdfs = BooleanField('Render PDF reports', default=False)
+    notes = TextAreaField('Notes', validators=[Optional()])
+
+class PurchaseForm(FlaskForm):
+    client_id = SelectField('Client', coerce=int, validators=[DataRequired()])
+    supplier_name = StringField('Supplier Name', validators=[DataRequired(), Length(max=255)])
+    supplier_vat_number = StringField('Supplier VAT Number', validators=[Optional(), Length(max=50)])
+    invoice_number = StringField('Supplier Invoice Number', validators=[Optional(), Length(max=50)])
+    purchase_date = DateField('Purchase Date', validators=[DataRequired()], default=date.today)
+    description = TextAreaField('Description', validators=[Optional()])
+    category = SelectField('Category', choices=[('General', 'General'), ('Rent', 'Rent'), ('Utilities', 'Utilities'), ('Inventory', 'Inventory'), ('Services', 'Services')], default='General')
+    subtotal = DecimalField('Subtotal (SAR)', validators=[DataRequired(), NumberRange(min=0)], places=2)
+    vat_rate = DecimalField('VAT Rate (%)', validators=[DataRequired(), NumberRange(min=0, max=100)], default=Decimal('15.00'), places=2)
+
+class PurchaseImportForm(FlaskForm):
+    client_id = SelectField('Client', coerce=int, validators=[DataRequired()])
+    file = FileField('Purchases (CSV)', validators=[DataRequired(), FileAllowed(['csv'], 'CSV files only!')])
+
+class ClientImportForm(FlaskForm):
+    file = FileField('Clients (CSV or Excel)', validators=[DataRequired(), FileAllowed(['csv', 'xlsx'], 'CSV or Excel files only!')])
+
+class BackupRestoreForm(FlaskForm):
+    file = FileField('Backup File', validators=[DataRequired(), FileAllowed(['tar'], 'Backup files (.tar) only!')])
+    confirm = BooleanField('Replace the current data with this backup', validators=[DataRequired()])
+
 class ZakatCalculationForm(FlaskForm):
     client_id = SelectField('Client', coerce=int, validators=[Optional()])
     hijri_year = StringField('Hijri Year', validators=[DataRequired(), Length(max=10)])
@@ -0,0 +1,200 @@
+import csv
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from io import TextIOWrapper
+from sqlalchemy import func, insert
+from app import db
+from models import Purchase, Client
+from archive import invoice_source
+from utils import calculate_vat, parse_csv_date, pick_csv_value
+
+# Rows per INSERT statement when importing purchases
+INSERT_CHUNK_SIZE = 1000
+
+# Only the first errors are reported back to the user
+MAX_REPORTED_ERRORS = 100
+
+# Accepted purchase CSV headers (compared lower-cased)
+DATE_HEADERS = ('date', 'purchase date', 'invoice date')
+SUPPLIER_HEADERS = ('supplier', 'supplier name', 'vendor')
+SUPPLIER_VAT_HEADERS = ('supplier vat number', 'vat number', 'supplier vat')
+INVOICE_NUMBER_HEADERS = ('invoice number', 'supplier invoice number', 'reference')
+DESCRIPTION_HEADERS = ('description', 'details')
+CATEGORY_HEADERS = ('category',)
+SUBTOTAL_HEADERS = ('subtotal', 'net amount', 'amount')
+VAT_RATE_HEADERS = ('vat rate',)
+VAT_AMOUNT_HEADERS = ('vat', 'vat amount')
+
+def _parse_amount(value):
+    return Decimal(value.replace(',', '')).quantize(Decimal('0.01'))
+
+def import_purchases_csv(stream, client_id, created_by):
+    """
+    Stream a purchases CSV into the ledger for one client.
+    Rows are validated one at a time and inserted in chunks; the VAT amount
+    is computed from the rate when the file does not provide one.
+    Returns (imported_count, skipped_count, errors) where errors are
+    (line, message) pairs for the first MAX_REPORTED_ERRORS skipped rows.
+    """
+    if not isinstance(stream, TextIOWrapper):
+        stream = TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if not header:
+        return 0, 0, [(1, 'File is empty.')]
+    header = [column.strip().lower() for column in header]
+    
+    imported = 0
+    errors = []
+    batch = []
+    now = datetime.utcnow()
+    
+    for line_number, values in enumerate(reader, start=2):
+        row = dict(zip(header, values))
+        
+        purchase_date = parse_csv_date(pick_csv_value(row, DATE_HEADERS))
+        supplier_name = pick_csv_value(row, SUPPLIER_HEADERS)
+        if not purchase_date or not supplier_name:
+            errors.append((line_number, 'Missing date or supplier.'))
+            continue
+        
+        try:
+            subtotal = _parse_amount(pick_csv_value(row, SUBTOTAL_HEADERS))
+            vat_rate = _parse_amount(pick_csv_value(row, VAT_RATE_HEADERS) or '15')
+            vat_amount = pick_csv_value(row, VAT_AMOUNT_HEADERS)
+            if vat_amount:
+                vat_amount = _parse_amount(vat_amount)
+                total_amount = subtotal + vat_amount
+            else:
+                vat_amount, total_amount = calculate_vat(subtotal, vat_rate)
+        except InvalidOperation:
+            errors.append((line_number, 'Invalid amount.'))
+            continue
+        
+        batch.append({
+            'client_id': client_id,
+            'supplier_name': supplier_name[:255],
+            'supplier_vat_number': pick_csv_value(row, SUPPLIER_VAT_HEADERS)[:50] or None,
+            'invoice_number': pick_csv_value(row, INVOICE_NUMBER_HEADERS)[:50] or None,
+            'purchase_date': purchase_date,
+            'description': pick_csv_value(row, DESCRIPTION_HEADERS) or None,
+            'category': pick_csv_value(row, CATEGORY_HEADERS)[:50] or 'General',
+            'subtotal': subtotal,
+            'vat_rate': vat_rate,
+            'vat_amount': vat_amount,
+            'total_amount': total_amount,
+            'created_by': created_by,
+            'created_at': now
+        })
+        
+        if len(batch) >= INSERT_CHUNK_SIZE:
+            db.session.execute(insert(Purchase), batch)
+            imported += len(batch)
+            batch = []
+    
+    if batch:
+        db.session.execute(insert(Purchase), batch)
+        imported += len(batch)
+    
+    db.session.commit()
+    
+    return imported, len(errors), errors[:MAX_REPORTED_ERRORS]
+
+def compute_vat_return(client_id, period_start, period_end):
+    """
+    Aggregate a client's VAT return for a period from the ledgers.
+    Output VAT comes from issued invoices and input VAT from purchases;
+    both sums use range predicates on the (client_id, date) indexes.
+    """
+    invoices = invoice_source(period_start, period_end)
+    sales = db.session.query(
+        func.coalesce(func.sum(invoices.subtotal), 0),
+        func.coalesce(func.sum(invoices.vat_amount), 0)
+    ).filter(
+        invoices.client_id == client_id,
+        invoices.issue_date >= period_start,
+        invoices.issue_date <= period_end
+    ).one()
+    
+    purchases = db.session.query(
+        func.coalesce(func.sum(Purchase.subtotal), 0),
+        func.coalesce(func.sum(Purchase.vat_amount), 0)
+    ).filter(
+        Purchase.client_id == client_id,
+        Purchase.purchase_date >= period_start,
+        Purchase.purchase_date <= period_end
+    ).one()
+    
+    total_sales, output_vat = Decimal(sales[0]), Decimal(sales[1])
+    total_purchases, input_vat = Decimal(purchases[0]), Decimal(purchases[1])
+    
+    return {
+        'total_sales': total_sales,
+        'total_purchases': total_purchases,
+        'output_vat': output_vat,
+        'input_vat': input_vat,
+        'net_vat': output_vat - input_vat
+    }
+
+def compute_vat_returns_batch(period_start, period_end, client_status='Active', client_ids=None):
+    """
+    Aggregate VAT returns for every selected client in one pass.
+    Sales and purchases are each summed with a single query grouped by
+    client, so the cost does not grow with one round trip per client.
+    Returns {client_id: totals} for every selected client.
+    """
+    selected = db.session.query(Client.id)
+    if client_status:
+        selected = selected.filter(Client.status == client_status)
+    if client_ids:
+        selected = selected.filter(Client.id.in_(client_ids))
+    selected_ids = [row.id for row in selected.all()]
+    
+    zero = Decimal('0')
+    totals = {
+        client_id: {
+            'total_sales': zero,
+            'total_purchases': zero,
+            'output_vat': zero,
+            'input_vat': zero,
+            'net_vat': zero
+        }
+        for client_id in selected_ids
+    }
+    if not totals:
+        return totals
+    
+    invoices = invoice_source(period_start, period_end)
+    sales = db.session.query(
+        invoices.client_id,
+        func.sum(invoices.subtotal),
+        func.sum(invoices.vat_amount)
+    ).filter(
+        invoices.client_id.in_(selected_ids),
+        invoices.issue_date >= period_start,
+        invoices.issue_date <= period_end
+    ).group_by(invoices.client_id)
+    
+    for client_id, total_sales, output_vat in sales:
+        totals[client_id]['total_sales'] = Decimal(total_sales or 0)
+        totals[client_id]['output_vat'] = Decimal(output_vat or 0)
+    
+    purchases = db.session.query(
+        Purchase.client_id,
+        func.sum(Purchase.subtotal),
+        func.sum(Purchase.vat_amount)
+    ).filter(
+        Purchase.client_id.in_(selected_ids),
+        Purchase.purchase_date >= period_start,
+        Purchase.purchase_date <= period_end
+    ).group_by(Purchase.client_id)
+    
+    for client_id, total_purchases, input_vat in purchases:
+        totals[client_id]['total_purchases'] = Decimal(total_purchases or 0)
+        totals[client_id]['input_vat'] = Decimal(input_vat or 0)
+    
+    for client_totals in totals.values():
+        client_totals['net_vat'] = client_totals['output_vat'] - client_totals['input_vat']
+    
+    return totals
@@ -0,0 +1,238 @@
+import itertools
+import json
+import queue
+import threading
+import uuid
+from collections import defaultdict, deque
+from datetime import date
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+from models import Task, Payment
+from money import Money
+import rollups
+
+# Admins and accountants share one scope; each client gets its own
+STAFF_SCOPE = 'staff'
+
+# Recent events kept per scope so a reconnecting dashboard can catch up
+HISTORY_SIZE = 500
+
+# Events buffered per connection before a slow reader is told to resync
+SUBSCRIBER_QUEUE_SIZE = 100
+
+PENDING_TASK_STATUSES = ('Pending', 'In Progress')
+
+# Stats sent as riyals; they are accumulated as integer halalas
+MONEY_STATS = ('monthly_revenue', 'unpaid_amount')
+
+_PENDING_EVENTS = 'live_pending_events'
+
+# Tells a dashboard to reload its stats because events were lost
+RESYNC = (None, 'resync', '{}')
+
+# Distinguishes event ids from another process or an earlier run
+_BOOT_ID = uuid.uuid4().hex[:8]
+
+def client_scope(client_id):
+    return f'client:{client_id}'
+
+def event_scopes(client_id):
+    """Every scope that should see a change for the given client"""
+    if client_id is None:
+        return [STAFF_SCOPE]
+    return [STAFF_SCOPE, client_scope(client_id)]
+
+class EventBroker:
+    """Fans events out to the dashboards connected to this process"""
+    
+    def __init__(self, history_size=HISTORY_SIZE):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._subscribers = defaultdict(set)
+        self._history = defaultdict(lambda: deque(maxlen=history_size))
+    
+    def _offer(self, subscriber, message):
+        try:
+            subscriber.put_nowait(message)
+        except queue.Full:
+            # Drop the backlog; the dashboard reloads its stats instead
+            while not subscriber.empty():
+                subscriber.get_nowait()
+            subscriber.put_nowait(RESYNC)
+    
+    def publish(self, scopes, kind, data):
+        """Send one event to every subscriber of the given scopes"""
+        with self._lock:
+            sequence = next(self._ids)
+            message = (f'{_BOOT_ID}-{sequence}', kind, json.dumps(data))
+            for scope in scopes:
+                self._history[scope].append((sequence, message))
+                for subscriber in self._subscribers[scope]:
+                    self._offer(subscriber, message)
+    
+    def subscribe(self, scope, last_event_id=None):
+        """
+        Register a new subscriber queue for a scope.
+        When last_event_id is given, events missed since then are queued
+        first, or a resync event if they are no longer in the history.
+        """
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            if last_event_id:
+                boot_id, _, last_sequence = last_event_id.partition('-')
+                history = self._history[scope]
+                if boot_id != _BOOT_ID or not last_sequence.isdigit():
+                    self._offer(subscriber, RESYNC)
+                elif history and history[0][0] > int(last_sequence) + 1:
+                    self._offer(subscriber, RESYNC)
+                else:
+                    for sequence, message in history:
+                        if sequence > int(last_sequence):
+                            self._offer(subscriber, message)
+            self._subscribers[scope].add(subscriber)
+        return subscriber
+    
+    def unsubscribe(self, scope, subscriber):
+        with self._lock:
+            self._subscribers[scope].discard(subscriber)
+            if not self._subscribers[scope]:
+                del self._subscribers[scope]
+    
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+broker = EventBroker()
+
+def format_event(message):
+    """Encode a broker message as a Server-Sent Events frame"""
+    event_id, kind, data = message
+    lines = []
+    if event_id:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {kind}')
+    lines.append(f'data: {data}')
+    return '\n'.join(lines) + '\n\n'
+
+def queue_event(session, client_id, kind, data):
+    """Publish an event once the session's transaction commits"""
+    session.info.setdefault(_PENDING_EVENTS, []).append((client_id, kind, data))
+
+def queue_task_status_changes(session, tasks, new_status):
+    """Queue dashboard events for a set-based task status update"""
+    for task in tasks:
+        _queue_pending_change(session, task.client_id, task.status, new_status)
+        if new_status == 'Completed' and task.status != 'Completed':
+            _queue_completion(session, task.client_id, task.id, task.title)
+
+def _queue_pending_change(session, client_id, old_status, new_status):
+    change = int(new_status in PENDING_TASK_STATUSES) - int(old_status in PENDING_TASK_STATUSES)
+    if change:
+        queue_event(session, client_id, 'stats', {'pending_tasks': change})
+
+def _queue_completion(session, client_id, task_id, title):
+    queue_event(session, client_id, 'activity', {
+        'type': 'task_completed',
+        'task_id': task_id,
+        'title': title
+    })
+
+def _committed_value(obj, field):
+    history = get_history(obj, field)
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return getattr(obj, field)
+
+@event.listens_for(Task.status, 'set', active_history=True)
+@event.listens_for(Task.client_id, 'set', active_history=True)
+def _load_old_task_value(target, value, oldvalue, initiator):
+    # Registered for active_history so an expired old value is loaded first
+    pass
+
+@event.listens_for(Session, 'before_flush')
+def collect_live_events(session, flush_context, instances):
+    """Turn task and payment writes into dashboard events"""
+    with session.no_autoflush:
+        for obj in session.new:
+            if isinstance(obj, Task):
+                _queue_pending_change(session, obj.client_id, None, obj.status or 'Pending')
+            elif isinstance(obj, Payment):
+                queue_event(session, obj.client_id, 'activity', {
+                    'type': 'payment_received',
+                    'invoice_id': obj.invoice_id,
+                    'amount': float(Money.parse(obj.amount))
+                })
+        
+        for obj in session.deleted:
+            if isinstance(obj, Task):
+                _queue_pending_change(session, _committed_value(obj, 'client_id'),
+                                      _committed_value(obj, 'status'), None)
+        
+        for obj in session.dirty:
+            if not isinstance(obj, Task) or not session.is_modified(obj):
+                continue
+            old_client_id = _committed_value(obj, 'client_id')
+            old_status = _committed_value(obj, 'status')
+            if old_client_id != obj.client_id:
+                _queue_pending_change(session, old_client_id, old_status, None)
+                _queue_pending_change(session, obj.client_id, None, obj.status)
+            else:
+                _queue_pending_change(session, obj.client_id, old_status, obj.status)
+            if obj.status == 'Completed' and old_status != 'Completed':
+                _queue_completion(session, obj.client_id, obj.id, obj.title)
+
+@event.listens_for(Session, 'after_commit')
+def publish_live_events(session):
+    stats = defaultdict(lambda: defaultdict(int))
+    for client_id, kind, data in session.info.pop(_PENDING_EVENTS, []):
+        if kind == 'stats':
+            # One stats event per scope and commit, however many rows changed
+            for key, value in data.items():
+                stats[client_id][key] += value
+        else:
+            broker.publish(event_scopes(client_id), kind, data)
+    publish_stats(stats)
+
+@event.listens_for(Session, 'after_rollback')
+def discard_live_events(session):
+    session.info.pop(_PENDING_EVENTS, None)
+
+def publish_stats(stats_by_client):
+    """Publish stat deltas to each client's scope and their sum to staff"""
+    staff_stats = defaultdict(int)
+    for client_id, stats in stats_by_client.items():
+        for key, value in stats.items():
+            staff_stats[key] += value
+        if client_id is not None:
+            _publish_stats(client_scope(client_id), stats)
+    _publish_stats(STAFF_SCOPE, staff_stats)
+
+def _publish_stats(scope, stats):
+    payload = {}
+    for key, value in stats.items():
+        if value:
+            payload[key] = float(Money(value)) if key in MONEY_STATS else value
+    if payload:
+        broker.publish([scope], 'stats', payload)
+
+def publish_invoice_deltas(deltas, payments):
+    """Translate committed rollup and payment deltas into dashboard stat deltas"""
+    current_month = date.today().replace(day=1)
+    stats_by_client = defaultdict(lambda: defaultdict(int))
+    
+    for (client_id, day, status), (count, subtotal, vat_amount, total_amount) in deltas.items():
+        stats = stats_by_client[client_id]
+        stats['total_invoices'] += count
+        if status != 'Paid':
+            stats['unpaid_amount'] += Money.parse(total_amount).halalas
+        elif day >= current_month:
+            stats['monthly_revenue'] += Money.parse(total_amount).halalas
+    for client_id, amount in payments.items():
+        stats_by_client[client_id]['unpaid_amount'] -= Money.parse(amount).halalas
+    
+    publish_stats(stats_by_client)
+
+rollups.commit_listeners.append(publish_invoice_deltas)
@@ -1,3 +1,10 @@
+from gevent import monkey
+
+if monkey.is_module_patched('socket'):
+    # Under the gevent worker, let other requests run while psycopg2 waits on the database
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
 from app import app
 
 if __name__ == "__main__":
@@ -54,6 +54,9 @@ class Company(db.Model):
 
 class Client(db.Model):
     __tablename__ = 'clients'
+    __table_args__ = (
+        db.Index('ix_clients_status_name', 'status', 'name'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
@@ -93,6 +96,11 @@ class ClientDocument(db.Model):
 
 class Invoice(db.Model):
     __tablename__ = 'invoices'
+    __table_args__ = (
+        db.Index('ix_invoices_client_issue_date', 'client_id', 'issue_date'),
+        db.Index('ix_invoices_open_due_date', 'due_date', 'client_id',
+                 postgresql_where=db.text("status <> 'Paid'")),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     invoice_number = db.Column(db.String(50), unique=True, nullable=False)
@@ -103,7 +111,7 @@ class Invoice(db.Model):
     vat_rate = db.Column(db.Numeric(5, 2), default=15.00)  # Saudi VAT rate 15%
     vat_amount = db.Column(db.Numeric(12, 2), nullable=False)
     total_amount = db.Column(db.Numeric(12, 2), nullable=False)
-    status = db.Column(db.String(20), default='Unpaid')  # Paid, Unpaid, Overdue
+    status = db.Column(db.String(20), default='Unpaid')  # Paid, Partially Paid, Unpaid, Overdue
     payment_date = db.Column(db.Date)
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -115,6 +123,36 @@ class Invoice(db.Model):
     # Relationships
     items = db.relationship('InvoiceItem', backref='invoice', lazy='dynamic', cascade='all, delete-orphan')
     attachments = db.relationship('InvoiceAttachment', backref='invoice', lazy='dynamic', cascade='all, delete-orphan')
+    payments = db.relationship('Payment', backref='invoice', lazy='dynamic', cascade='all, delete-orphan')
+
+class InvoiceDailyRollup(db.Model):
+    __tablename__ = 'invoice_daily_rollups'
+    __table_args__ = (
+        db.Index('ix_invoice_daily_rollups_day', 'day'),
+    )
+    
+    # Invoice totals per client, issue day and status, maintained on write
+    client_id = db.Column(db.Integer, db.ForeignKey('clients.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    invoice_count = db.Column(db.Integer, nullable=False, default=0)
+    subtotal = db.Column(db.Numeric(15, 2), nullable=False, default=0)
+    vat_amount = db.Column(db.Numeric(15, 2), nullable=False, default=0)
+    total_amount = db.Column(db.Numeric(15, 2), nullable=False, default=0)
+
+class ClientSummary(db.Model):
+    __tablename__ = 'client_summaries'
+    __table_args__ = (
+        db.Index('ix_client_summaries_outstanding_balance', 'outstanding_balance'),
+    )
+    
+    # Per-client invoice counters, maintained on write alongside the rollups
+    client_id = db.Column(db.Integer, db.ForeignKey('clients.id'), primary_key=True)
+    invoice_count = db.Column(db.Integer, nullable=False, default=0)
+    outstanding_balance = db.Column(db.Numeric(15, 2), nullable=False, default=0)  # Invoices not yet Paid, less their payments
+    last_invoice_date = db.Column(db.Date)
+    
+    client = db.relationship('Client', backref=db.backref('summary', uselist=False, viewonly=True), viewonly=True)
 
 class InvoiceItem(db.Model):
     __tablename__ = 'invoice_items'
@@ -127,6 +165,22 @@ class InvoiceItem(db.Model):
     
     invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id'), nullable=False)
 
+class EInvoice(db.Model):
+    __tablename__ = 'einvoices'
+    
+    # ZATCA e-invoice issued for an invoice; counter and hashes chain every
+    # issued invoice to the one before it
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id'), primary_key=True)
+    uuid = db.Column(db.String(36), unique=True, nullable=False)
+    counter = db.Column(db.Integer, unique=True, nullable=False)  # Invoice counter value (ICV)
+    invoice_hash = db.Column(db.String(64), nullable=False)
+    previous_hash = db.Column(db.String(128), nullable=False)  # Previous invoice hash (PIH)
+    qr_payload = db.Column(db.Text, nullable=False)
+    xml = db.Column(db.Text, nullable=False)
+    issued_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    invoice = db.relationship('Invoice', backref=db.backref('einvoice', uselist=False))
+
 class InvoiceAttachment(db.Model):
     __tablename__ = 'invoice_attachments'
     
@@ -139,8 +193,52 @@ class InvoiceAttachment(db.Model):
     
     invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id'), nullable=False)
 
+class Payment(db.Model):
+    __tablename__ = 'payments'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    amount = db.Column(db.Numeric(12, 2), nullable=False)
+    payment_date = db.Column(db.Date, nullable=False)
+    method = db.Column(db.String(30), default='Bank Transfer')  # Bank Transfer, Cash, Cheque
+    reference = db.Column(db.String(255))
+    notes = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id'), nullable=False, index=True)
+    client_id = db.Column(db.Integer, db.ForeignKey('clients.id'), nullable=False, index=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+
+class Purchase(db.Model):
+    __tablename__ = 'purchases'
+    __table_args__ = (
+        db.Index('ix_purchases_client_purchase_date', 'client_id', 'purchase_date'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    supplier_name = db.Column(db.String(255), nullable=False)
+    supplier_vat_number = db.Column(db.String(50))
+    invoice_number = db.Column(db.String(50))  # Supplier's invoice number
+    purchase_date = db.Column(db.Date, nullable=False)
+    description = db.Column(db.Text)
+    category = db.Column(db.String(50), default='General')  # General, Rent, Utilities, Inventory, Services
+    subtotal = db.Column(db.Numeric(12, 2), nullable=False)
+    vat_rate = db.Column(db.Numeric(5, 2), default=15.00)
+    vat_amount = db.Column(db.Numeric(12, 2), nullable=False)
+    total_amount = db.Column(db.Numeric(12, 2), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    client_id = db.Column(db.Integer, db.ForeignKey('clients.id'), nullable=False)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    
+    client = db.relationship('Client', backref=db.backref('purchases', lazy='dynamic'))
+
 class Task(db.Model):
     __tablename__ = 'tasks'
+    __table_args__ = (
+        # Covers the task dashboard's single scan of open tasks
+        db.Index('ix_tasks_open_due_date', 'due_date', 'priority', 'client_id', 'assigned_to', 'created_by',
+                 postgresql_include=['id'], postgresql_where=db.text("status <> 'Completed'")),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
@@ -177,6 +275,8 @@ class VATCalculation(db.Model):
     
     client_id = db.Column(db.Integer, db.ForeignKey('clients.id'))
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    
+    client = db.relationship('Client', backref=db.backref('vat_calculations', lazy='dynamic'))
 
 class ZakatCalculation(db.Model):
     __tablename__ = 'zakat_calculations'
@@ -198,6 +298,8 @@ class ZakatCalculation(db.Model):
     
     client_id = db.Column(db.Integer, db.ForeignKey('clients.id'))
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    
+    client = db.relationship('Client', backref=db.backref('zakat_calculations', lazy='dynamic'))
 
 class Notification(db.Model):
     __tablename__ = 'notifications'
@@ -215,3 +317,94 @@ class Notification(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     
     recipient = db.relationship('User', backref='notifications')
+
+class ReportJob(db.Model):
+    __tablename__ = 'report_jobs'
+    __table_args__ = (
+        # At most one queued or running job per request, however many arrive at once
+        db.Index('uq_report_jobs_in_flight_params_key', 'params_key', unique=True,
+                 postgresql_where=db.text("status IN ('Queued', 'Running')"),
+                 sqlite_where=db.text("status IN ('Queued', 'Running')")),
+    )
+    
+    id = db.Column(db.String(32), primary_key=True)
+    report = db.Column(db.String(50), nullable=False)
+    # Hash of report name, parameters and scope; identical requests share a job
+    params_key = db.Column(db.String(64), nullable=False, index=True)
+    params = db.Column(db.Text, nullable=False)
+    scope = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default='Queued')  # Queued, Running, Ready, Failed
+    result = db.Column(db.Text)
+    row_count = db.Column(db.Integer)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    expires_at = db.Column(db.DateTime, index=True)
+    
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+
+class ArchivedYear(db.Model):
+    __tablename__ = 'archived_years'
+    
+    # Calendar year whose paid invoices and completed tasks have been moved
+    # to the archive tables below
+    year = db.Column(db.Integer, primary_key=True)
+    invoice_count = db.Column(db.Integer, nullable=False, default=0)
+    task_count = db.Column(db.Integer, nullable=False, default=0)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+def archive_table(model, *indexes):
+    """Table with the columns of model's table, holding the rows archived out of it"""
+    table = model.__table__
+    columns = [
+        db.Column(column.name, column.type, primary_key=column.primary_key,
+                  nullable=column.nullable, autoincrement=False)
+        for column in table.columns
+    ]
+    return db.Table(f'{table.name}_archive', *columns, *indexes)
+
+invoices_archive = archive_table(
+    Invoice,
+    db.Index('ix_invoices_archive_client_issue_date', 'client_id', 'issue_date'),
+    db.Index('ix_invoices_archive_invoice_number', 'invoice_number')
+)
+invoice_items_archive = archive_table(InvoiceItem, db.Index('ix_invoice_items_archive_invoice_id', 'invoice_id'))
+invoice_attachments_archive = archive_table(
+    InvoiceAttachment,
+    db.Index('ix_invoice_attachments_archive_invoice_id', 'invoice_id')
+)
+payments_archive = archive_table(
+    Payment,
+    db.Index('ix_payments_archive_invoice_id', 'invoice_id'),
+    db.Index('ix_payments_archive_client_payment_date', 'client_id', 'payment_date')
+)
+einvoices_archive = archive_table(EInvoice, db.Index('ix_einvoices_archive_counter', 'counter'))
+tasks_archive = archive_table(
+    Task,
+    db.Index('ix_tasks_archive_created_at', 'created_at'),
+    db.Index('ix_tasks_archive_client_id', 'client_id')
+)
+
+class BackupSnapshot(db.Model):
+    __tablename__ = 'backup_snapshots'
+    
+    # A backup taken from this database, or one restored into it
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # full, incremental
+    base_id = db.Column(db.String(32))  # Backup an incremental backup builds on
+    since = db.Column(db.DateTime)  # Incremental backups hold the rows changed after this
+    started_at = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime)
+    restored_at = db.Column(db.DateTime)
+    row_count = db.Column(db.BigInteger)
+    file_count = db.Column(db.Integer)
+
+class BackupFile(db.Model):
+    __tablename__ = 'backup_files'
+    
+    # Content hash of each uploaded file as of the last completed backup;
+    # files whose size and mtime still match are neither re-read nor re-sent
+    path = db.Column(db.String(512), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    mtime = db.Column(db.Float, nullable=False)
+    sha256 = db.Column(db.String(64), nullable=False)
@@ -0,0 +1,193 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+import operator
+from functools import lru_cache
+
+HALALAS_PER_RIYAL = 100
+DEFAULT_CURRENCY = 'SAR'
+
+_HALALA = Decimal('0.01')
+
+def to_halalas(value):
+    """
+    Convert an amount in SAR to integer halalas.
+    Raises ValueError for anything that is not an exact number of halalas.
+    """
+    try:
+        halalas = Decimal(str(value)) * HALALAS_PER_RIYAL
+        if not halalas.is_finite() or halalas != halalas.to_integral_value():
+            raise ValueError
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"Invalid amount: {value!r}")
+    return int(halalas)
+
+def parse_halalas(value, rounding=ROUND_HALF_UP):
+    """
+    Convert an amount to integer halalas, rounding half away from zero to
+    the nearest halala like a NUMERIC(…, 2) column does. None counts as 0.
+    """
+    if value is None:
+        return 0
+    if isinstance(value, Money):
+        return value.halalas
+    if isinstance(value, int):
+        return value * HALALAS_PER_RIYAL
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    # Values read from NUMERIC(…, 2) columns are already whole halalas
+    scaled = value * HALALAS_PER_RIYAL
+    halalas = int(scaled)
+    if scaled == halalas:
+        return halalas
+    return int(value.quantize(_HALALA, rounding=rounding) * HALALAS_PER_RIYAL)
+
+def halalas_to_decimal(halalas):
+    """Convert integer halalas back to a two-decimal Decimal"""
+    return Decimal(halalas) * _HALALA
+
+def format_halalas(halalas):
+    """Format integer halalas as an exact two-decimal string"""
+    if halalas < 0:
+        return '-%d.%02d' % divmod(-halalas, HALALAS_PER_RIYAL)
+    return '%d.%02d' % divmod(halalas, HALALAS_PER_RIYAL)
+
+def scale_halalas(halalas, numerator, denominator):
+    """Multiply by numerator/denominator, rounding half away from zero"""
+    scaled = (abs(halalas) * numerator * 2 + denominator) // (denominator * 2)
+    return -scaled if halalas < 0 else scaled
+
+@lru_cache(maxsize=64)
+def rate_hundredths(rate):
+    """Convert a percentage to hundredths of a percent, e.g. 15.00% -> 1500"""
+    return to_halalas(rate)
+
+def percent_of(amount, rate):
+    """Apply a percentage (e.g. 15 or '2.5') to one halala amount"""
+    return scale_halalas(amount, rate_hundredths(rate), 10000)
+
+def percent_many(amounts, rate):
+    """Apply a percentage (e.g. 15 or '2.5') to a list of halala amounts"""
+    rate = rate_hundredths(rate)
+    return [scale_halalas(amount, rate, 10000) for amount in amounts]
+
+def sum_halalas(values):
+    """
+    Sum amounts of any supported type as integer halalas.
+    Decimal columns are summed exactly in C and converted once; anything
+    else falls back to converting each value.
+    """
+    values = list(values)
+    try:
+        total = sum(values, Decimal(0))
+    except TypeError:
+        total = None
+    if total is not None and total == total.quantize(_HALALA):
+        return int(total * HALALAS_PER_RIYAL)
+    return sum(parse_halalas(value) for value in values)
+
+class Money:
+    """An immutable amount of money held as integer halalas"""
+    
+    __slots__ = ('halalas', 'currency')
+    
+    def __init__(self, halalas=0, currency=DEFAULT_CURRENCY):
+        self.halalas = int(halalas)
+        self.currency = currency
+    
+    @classmethod
+    def parse(cls, value, currency=DEFAULT_CURRENCY):
+        """Build from a Decimal, float, int (riyals) or string amount"""
+        if isinstance(value, Money):
+            return value
+        return cls(parse_halalas(value), currency)
+    
+    @classmethod
+    def sum(cls, values, currency=DEFAULT_CURRENCY):
+        """Sum many amounts without creating an intermediate object per value"""
+        return cls(sum_halalas(values), currency)
+    
+    def percent(self, rate):
+        """Return rate percent of this amount, rounded to the halala"""
+        return Money(percent_many([self.halalas], rate)[0], self.currency)
+    
+    def to_decimal(self):
+        return Decimal(self.halalas).scaleb(-2)
+    
+    def format(self):
+        return f"{format_halalas(self.halalas)} {self.currency}"
+    
+    def _other_halalas(self, other):
+        if isinstance(other, Money):
+            if other.currency != self.currency:
+                raise ValueError(f"Cannot combine {self.currency} and {other.currency}")
+            return other.halalas
+        if other == 0:
+            # Lets sum() start from its default of 0
+            return 0
+        return NotImplemented
+    
+    def __add__(self, other):
+        halalas = self._other_halalas(other)
+        if halalas is NotImplemented:
+            return NotImplemented
+        return Money(self.halalas + halalas, self.currency)
+    
+    __radd__ = __add__
+    
+    def __sub__(self, other):
+        halalas = self._other_halalas(other)
+        if halalas is NotImplemented:
+            return NotImplemented
+        return Money(self.halalas - halalas, self.currency)
+    
+    def __neg__(self):
+        return Money(-self.halalas, self.currency)
+    
+    def __mul__(self, factor):
+        if isinstance(factor, int):
+            return Money(self.halalas * factor, self.currency)
+        return NotImplemented
+    
+    __rmul__ = __mul__
+    
+    def __eq__(self, other):
+        if isinstance(other, Money):
+            return self.halalas == other.halalas and self.currency == other.currency
+        return NotImplemented
+    
+    def _compare(self, other, op):
+        halalas = self._other_halalas(other)
+        if halalas is NotImplemented:
+            return NotImplemented
+        return op(self.halalas, halalas)
+    
+    def __lt__(self, other):
+        return self._compare(other, operator.lt)
+    
+    def __le__(self, other):
+        return self._compare(other, operator.le)
+    
+    def __gt__(self, other):
+        return self._compare(other, operator.gt)
+    
+    def __ge__(self, other):
+        return self._compare(other, operator.ge)
+    
+    def __hash__(self):
+        return hash((self.halalas, self.currency))
+    
+    def __bool__(self):
+        return self.halalas != 0
+    
+    def __float__(self):
+        return self.halalas / HALALAS_PER_RIYAL
+    
+    def __str__(self):
+        return format_halalas(self.halalas)
+    
+    def __format__(self, spec):
+        if spec:
+            return format(self.to_decimal(), spec)
+        return str(self)
+    
+    def __repr__(self):
+        return f"Money({str(self)!r}, {self.currency!r})"
@@ -0,0 +1,824 @@
+import logging
+import os
+import re
+import threading
+from collections import namedtuple
+from functools import cached_property, lru_cache
+from io import BytesIO
+from xml.sax.saxutils import escape
+from flask import current_app, has_app_context
+from reportlab.lib.pagesizes import A4
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER, TA_RIGHT
+from reportlab.lib.utils import simpleSplit, ImageReader
+from reportlab.pdfbase.pdfmetrics import stringWidth, getFont, registerFont
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from reportlab.graphics import renderPDF
+from reportlab.graphics.barcode.qr import QrCodeWidget
+from reportlab.graphics.shapes import Drawing
+from reportlab import rl_config
+from PIL import Image
+from utils import format_currency
+
+logger = logging.getLogger(__name__)
+
+try:
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+except ImportError:
+    # check_arabic_support refuses to start with PDF_ARABIC on and these missing
+    arabic_reshaper = None
+
+# Invoices with more line items than this are drawn on the canvas directly;
+# platypus Table layout grows much slower than linearly with row count
+FAST_PATH_MIN_ITEMS = 50
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+MARGIN = 40
+
+# Write compressed page streams as binary rather than ASCII85 text: files
+# are a fifth smaller and the pure-Python encoder is a large share of the
+# time spent on long documents
+rl_config.useA85 = 0
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Bundled fonts with Arabic coverage; PDF_ARABIC_FONT / PDF_ARABIC_FONT_BOLD
+# point at others, such as Noto Naskh Arabic
+ARABIC_FONT_PATH = os.path.join('static', 'fonts', 'DejaVuSans.ttf')
+ARABIC_BOLD_FONT_PATH = os.path.join('static', 'fonts', 'DejaVuSans-Bold.ttf')
+
+ARABIC_FONT = 'Arabic'
+ARABIC_BOLD_FONT = 'Arabic-Bold'
+
+LOGO_FOLDER = os.path.join('static', 'uploads', 'logos')
+
+# Logos are downsampled to this many pixels (about 200 dpi at the size
+# they are drawn) so a large upload does not inflate every PDF
+LOGO_MAX_PIXELS = (360, 180)
+LOGO_BOX = (120, 60)
+
+HEADER_HEIGHT = 76
+
+QR_SIZE = 90
+
+# Styles are built once per process instead of on every PDF
+STYLES = getSampleStyleSheet()
+
+TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=STYLES['Heading1'],
+    fontSize=18,
+    alignment=TA_CENTER,
+    spaceAfter=30
+)
+
+INVOICE_DETAILS_STYLE = TableStyle([
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+])
+
+INVOICE_ITEMS_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black)
+])
+
+INVOICE_TOTALS_STYLE = TableStyle([
+    ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
+    ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+])
+
+CALCULATION_DETAILS_STYLE = TableStyle([
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 12),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+])
+
+# Added on top of the styles above when the Arabic fonts are available:
+# the third column of label tables holds the Arabic label
+ARABIC_LABELS_STYLE = [
+    ('FONTNAME', (2, 0), (2, -1), ARABIC_BOLD_FONT),
+    ('ALIGN', (2, 0), (2, -1), 'RIGHT'),
+]
+
+ARABIC_TOTALS_STYLE = [
+    ('FONTNAME', (2, 0), (2, -1), ARABIC_BOLD_FONT),
+]
+
+ARABIC_ITEMS_HEADER_STYLE = [
+    ('BACKGROUND', (0, 1), (-1, 1), colors.grey),
+    ('TEXTCOLOR', (0, 1), (-1, 1), colors.whitesmoke),
+    ('FONTNAME', (0, 1), (-1, 1), ARABIC_BOLD_FONT),
+]
+
+BILINGUAL_TITLE_STYLE = ParagraphStyle(
+    'BilingualTitle',
+    parent=TITLE_STYLE,
+    spaceAfter=8
+)
+
+ARABIC_TITLE_STYLE = ParagraphStyle(
+    'ArabicTitle',
+    parent=TITLE_STYLE,
+    fontName=ARABIC_BOLD_FONT,
+    fontSize=16,
+    leading=22,
+    spaceAfter=24
+)
+
+ARABIC_NOTES_STYLE = ParagraphStyle(
+    'ArabicNotes',
+    parent=STYLES['Normal'],
+    fontName=ARABIC_FONT,
+    alignment=TA_RIGHT
+)
+
+LABELS_AR = {
+    'Invoice': 'فاتورة ضريبية',
+    'VAT Calculation Report': 'تقرير احتساب ضريبة القيمة المضافة',
+    'Zakat Calculation Report': 'تقرير احتساب الزكاة',
+    'Invoice Number:': 'رقم الفاتورة',
+    'Issue Date:': 'تاريخ الإصدار',
+    'Due Date:': 'تاريخ الاستحقاق',
+    'Client:': 'العميل',
+    'Status:': 'الحالة',
+    'Description': 'الوصف',
+    'Quantity': 'الكمية',
+    'Unit Price': 'سعر الوحدة',
+    'Total': 'الإجمالي',
+    'Subtotal:': 'المجموع الفرعي',
+    'VAT (15%):': 'ضريبة القيمة المضافة 15%',
+    'Total Amount:': 'المبلغ الإجمالي',
+    'Period:': 'الفترة',
+    'Total Sales:': 'إجمالي المبيعات',
+    'Total Purchases:': 'إجمالي المشتريات',
+    'Output VAT (15%):': 'ضريبة المخرجات 15%',
+    'Input VAT (15%):': 'ضريبة المدخلات 15%',
+    'Net VAT Due:': 'صافي الضريبة المستحقة',
+    'Hijri Year:': 'السنة الهجرية',
+    'Cash and Deposits:': 'النقد والودائع',
+    'Trade Goods:': 'عروض التجارة',
+    'Receivables:': 'الذمم المدينة',
+    'Investments:': 'الاستثمارات',
+    'Total Assets:': 'إجمالي الأصول',
+    'Liabilities:': 'الالتزامات',
+    'Net Wealth:': 'صافي الثروة',
+    'Nisab Threshold:': 'حد النصاب',
+    'Zakat Due (2.5%):': 'الزكاة المستحقة 2.5%',
+    'VAT Number:': 'الرقم الضريبي',
+    'CR Number:': 'السجل التجاري',
+}
+
+Column = namedtuple('Column', ['heading', 'width', 'align', 'wrap', 'heading_ar'], defaults=['left', False, None])
+
+INVOICE_ITEM_COLUMNS = [
+    Column('Description', 3 * inch, 'left', True, LABELS_AR['Description']),
+    Column('Quantity', 1 * inch, 'center', False, LABELS_AR['Quantity']),
+    Column('Unit Price', 1.5 * inch, 'right', False, LABELS_AR['Unit Price']),
+    Column('Total', 1.5 * inch, 'right', False, LABELS_AR['Total'])
+]
+
+ARABIC_TEXT = re.compile('[\u0600-\u06ff\u0750-\u077f\ufb50-\ufdff\ufe70-\ufeff]')
+
+def has_arabic(text):
+    return text is not None and ARABIC_TEXT.search(str(text)) is not None
+
+@lru_cache(maxsize=4096)
+def shape_arabic(text):
+    """Arabic text joined into presentation forms and put in visual order"""
+    if arabic_reshaper is None or not has_arabic(text):
+        return text
+    return get_display(arabic_reshaper.reshape(text))
+
+@lru_cache(maxsize=None)
+def _register_font(name, path):
+    # TrueType fonts are embedded as subsets of the glyphs actually used
+    try:
+        registerFont(TTFont(name, path))
+    except Exception:
+        logger.warning('Could not load PDF font %s from %s; PDFs are rendered in English only', name, path)
+        return None
+    return name
+
+def _font_path(key, default):
+    path = (current_app.config.get(key) if has_app_context() else None) or default
+    return path if os.path.isabs(path) else os.path.join(BASE_DIR, path)
+
+def check_arabic_support(app):
+    """Raise RuntimeError when bilingual PDFs are enabled but cannot be rendered"""
+    if not app.config.get('PDF_ARABIC'):
+        return
+    problems = []
+    if arabic_reshaper is None:
+        problems.append('the arabic_reshaper and python-bidi packages are not installed')
+    with app.app_context():
+        path = _font_path('PDF_ARABIC_FONT', ARABIC_FONT_PATH)
+    if not os.path.exists(path):
+        problems.append(f'the Arabic font {path} does not exist')
+    if problems:
+        raise RuntimeError(f"PDF_ARABIC is enabled but {' and '.join(problems)}; "
+                           'fix this or set PDF_ARABIC=0 for English-only PDFs.')
+
+def arabic_fonts():
+    """(regular, bold) Arabic font names, or None when Arabic can't be rendered"""
+    if arabic_reshaper is None or (has_app_context() and not current_app.config.get('PDF_ARABIC', True)):
+        return None
+    regular = _register_font(ARABIC_FONT, _font_path('PDF_ARABIC_FONT', ARABIC_FONT_PATH))
+    if regular is None:
+        return None
+    bold_path = _font_path('PDF_ARABIC_FONT_BOLD', ARABIC_BOLD_FONT_PATH)
+    if not os.path.exists(bold_path):
+        bold_path = _font_path('PDF_ARABIC_FONT', ARABIC_FONT_PATH)
+    bold = _register_font(ARABIC_BOLD_FONT, bold_path) or regular
+    return regular, bold
+
+def bilingual_fonts(*texts):
+    """
+    Arabic fonts for a bilingual layout when any of texts contains Arabic,
+    else None: English-only documents keep to the standard fonts, so the
+    Arabic font is neither loaded nor embedded for them.
+    """
+    if not any(has_arabic(text) for text in texts):
+        return None
+    return arabic_fonts()
+
+def _company_texts(company):
+    return (company.name_ar, company.address_ar) if company is not None else ()
+
+def label_ar(label):
+    return shape_arabic(LABELS_AR.get(label, ''))
+
+_logo_cache = {}
+_logo_lock = threading.Lock()
+
+def company_logo(company):
+    """
+    The company logo downsampled and re-encoded as JPEG, or None. The
+    decoded image is kept per company until its logo or record changes,
+    and JPEG data is embedded in the PDF as is, without re-encoding.
+    """
+    if company is None or not company.logo_filename:
+        return None
+    version = (company.logo_filename, company.updated_at)
+    with _logo_lock:
+        cached = _logo_cache.get(company.id)
+    if cached and cached[0] == version:
+        return cached[1]
+    
+    path = os.path.join(BASE_DIR, LOGO_FOLDER, company.logo_filename)
+    try:
+        with Image.open(path) as image:
+            image.thumbnail(LOGO_MAX_PIXELS)
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                flattened = Image.new('RGB', image.size, 'white')
+                flattened.paste(image, mask=image.getchannel('A'))
+                image = flattened
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+            output = BytesIO()
+            image.save(output, 'JPEG', quality=90)
+            logo = output.getvalue()
+    except (OSError, ValueError):
+        logger.warning('Could not load company logo %s', path)
+        logo = None
+    
+    with _logo_lock:
+        _logo_cache[company.id] = (version, logo)
+    return logo
+
+def draw_company_header(pdf, company):
+    """Logo, English details on the left and Arabic details on the right"""
+    top = PAGE_HEIGHT - MARGIN
+    fonts = bilingual_fonts(*_company_texts(company))
+    
+    x = MARGIN
+    logo = company_logo(company)
+    if logo:
+        pdf.drawImage(ImageReader(BytesIO(logo)), MARGIN, top - LOGO_BOX[1], *LOGO_BOX,
+                      preserveAspectRatio=True, anchor='nw')
+        x += LOGO_BOX[0] + 10
+    
+    pdf.setFillColor(colors.black)
+    pdf.setFont('Helvetica-Bold', 12)
+    pdf.drawString(x, top - 12, company.name)
+    pdf.setFont('Helvetica', 8)
+    y = top - 26
+    for line in (company.address or '').splitlines()[:3]:
+        pdf.drawString(x, y, line.strip())
+        y -= 10
+    registration = [f'{label} {value}' for label, value in (
+        ('VAT Number:', company.vat_number), ('CR Number:', company.cr_number)
+    ) if value]
+    if registration:
+        pdf.drawString(x, y, '   '.join(registration))
+    
+    if fonts:
+        right = PAGE_WIDTH - MARGIN
+        if company.name_ar:
+            pdf.setFont(fonts[1], 12)
+            pdf.drawRightString(right, top - 12, shape_arabic(company.name_ar))
+        pdf.setFont(fonts[0], 8)
+        y = top - 26
+        for line in (company.address_ar or '').splitlines()[:3]:
+            pdf.drawRightString(right, y, shape_arabic(line.strip()))
+            y -= 10
+    
+    pdf.setStrokeColor(colors.grey)
+    pdf.line(MARGIN, top - HEADER_HEIGHT + 6, PAGE_WIDTH - MARGIN, top - HEADER_HEIGHT + 6)
+    pdf.setStrokeColor(colors.black)
+    return top - HEADER_HEIGHT
+
+def _build(story, company=None):
+    buffer = BytesIO()
+    if company is None:
+        SimpleDocTemplate(buffer, pagesize=A4).build(story)
+    else:
+        doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=MARGIN + HEADER_HEIGHT + 10)
+        doc.build(story, onFirstPage=lambda pdf, doc: draw_company_header(pdf, company))
+    buffer.seek(0)
+    return buffer
+
+def _title(title, fonts):
+    if not fonts:
+        return [Paragraph(title, TITLE_STYLE)]
+    return [
+        Paragraph(title, BILINGUAL_TITLE_STYLE),
+        Paragraph(label_ar(title.split(' #')[0]), ARABIC_TITLE_STYLE)
+    ]
+
+def _label_table(rows, widths, style, fonts, arabic_style=ARABIC_LABELS_STYLE):
+    """A label/value table; with Arabic fonts it gains an Arabic label column"""
+    if not fonts:
+        table = Table(rows, colWidths=widths)
+        table.setStyle(style)
+        return table
+    
+    commands = list(arabic_style)
+    data = []
+    for row_number, (label, value) in enumerate(rows):
+        value = str(value)
+        if has_arabic(value):
+            value = shape_arabic(value)
+            commands.append(('FONTNAME', (1, row_number), (1, row_number), fonts[0]))
+        data.append([label, value, label_ar(label)])
+    
+    scale = 6.2 * inch / (sum(widths) + widths[0])
+    table = Table(data, colWidths=[width * scale for width in widths + [widths[0]]])
+    table.setStyle(style)
+    table.setStyle(commands)
+    return table
+
+class CanvasTable:
+    """
+    Streams table rows onto a canvas: pages break automatically and the
+    column headings repeat on each new page. Only the rows of the current
+    page are held; each page is drawn as one background, one text object
+    and one path of grid lines. Cells containing Arabic are shaped and set
+    in the Arabic font; when bilingual and the Arabic fonts are available,
+    Arabic headings are drawn under the English ones.
+    on_new_page(pdf, page_number) draws any running header and returns the
+    y position where the table continues.
+    """
+    
+    def __init__(self, pdf, columns, top, on_new_page=None, font_size=9, padding=3,
+                 header_fill=colors.grey, row_fill=None, grid=False, bottom=MARGIN, left=MARGIN,
+                 bilingual=True):
+        self.pdf = pdf
+        self.columns = columns
+        self.on_new_page = on_new_page
+        self.font_size = font_size
+        self.leading = font_size * 1.2
+        self.padding = padding
+        self.header_fill = header_fill
+        self.row_fill = row_fill
+        self.grid = grid
+        self.bottom = bottom
+        self.left = left
+        self.width = sum(column.width for column in columns)
+        self.bilingual = bilingual and any(column.heading_ar for column in columns) and bool(self.fonts)
+        self.page_number = 1
+        self.y = top
+        self._header_top = None
+        self._rows_top = None
+        self._rows = []
+        self._draw_header()
+    
+    @cached_property
+    def fonts(self):
+        # Only loaded once a bilingual header or an Arabic cell needs them
+        return arabic_fonts()
+    
+    def _row_height(self, line_count):
+        return line_count * self.leading + 2 * self.padding
+    
+    def _draw_cells(self, text, cells, y):
+        current = None
+        x = self.left
+        for column, value in zip(self.columns, cells):
+            for number, (line, width, font) in enumerate(value):
+                if not line:
+                    continue
+                if font != current:
+                    text.setFont(font, self.font_size)
+                    current = font
+                baseline = y - self.padding - self.font_size - number * self.leading
+                if column.align == 'right':
+                    start = x + column.width - self.padding - width
+                elif column.align == 'center':
+                    start = x + (column.width - width) / 2
+                else:
+                    start = x + self.padding
+                text.setTextOrigin(start, baseline)
+                text.textOut(line)
+            x += column.width
+    
+    def _draw_header(self):
+        height = self._row_height(2 if self.bilingual else 1)
+        self._header_top = self.y
+        if self.header_fill is not None:
+            self.pdf.setFillColor(self.header_fill)
+            self.pdf.rect(self.left, self.y - height, self.width, height, stroke=0, fill=1)
+        text = self.pdf.beginText()
+        text.setFillColor(colors.whitesmoke if self.header_fill is not None else colors.black)
+        headings = []
+        for column in self.columns:
+            lines = [(column.heading, text_width(column.heading, 'Helvetica-Bold', self.font_size), 'Helvetica-Bold')]
+            if self.bilingual and column.heading_ar:
+                heading = shape_arabic(column.heading_ar)
+                lines.append((heading, stringWidth(heading, self.fonts[1], self.font_size), self.fonts[1]))
+            headings.append(lines)
+        self._draw_cells(text, headings, self.y)
+        self.pdf.drawText(text)
+        self.pdf.setFillColor(colors.black)
+        self.y -= height
+        self._rows_top = self.y
+    
+    def _flush_page(self):
+        """Draw the rows collected for the current page"""
+        if self._rows_top is None:
+            return
+        pdf = self.pdf
+        
+        if self.row_fill is not None and self._rows:
+            pdf.setFillColor(self.row_fill)
+            pdf.rect(self.left, self.y, self.width, self._rows_top - self.y, stroke=0, fill=1)
+            pdf.setFillColor(colors.black)
+        
+        text = pdf.beginText()
+        for cells, y in self._rows:
+            self._draw_cells(text, cells, y)
+        pdf.drawText(text)
+        
+        if self.grid:
+            top = self._header_top if self._header_top is not None else self._rows_top
+            right = self.left + self.width
+            segments = [(self.left, top, right, top), (self.left, self._rows_top, right, self._rows_top)]
+            segments.extend((self.left, y - height, right, y - height) for y, height in self._row_bounds())
+            x = self.left
+            segments.append((x, top, x, self.y))
+            for column in self.columns:
+                x += column.width
+                segments.append((x, top, x, self.y))
+            pdf.lines(segments)
+        
+        self._rows = []
+        self._header_top = None
+        self._rows_top = None
+    
+    def _row_bounds(self):
+        bounds = []
+        for index, (cells, y) in enumerate(self._rows):
+            next_y = self._rows[index + 1][1] if index + 1 < len(self._rows) else self.y
+            bounds.append((y, y - next_y))
+        return bounds
+    
+    def new_page(self, repeat_header=True):
+        self._flush_page()
+        self.pdf.showPage()
+        self.page_number += 1
+        self.y = self.on_new_page(self.pdf, self.page_number) if self.on_new_page else PAGE_HEIGHT - MARGIN
+        if repeat_header:
+            self._draw_header()
+    
+    def _arabic_cell(self, value, column, inner, bold):
+        # Wrap or clip in logical order, then shape each line for display
+        font = self.fonts[1 if bold else 0]
+        if stringWidth(value, font, self.font_size) <= inner:
+            lines = [value]
+        elif column.wrap:
+            lines = simpleSplit(value, font, self.font_size, inner)
+        else:
+            lines = [_clip(value, inner, font, self.font_size)]
+        shaped = [shape_arabic(line) for line in lines]
+        return [(line, stringWidth(line, font, self.font_size), font) for line in shaped]
+    
+    def add_row(self, cells, bold=False):
+        font = 'Helvetica-Bold' if bold else 'Helvetica'
+        wrapped = []
+        line_count = 1
+        for column, value in zip(self.columns, cells):
+            value = str(value)
+            inner = column.width - 2 * self.padding
+            if has_arabic(value) and self.fonts:
+                lines = self._arabic_cell(value, column, inner, bold)
+                line_count = max(line_count, len(lines))
+                wrapped.append(lines)
+                continue
+            width = text_width(value, font, self.font_size)
+            if width <= inner:
+                wrapped.append([(value, width, font)])
+            elif column.wrap:
+                lines = simpleSplit(value, font, self.font_size, inner)
+                line_count = max(line_count, len(lines))
+                wrapped.append([(line, text_width(line, font, self.font_size), font) for line in lines])
+            else:
+                value = _clip(value, inner, font, self.font_size)
+                wrapped.append([(value, text_width(value, font, self.font_size), font)])
+        
+        height = self._row_height(line_count)
+        if self.y - height < self.bottom:
+            self.new_page()
+        
+        self._rows.append((wrapped, self.y))
+        self.y -= height
+    
+    def finish(self):
+        """Draw the remaining rows and return the y position below the table"""
+        self._flush_page()
+        return self.y
+    
+    def ensure_space(self, height):
+        """Start a new page, without headings, unless height points remain"""
+        if self.y - height < self.bottom:
+            self.new_page(repeat_header=False)
+        return self.y
+
+@lru_cache(maxsize=None)
+def _char_widths(font):
+    # Glyph widths of a standard font by character, in 1/1000 em
+    widths = getFont(font).widths
+    table = {}
+    for code in range(256):
+        try:
+            table[bytes([code]).decode('cp1252')] = widths[code]
+        except UnicodeDecodeError:
+            pass
+    return table
+
+def text_width(text, font, font_size):
+    """stringWidth with a per-font lookup table for the common characters"""
+    try:
+        return sum(map(_char_widths(font).__getitem__, text)) * font_size / 1000
+    except (KeyError, AttributeError):
+        return stringWidth(text, font, font_size)
+
+def _clip(text, width, font, font_size):
+    # Keep single-line cells inside their column
+    while text and text_width(text + '…', font, font_size) > width:
+        text = text[:-1]
+    return text + '…'
+
+def _page_number_footer(pdf, page_number):
+    pdf.setFont('Helvetica', 8)
+    pdf.drawRightString(PAGE_WIDTH - MARGIN, MARGIN / 2, f'Page {page_number}')
+
+def _invoice_details(invoice, fonts=None):
+    details = [
+        ['Invoice Number:', invoice.invoice_number],
+        ['Issue Date:', invoice.issue_date.strftime('%Y-%m-%d')],
+        ['Due Date:', invoice.due_date.strftime('%Y-%m-%d') if invoice.due_date else 'N/A'],
+        ['Client:', invoice.client.name],
+        ['Status:', invoice.status],
+    ]
+    name_ar = getattr(invoice.client, 'name_ar', None)
+    if fonts and name_ar:
+        details.insert(4, ['', name_ar])
+    return details
+
+def _invoice_totals(invoice):
+    return [
+        ['Subtotal:', format_currency(invoice.subtotal)],
+        ['VAT (15%):', format_currency(invoice.vat_amount)],
+        ['Total Amount:', format_currency(invoice.total_amount)],
+    ]
+
+def _item_cells(item):
+    return [
+        str(item.description),
+        str(item.quantity),
+        format_currency(item.unit_price),
+        format_currency(item.total_price)
+    ]
+
+def _items_table(rows, fonts):
+    columns = INVOICE_ITEM_COLUMNS
+    data = [[column.heading for column in columns]]
+    commands = []
+    if fonts:
+        data.append([shape_arabic(column.heading_ar) for column in columns])
+        commands.extend(ARABIC_ITEMS_HEADER_STYLE)
+    for cells in rows:
+        if fonts:
+            for index, value in enumerate(cells):
+                if has_arabic(value):
+                    cells[index] = shape_arabic(value)
+                    commands.append(('FONTNAME', (index, len(data)), (index, len(data)), fonts[0]))
+        data.append(cells)
+    
+    table = Table(data, colWidths=[column.width for column in columns])
+    table.setStyle(INVOICE_ITEMS_STYLE)
+    if commands:
+        table.setStyle(commands)
+    return table
+
+def qr_drawing(payload, size=QR_SIZE):
+    """QR code of an e-invoice payload as a drawing (also a platypus flowable)"""
+    widget = QrCodeWidget(payload)
+    left, bottom, right, top = widget.getBounds()
+    drawing = Drawing(size, size, transform=[size / (right - left), 0, 0, size / (top - bottom), 0, 0])
+    drawing.add(widget)
+    return drawing
+
+def generate_invoice_pdf(invoice, items=None, company=None, qr_payload=None):
+    """
+    Generate PDF for invoice. items defaults to the invoice's line items;
+    long invoices take the canvas fast path. With a company the PDF gets
+    its letterhead. Invoices with Arabic content (company or client
+    details, item descriptions) get Arabic labels when the Arabic fonts
+    are available; an e-invoice QR payload is printed below the totals.
+    """
+    item_count = invoice.items.count() if items is None else len(items)
+    if item_count > FAST_PATH_MIN_ITEMS:
+        return _canvas_invoice_pdf(invoice, invoice.items if items is None else items, company, qr_payload)
+    
+    rows = [_item_cells(item) for item in (invoice.items if items is None else items)] if item_count > 0 else []
+    fonts = bilingual_fonts(getattr(invoice.client, 'name_ar', None), *_company_texts(company),
+                            *(row[0] for row in rows))
+    story = _title(f"Invoice #{invoice.invoice_number}", fonts)
+    story.append(_label_table(_invoice_details(invoice, fonts), [2*inch, 3*inch], INVOICE_DETAILS_STYLE, fonts))
+    story.append(Spacer(1, 20))
+    
+    if rows:
+        story.append(_items_table(rows, fonts))
+        story.append(Spacer(1, 20))
+    
+    story.append(_label_table(_invoice_totals(invoice), [2*inch, 2*inch], INVOICE_TOTALS_STYLE, fonts, ARABIC_TOTALS_STYLE))
+    
+    if qr_payload:
+        story.append(Spacer(1, 20))
+        story.append(qr_drawing(qr_payload))
+    
+    return _build(story, company)
+
+def _draw_label_rows(pdf, rows, left, widths, y, fonts, bold_rows=(), right_aligned=False):
+    """
+    Label/value rows drawn straight onto the canvas; widths are (label,
+    value, Arabic label) and the Arabic labels are right-aligned.
+    """
+    label_width, value_width, arabic_width = widths
+    arabic_right = left + label_width + value_width + arabic_width
+    for index, (label, value) in enumerate(rows):
+        value = str(value)
+        bold = index in bold_rows
+        pdf.setFont('Helvetica-Bold' if bold or not right_aligned else 'Helvetica', 10)
+        if right_aligned:
+            pdf.drawRightString(left + label_width, y, label)
+        else:
+            pdf.drawString(left, y, label)
+        
+        value_font = 'Helvetica-Bold' if bold else 'Helvetica'
+        if fonts and has_arabic(value):
+            value, value_font = shape_arabic(value), fonts[0]
+        pdf.setFont(value_font, 10)
+        if right_aligned:
+            pdf.drawRightString(left + label_width + value_width, y, value)
+        else:
+            pdf.drawString(left + label_width, y, value)
+        
+        if fonts and label:
+            pdf.setFont(fonts[1], 10)
+            pdf.drawRightString(arabic_right, y, label_ar(label))
+        y -= 18
+    return y
+
+def _canvas_invoice_pdf(invoice, items, company=None, qr_payload=None):
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    # Items are streamed, so only the company and client decide the labels
+    fonts = bilingual_fonts(getattr(invoice.client, 'name_ar', None), *_company_texts(company))
+    
+    y = draw_company_header(pdf, company) if company is not None else PAGE_HEIGHT - MARGIN
+    pdf.setFont('Helvetica-Bold', 18)
+    pdf.drawCentredString(PAGE_WIDTH / 2, y - 18, f"Invoice #{invoice.invoice_number}")
+    y -= 54
+    if fonts:
+        pdf.setFont(fonts[1], 16)
+        pdf.drawCentredString(PAGE_WIDTH / 2, y + 10, label_ar('Invoice'))
+        y -= 24
+    
+    widths = (1.7 * inch, 2.8 * inch, 1.7 * inch) if fonts else (2 * inch, 3 * inch, 0)
+    left = (PAGE_WIDTH - sum(widths)) / 2
+    y = _draw_label_rows(pdf, _invoice_details(invoice, fonts), left, widths, y, fonts) - 20
+    
+    _page_number_footer(pdf, 1)
+    
+    def continuation(pdf, page_number):
+        _page_number_footer(pdf, page_number)
+        pdf.setFont('Helvetica', 8)
+        pdf.drawString(MARGIN, PAGE_HEIGHT - MARGIN, f"Invoice #{invoice.invoice_number} (continued)")
+        return PAGE_HEIGHT - MARGIN - 12
+    
+    table = CanvasTable(pdf, INVOICE_ITEM_COLUMNS, y, on_new_page=continuation, font_size=10,
+                        left=(PAGE_WIDTH - sum(column.width for column in INVOICE_ITEM_COLUMNS)) / 2,
+                        row_fill=colors.beige, grid=True, bilingual=bool(fonts))
+    for item in items:
+        table.add_row(_item_cells(item))
+    table.finish()
+    
+    y = table.ensure_space(3 * 18 + 20) - 20
+    if fonts:
+        widths = (1.4 * inch, 1.4 * inch, 2 * inch)
+        left = (PAGE_WIDTH + table.width) / 2 - sum(widths)
+    else:
+        widths = (2 * inch, 2 * inch, 0)
+        left = (PAGE_WIDTH - 4 * inch) / 2
+    # Continue below the totals, on a new page if the QR code does not fit
+    table.y = _draw_label_rows(pdf, _invoice_totals(invoice), left, widths, y, fonts, bold_rows=(2,), right_aligned=True)
+    
+    if qr_payload:
+        y = table.ensure_space(QR_SIZE + 10) - QR_SIZE - 10
+        renderPDF.draw(qr_drawing(qr_payload), pdf, (PAGE_WIDTH - table.width) / 2, y)
+    
+    pdf.save()
+    buffer.seek(0)
+    return buffer
+
+def _calculation_report_pdf(title, details, notes, company=None):
+    fonts = bilingual_fonts(notes, *(value for _, value in details), *_company_texts(company))
+    story = _title(title, fonts)
+    story.append(_label_table(details, [2*inch, 3*inch], CALCULATION_DETAILS_STYLE, fonts))
+    
+    if notes:
+        story.append(Spacer(1, 20))
+        if fonts and has_arabic(notes):
+            story.append(Paragraph(
+                f'{escape(shape_arabic(notes))} :<font name="{fonts[1]}">{shape_arabic("ملاحظات")}</font>',
+                ARABIC_NOTES_STYLE
+            ))
+        else:
+            story.append(Paragraph(f"<b>Notes:</b> {notes}", STYLES['Normal']))
+    
+    return _build(story, company)
+
+def _client_rows(client):
+    rows = [['Client:', client.name if client else 'N/A']]
+    if client is not None and client.name_ar and arabic_fonts():
+        rows.append(['', client.name_ar])
+    return rows
+
+def generate_vat_report_pdf(vat_calculation, company=None):
+    """Generate PDF for VAT calculation report"""
+    return _calculation_report_pdf("VAT Calculation Report", [
+        ['Period:', f"{vat_calculation.period_start.strftime('%Y-%m-%d')} to {vat_calculation.period_end.strftime('%Y-%m-%d')}"],
+        *_client_rows(vat_calculation.client),
+        ['Total Sales:', format_currency(vat_calculation.total_sales)],
+        ['Total Purchases:', format_currency(vat_calculation.total_purchases)],
+        ['Output VAT (15%):', format_currency(vat_calculation.output_vat)],
+        ['Input VAT (15%):', format_currency(vat_calculation.input_vat)],
+        ['Net VAT Due:', format_currency(vat_calculation.net_vat)],
+        ['Status:', vat_calculation.status],
+    ], vat_calculation.notes, company)
+
+def generate_zakat_report_pdf(zakat_calculation, company=None):
+    """Generate PDF for Zakat calculation report"""
+    return _calculation_report_pdf("Zakat Calculation Report", [
+        ['Hijri Year:', zakat_calculation.hijri_year],
+        *_client_rows(zakat_calculation.client),
+        ['Cash and Deposits:', format_currency(zakat_calculation.cash_and_deposits)],
+        ['Trade Goods:', format_currency(zakat_calculation.trade_goods)],
+        ['Receivables:', format_currency(zakat_calculation.receivables)],
+        ['Investments:', format_currency(zakat_calculation.investments)],
+        ['Total Assets:', format_currency(zakat_calculation.total_assets)],
+        ['Liabilities:', format_currency(zakat_calculation.liabilities)],
+        ['Net Wealth:', format_currency(zakat_calculation.net_wealth)],
+        ['Nisab Threshold:', format_currency(zakat_calculation.nisab_threshold)],
+        ['Zakat Due (2.5%):', format_currency(zakat_calculation.zakat_due)],
+        ['Status:', zakat_calculation.status],
+    ], zakat_calculation.notes, company)
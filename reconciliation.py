@@ -0,0 +1,272 @@
+import csv
+import re
+from collections import defaultdict
+from datetime import datetime
+from decimal import InvalidOperation
+from io import TextIOWrapper
+from sqlalchemy import func, insert
+from app import db
+from models import Invoice, Client, Payment
+from utils import parse_csv_date, pick_csv_value
+from money import Money, parse_halalas, format_halalas
+from rollups import move_invoices_to_status, record_bulk_payments
+from live import queue_event
+
+# Rows per INSERT statement when applying matches
+INSERT_CHUNK_SIZE = 1000
+
+# Accepted bank statement headers (compared lower-cased)
+DATE_HEADERS = ('date', 'transaction date', 'value date', 'posting date')
+AMOUNT_HEADERS = ('amount', 'credit', 'deposit')
+REFERENCE_HEADERS = ('reference', 'ref', 'narrative')
+DESCRIPTION_HEADERS = ('description', 'details', 'memo')
+
+TOKEN_PATTERN = re.compile(r'[A-Za-z0-9][A-Za-z0-9\-/]*')
+VAT_NUMBER_PATTERN = re.compile(r'\b\d{15}\b')
+
+def iter_statement_lines(stream):
+    """
+    Stream a bank statement CSV and yield normalized credit lines.
+    Each line is (line_number, date, amount, reference, text); unparseable
+    rows are yielded with a None amount so they can be reported.
+    """
+    if not isinstance(stream, TextIOWrapper):
+        stream = TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if not header:
+        return
+    header = [column.strip().lower() for column in header]
+    
+    for line_number, values in enumerate(reader, start=2):
+        row = dict(zip(header, values))
+        raw_amount = pick_csv_value(row, AMOUNT_HEADERS).replace(',', '')
+        try:
+            amount = parse_halalas(raw_amount)
+        except (InvalidOperation, ValueError):
+            amount = None
+        
+        reference = pick_csv_value(row, REFERENCE_HEADERS)
+        description = pick_csv_value(row, DESCRIPTION_HEADERS)
+        yield (line_number, parse_csv_date(pick_csv_value(row, DATE_HEADERS)), amount,
+               reference, f"{reference} {description}")
+
+class OpenInvoiceIndex:
+    """In-memory hash indexes over open invoices for statement matching"""
+    
+    def __init__(self):
+        self.balances = {}
+        self.client_of = {}
+        self.by_number = {}
+        self.by_amount = defaultdict(list)
+        self.by_client = defaultdict(list)
+        self.by_vat = {}
+    
+    @classmethod
+    def load(cls):
+        """Build the indexes from a single streamed query"""
+        index = cls()
+        
+        paid = db.session.query(
+            Payment.invoice_id,
+            func.sum(Payment.amount).label('paid')
+        ).group_by(Payment.invoice_id).subquery()
+        
+        rows = db.session.query(
+            Invoice.id,
+            Invoice.invoice_number,
+            Invoice.total_amount,
+            Invoice.client_id,
+            Client.vat_number,
+            func.coalesce(paid.c.paid, 0).label('paid')
+        ).join(Client, Invoice.client_id == Client.id).outerjoin(
+            paid, paid.c.invoice_id == Invoice.id
+        ).filter(
+            Invoice.status != 'Paid'
+        ).order_by(Invoice.issue_date, Invoice.id).yield_per(5000)
+        
+        for row in rows:
+            balance = parse_halalas(row.total_amount) - parse_halalas(row.paid)
+            if balance <= 0:
+                continue
+            index.balances[row.id] = balance
+            index.client_of[row.id] = row.client_id
+            index.by_number[row.invoice_number.upper()] = row.id
+            index.by_amount[balance].append(row.id)
+            index.by_client[row.client_id].append(row.id)
+            if row.vat_number:
+                index.by_vat[row.vat_number.strip()] = row.client_id
+        
+        return index
+    
+    def allocate(self, invoice_ids, amount):
+        """Spread amount over invoice_ids in order, returning (invoice_id, amount) pairs"""
+        allocations = []
+        for invoice_id in invoice_ids:
+            if amount <= 0:
+                break
+            balance = self.balances.get(invoice_id, 0)
+            if balance <= 0:
+                continue
+            applied = min(balance, amount)
+            self.balances[invoice_id] = balance - applied
+            amount -= applied
+            allocations.append((invoice_id, applied))
+        return allocations, amount
+    
+    def match(self, amount, text):
+        """
+        Match one statement line, trying invoice number, then client VAT
+        number, then a unique open balance equal to the amount.
+        Returns (matched_by, allocations, unallocated_amount).
+        """
+        for token in TOKEN_PATTERN.findall(text):
+            invoice_id = self.by_number.get(token.upper())
+            if invoice_id and self.balances[invoice_id] > 0:
+                # Any overpayment rolls onto the same client's oldest open invoices
+                client_invoices = self.by_client[self.client_of[invoice_id]]
+                allocations, rest = self.allocate([invoice_id] + client_invoices, amount)
+                return 'invoice_number', allocations, rest
+        
+        for vat_number in VAT_NUMBER_PATTERN.findall(text):
+            client_id = self.by_vat.get(vat_number)
+            if client_id:
+                client_invoices = self.by_client[client_id]
+                exact = [i for i in client_invoices if self.balances[i] == amount]
+                allocations, rest = self.allocate(exact[:1] + client_invoices, amount)
+                if allocations:
+                    return 'vat_number', allocations, rest
+        
+        candidates = [i for i in self.by_amount.get(amount, ()) if self.balances[i] == amount]
+        if len(candidates) == 1:
+            allocations, rest = self.allocate(candidates, amount)
+            return 'amount', allocations, rest
+        if candidates:
+            return 'ambiguous', [], amount
+        
+        return None, [], amount
+
+def reconcile_statement(stream, created_by, apply=True):
+    """
+    Match a bank statement against open invoices and optionally apply the
+    matches as Payment rows in bulk. Amounts are matched as integer halalas.
+    Returns a summary with per-line results for every line that was not
+    fully allocated.
+    """
+    index = OpenInvoiceIndex.load()
+    
+    payments = []
+    paid_on = {}
+    summary = {
+        'lines': 0,
+        'matched': 0,
+        'partial': 0,
+        'unmatched': 0,
+        'matched_amount': 0,
+        'issues': []
+    }
+    
+    for line_number, payment_date, amount, reference, text in iter_statement_lines(stream):
+        summary['lines'] += 1
+        
+        if amount is None or payment_date is None:
+            summary['issues'].append({'line': line_number, 'result': 'invalid'})
+            continue
+        if amount <= 0:
+            # Debits are not customer payments
+            continue
+        
+        matched_by, allocations, rest = index.match(amount, text)
+        
+        for invoice_id, applied in allocations:
+            payments.append({
+                'invoice_id': invoice_id,
+                'client_id': index.client_of[invoice_id],
+                'amount': Money(applied).to_decimal(),
+                'payment_date': payment_date,
+                'method': 'Bank Transfer',
+                'reference': reference[:255] or None,
+                'notes': f'Bank statement line {line_number}',
+                'created_by': created_by,
+                'created_at': datetime.utcnow()
+            })
+            paid_on[invoice_id] = payment_date
+            summary['matched_amount'] += applied
+        
+        if not allocations:
+            summary['unmatched'] += 1
+            summary['issues'].append({'line': line_number, 'result': matched_by or 'unmatched',
+                                      'amount': format_halalas(amount)})
+        elif rest > 0:
+            summary['partial'] += 1
+            summary['issues'].append({'line': line_number, 'result': 'unallocated',
+                                      'amount': format_halalas(rest), 'matched_by': matched_by})
+        else:
+            summary['matched'] += 1
+    
+    summary['matched_amount'] = Money(summary['matched_amount']).to_decimal()
+    
+    if apply and payments:
+        apply_payments(payments, paid_on, index)
+    
+    return summary
+
+def apply_payments(payments, paid_on, index):
+    """Insert payments in chunks and update invoice statuses with set-based UPDATEs"""
+    record_bulk_payments(payments)
+    for start in range(0, len(payments), INSERT_CHUNK_SIZE):
+        db.session.execute(insert(Payment), payments[start:start + INSERT_CHUNK_SIZE])
+    
+    # One dashboard event per client rather than per statement line
+    received = defaultdict(list)
+    for payment in payments:
+        received[payment['client_id']].append(payment['amount'])
+    for client_id, amounts in received.items():
+        queue_event(db.session, client_id, 'activity', {
+            'type': 'payments_reconciled',
+            'count': len(amounts),
+            'amount': float(Money.sum(amounts))
+        })
+    
+    settled_by_date = defaultdict(list)
+    partial_ids = []
+    for invoice_id, payment_date in paid_on.items():
+        if index.balances[invoice_id] <= 0:
+            settled_by_date[payment_date].append(invoice_id)
+        else:
+            partial_ids.append(invoice_id)
+    
+    # One UPDATE per distinct payment date; statements only span a few dates
+    for payment_date, invoice_ids in settled_by_date.items():
+        move_invoices_to_status(invoice_ids, 'Paid')
+        Invoice.query.filter(Invoice.id.in_(invoice_ids)).update(
+            {Invoice.status: 'Paid', Invoice.payment_date: payment_date},
+            synchronize_session=False
+        )
+    
+    if partial_ids:
+        move_invoices_to_status(partial_ids, 'Partially Paid')
+        Invoice.query.filter(Invoice.id.in_(partial_ids)).update(
+            {Invoice.status: 'Partially Paid'},
+            synchronize_session=False
+        )
+    
+    db.session.commit()
+
+def refresh_payment_status(invoice):
+    """Set an invoice's status from the sum of its recorded payments"""
+    paid = db.session.query(func.coalesce(func.sum(Payment.amount), 0)).filter(
+        Payment.invoice_id == invoice.id
+    ).scalar()
+    
+    if paid >= invoice.total_amount:
+        invoice.status = 'Paid'
+        invoice.payment_date = db.session.query(func.max(Payment.payment_date)).filter(
+            Payment.invoice_id == invoice.id
+        ).scalar()
+    elif paid > 0:
+        invoice.status = 'Partially Paid'
+        invoice.payment_date = None
+    
+    return paid
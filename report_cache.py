@@ -0,0 +1,193 @@
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from datetime import date
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import Invoice, Client, Task, User, VATCalculation, ZakatCalculation
+
+logger = logging.getLogger(__name__)
+
+# Tables whose writes invalidate cached reports, by data-version name
+TRACKED_MODELS = {
+    Invoice: 'invoices',
+    Client: 'clients',
+    VATCalculation: 'vat',
+    ZakatCalculation: 'zakat',
+    Task: 'tasks',
+    User: 'users'
+}
+
+# Shared backend entries are dropped after this long even if never invalidated
+SHARED_ENTRY_SECONDS = 3600
+
+_CHANGED_TABLES = 'report_cache_changed'
+
+class LocalBackend:
+    """Bounded LRU kept in this process"""
+    
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+    
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def versions(self, names):
+        with self._lock:
+            return [self._versions.get(name, 0) for name in names]
+    
+    def bump(self, names):
+        with self._lock:
+            for name in names:
+                self._versions[name] = self._versions.get(name, 0) + 1
+    
+    def size(self):
+        return len(self._entries)
+
+class RedisBackend:
+    """Cache shared by every process, so a write anywhere invalidates everywhere"""
+    
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+    
+    def get(self, key):
+        value = self.client.get(f'report_cache:entry:{key}')
+        return json.loads(value) if value is not None else None
+    
+    def set(self, key, value):
+        self.client.set(f'report_cache:entry:{key}', json.dumps(value), ex=SHARED_ENTRY_SECONDS)
+    
+    def versions(self, names):
+        values = self.client.mget([f'report_cache:version:{name}' for name in names])
+        return [int(value or 0) for value in values]
+    
+    def bump(self, names):
+        pipeline = self.client.pipeline()
+        for name in names:
+            pipeline.incr(f'report_cache:version:{name}')
+        pipeline.execute()
+    
+    def size(self):
+        return None
+
+_backend = None
+_backend_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+def get_backend():
+    """Create the configured backend on first use"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                url = current_app.config.get('REPORT_CACHE_URL')
+                if url:
+                    try:
+                        _backend = RedisBackend(url)
+                    except ImportError:
+                        logger.warning('redis is not installed; using the in-process report cache')
+                if _backend is None:
+                    _backend = LocalBackend(current_app.config.get('REPORT_CACHE_SIZE', 256))
+    return _backend
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+def cached_report(report, params, scope, depends_on, compute):
+    """
+    Return compute() for a report, reusing an earlier result while none of
+    the tables it depends on have been written to since.
+    """
+    backend = get_backend()
+    versions = backend.versions(depends_on)
+    payload = json.dumps({
+        'report': report,
+        'params': params,
+        'scope': scope,
+        'versions': dict(zip(depends_on, versions)),
+        # Overdue counts and default ranges move with the calendar
+        'as_of': date.today().isoformat()
+    }, sort_keys=True, default=str)
+    key = hashlib.sha256(payload.encode()).hexdigest()
+    
+    try:
+        value = backend.get(key)
+    except Exception:
+        logger.exception('Report cache read failed')
+        value = None
+    
+    if value is not None:
+        _count('hits')
+        return value
+    
+    _count('misses')
+    value = compute()
+    try:
+        backend.set(key, value)
+    except Exception:
+        logger.exception('Report cache write failed')
+    return value
+
+def cache_stats():
+    """Hit/miss counters for this process plus the backend's entry count"""
+    backend = get_backend()
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else None
+    stats['backend'] = type(backend).__name__
+    stats['entries'] = backend.size()
+    stats['versions'] = dict(zip(TRACKED_MODELS.values(), backend.versions(list(TRACKED_MODELS.values()))))
+    return stats
+
+def _mark_changed(session, name):
+    session.info.setdefault(_CHANGED_TABLES, set()).add(name)
+
+@event.listens_for(Session, 'before_flush')
+def collect_changed_tables(session, flush_context, instances):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        name = TRACKED_MODELS.get(type(obj))
+        if name:
+            _mark_changed(session, name)
+
+@event.listens_for(Session, 'do_orm_execute')
+def collect_bulk_changes(orm_execute_state):
+    # Set-based INSERT/UPDATE/DELETE statements bypass the flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        name = TRACKED_MODELS.get(mapper.class_) if mapper is not None else None
+        if name:
+            _mark_changed(orm_execute_state.session, name)
+
+@event.listens_for(Session, 'after_commit')
+def bump_data_versions(session):
+    changed = session.info.pop(_CHANGED_TABLES, None)
+    if changed and has_app_context():
+        try:
+            get_backend().bump(sorted(changed))
+        except Exception:
+            logger.exception('Report cache invalidation failed')
+
+@event.listens_for(Session, 'after_rollback')
+def discard_changed_tables(session):
+    session.info.pop(_CHANGED_TABLES, None)
@@ -0,0 +1,146 @@
+import csv
+import hashlib
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import ReportJob
+from background import submit
+
+# Reports with more detail rows than this are computed in the background
+ASYNC_ROW_THRESHOLD = 5000
+
+# How long a finished report is reused and kept for download
+RESULT_TTL = timedelta(hours=1)
+
+# A job still queued or running after this long is assumed lost
+RUNNING_TIMEOUT = timedelta(minutes=30)
+
+# Expired jobs cleaned up per new job, so purging never stalls a request
+PURGE_BATCH_SIZE = 100
+
+# Statuses covered by the unique index on params_key
+IN_FLIGHT_STATUSES = ('Queued', 'Running')
+
+def report_key(report, params, scope):
+    """Stable hash of a report request; identical requests share one job"""
+    payload = json.dumps({'report': report, 'params': params, 'scope': scope}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def report_export_path(job_id):
+    """Location of the CSV export written by a report job"""
+    return os.path.join(current_app.root_path, 'uploads', 'report_jobs', f'{job_id}.csv')
+
+def find_or_start_job(report, params, scope, compute, created_by):
+    """
+    Return a queued, running or still fresh job for identical parameters,
+    or queue a new one. compute(report, params, scope) must return
+    (summary, export_columns, export_rows). A unique index on in-flight
+    jobs settles concurrent identical requests: the losing insert returns
+    the winner's job.
+    """
+    now = datetime.utcnow()
+    key = report_key(report, params, scope)
+    
+    job = ReportJob.query.filter(
+        ReportJob.params_key == key,
+        ReportJob.status.in_(['Queued', 'Running', 'Ready']),
+        ReportJob.expires_at > now
+    ).order_by(ReportJob.created_at.desc()).first()
+    if job:
+        return job
+    
+    purge_expired_jobs()
+    
+    # A lost job still holds the key in the unique index; release it
+    ReportJob.query.filter(
+        ReportJob.params_key == key,
+        ReportJob.status.in_(IN_FLIGHT_STATUSES),
+        ReportJob.expires_at <= now
+    ).update({
+        ReportJob.status: 'Failed',
+        ReportJob.error: 'The job did not finish in time.',
+        ReportJob.finished_at: now
+    }, synchronize_session=False)
+    
+    job = ReportJob(
+        id=uuid.uuid4().hex,
+        report=report,
+        params_key=key,
+        params=json.dumps(params, default=str),
+        scope=json.dumps(scope),
+        status='Queued',
+        expires_at=now + RUNNING_TIMEOUT,
+        created_by=created_by
+    )
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # An identical request queued its job first
+        db.session.rollback()
+        return ReportJob.query.filter(
+            ReportJob.params_key == key,
+            ReportJob.status.in_(['Queued', 'Running', 'Ready'])
+        ).order_by(ReportJob.created_at.desc()).first()
+    
+    submit(run_report_job, job.id, compute)
+    return job
+
+def run_report_job(job_id, compute):
+    """Compute a report's summary and write its export file (runs in the background)"""
+    job = db.session.get(ReportJob, job_id)
+    job.status = 'Running'
+    db.session.commit()
+    
+    try:
+        summary, columns, rows = compute(job.report, json.loads(job.params), json.loads(job.scope))
+        
+        export_path = report_export_path(job_id)
+        os.makedirs(os.path.dirname(export_path), exist_ok=True)
+        partial_path = f'{export_path}.part'
+        row_count = 0
+        with open(partial_path, 'w', newline='', encoding='utf-8') as export_file:
+            writer = csv.writer(export_file)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow(row)
+                row_count += 1
+        
+        # Only expose the file once it is complete
+        os.replace(partial_path, export_path)
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(ReportJob, job_id)
+        job.status = 'Failed'
+        job.error = str(e)[:500]
+        job.finished_at = job.expires_at = datetime.utcnow()
+        db.session.commit()
+        raise
+    
+    finished_at = datetime.utcnow()
+    job.status = 'Ready'
+    job.result = json.dumps(summary)
+    job.row_count = row_count
+    job.finished_at = finished_at
+    job.expires_at = finished_at + RESULT_TTL
+    db.session.commit()
+
+def purge_expired_jobs():
+    """Delete a batch of expired jobs and their export files"""
+    expired = ReportJob.query.filter(
+        or_(ReportJob.expires_at <= datetime.utcnow(), ReportJob.expires_at.is_(None))
+    ).limit(PURGE_BATCH_SIZE).all()
+    
+    for job in expired:
+        for path in [report_export_path(job.id), f'{report_export_path(job.id)}.part']:
+            if os.path.exists(path):
+                os.remove(path)
+        db.session.delete(job)
+    
+    if expired:
+        db.session.commit()
@@ -0,0 +1,429 @@
+import click
+from collections import defaultdict
+from decimal import Decimal
+from flask.cli import with_appcontext
+from sqlalchemy import event, func, select, delete, insert, update, case
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+from app import db
+from models import Invoice, InvoiceDailyRollup, ClientSummary, Payment
+from archive import invoice_source, payment_source
+
+# Invoice columns that decide which rollup row an invoice counts towards
+ROLLUP_FIELDS = ('client_id', 'issue_date', 'status', 'subtotal', 'vat_amount', 'total_amount')
+
+_PENDING_DELTAS = 'invoice_rollup_deltas'
+_PENDING_PAYMENTS = 'invoice_payment_deltas'
+_APPLIED_DELTAS = 'invoice_rollup_applied'
+
+# Callbacks run with each set of deltas and payment deltas once its transaction commits
+commit_listeners = []
+
+def _new_deltas():
+    # (client_id, day, status) -> [invoice_count, subtotal, vat_amount, total_amount]
+    return defaultdict(lambda: [0, Decimal('0'), Decimal('0'), Decimal('0')])
+
+def _new_payment_deltas():
+    # client_id -> change in the payments received against invoices not yet Paid
+    return defaultdict(Decimal)
+
+def _is_open(status):
+    return (status or 'Unpaid') != 'Paid'
+
+def _amount(value):
+    if value is None:
+        return Decimal('0')
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+def _add_contribution(deltas, values, sign):
+    client_id, day, status, subtotal, vat_amount, total_amount = values
+    if client_id is None or day is None:
+        return
+    delta = deltas[(client_id, day, status or 'Unpaid')]
+    delta[0] += sign
+    delta[1] += sign * _amount(subtotal)
+    delta[2] += sign * _amount(vat_amount)
+    delta[3] += sign * _amount(total_amount)
+
+def _current_values(invoice):
+    return tuple(getattr(invoice, field) for field in ROLLUP_FIELDS)
+
+def _committed_value(obj, field):
+    history = get_history(obj, field)
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return getattr(obj, field)
+
+def _committed_values(invoice):
+    return tuple(_committed_value(invoice, field) for field in ROLLUP_FIELDS)
+
+def apply_deltas(session, deltas, payments=None):
+    """
+    Add per-key deltas into the rollup table with one upsert statement.
+    payments holds per-client changes in the payments against open
+    invoices, which come off the client's outstanding balance.
+    """
+    payments = payments or {}
+    rows = [
+        {
+            'client_id': client_id,
+            'day': day,
+            'status': status,
+            'invoice_count': count,
+            'subtotal': subtotal,
+            'vat_amount': vat_amount,
+            'total_amount': total_amount
+        }
+        for (client_id, day, status), (count, subtotal, vat_amount, total_amount) in deltas.items()
+        if count or subtotal or vat_amount or total_amount
+    ]
+    if not rows and not any(payments.values()):
+        return
+    
+    connection = session.connection()
+    
+    if rows:
+        table = InvoiceDailyRollup.__table__
+        stmt = _upsert(connection)(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.client_id, table.c.day, table.c.status],
+            set_={
+                'invoice_count': table.c.invoice_count + stmt.excluded.invoice_count,
+                'subtotal': table.c.subtotal + stmt.excluded.subtotal,
+                'vat_amount': table.c.vat_amount + stmt.excluded.vat_amount,
+                'total_amount': table.c.total_amount + stmt.excluded.total_amount
+            }
+        )
+        connection.execute(stmt, rows)
+        
+        # Drop rows whose last invoice moved away so deleted clients leave nothing behind
+        connection.execute(
+            delete(table).where(
+                table.c.invoice_count == 0,
+                table.c.client_id.in_({row['client_id'] for row in rows})
+            )
+        )
+    
+    _apply_summary_deltas(connection, deltas, payments)
+    
+    session.info.setdefault(_APPLIED_DELTAS, []).append((deltas, payments))
+
+def _upsert(connection):
+    if connection.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as upsert
+    else:
+        from sqlalchemy.dialects.postgresql import insert as upsert
+    return upsert
+
+def _apply_summary_deltas(connection, deltas, payments):
+    """Fold rollup and payment deltas into the per-client counters"""
+    # client_id -> [invoice_count, outstanding_balance, latest added day]
+    by_client = defaultdict(lambda: [0, Decimal('0'), None])
+    # Clients that lost an invoice, whose last invoice date may move back
+    shrunk = set()
+    
+    for (client_id, day, status), (count, subtotal, vat_amount, total_amount) in deltas.items():
+        summary = by_client[client_id]
+        summary[0] += count
+        if status != 'Paid':
+            summary[1] += total_amount
+        if count > 0 and (summary[2] is None or day > summary[2]):
+            summary[2] = day
+        elif count < 0:
+            shrunk.add(client_id)
+    for client_id, amount in payments.items():
+        by_client[client_id][1] -= amount
+    
+    rows = [
+        {
+            'client_id': client_id,
+            'invoice_count': count,
+            'outstanding_balance': outstanding,
+            'last_invoice_date': last_day
+        }
+        for client_id, (count, outstanding, last_day) in by_client.items()
+        if count or outstanding or last_day
+    ]
+    if not rows:
+        return
+    
+    table = ClientSummary.__table__
+    stmt = _upsert(connection)(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.client_id],
+        set_={
+            'invoice_count': table.c.invoice_count + stmt.excluded.invoice_count,
+            'outstanding_balance': table.c.outstanding_balance + stmt.excluded.outstanding_balance,
+            'last_invoice_date': case(
+                (table.c.last_invoice_date.is_(None), stmt.excluded.last_invoice_date),
+                (stmt.excluded.last_invoice_date > table.c.last_invoice_date, stmt.excluded.last_invoice_date),
+                else_=table.c.last_invoice_date
+            )
+        }
+    )
+    connection.execute(stmt, rows)
+    
+    if shrunk:
+        rollups = InvoiceDailyRollup.__table__
+        connection.execute(
+            update(table).where(table.c.client_id.in_(shrunk)).values(
+                last_invoice_date=select(func.max(rollups.c.day)).where(
+                    rollups.c.client_id == table.c.client_id
+                ).scalar_subquery()
+            )
+        )
+    
+    connection.execute(
+        delete(table).where(
+            table.c.invoice_count == 0,
+            table.c.client_id.in_({row['client_id'] for row in rows})
+        )
+    )
+
+def _load_old_value(target, value, oldvalue, initiator):
+    # Registered for active_history so an expired old value is loaded first
+    pass
+
+# The flush hook must know which rollup row an edited invoice is leaving
+for _field in ROLLUP_FIELDS:
+    event.listen(getattr(Invoice, _field), 'set', _load_old_value, active_history=True)
+
+def _stored_payments(invoice_id):
+    return _amount(db.session.query(func.sum(Payment.amount)).filter(Payment.invoice_id == invoice_id).scalar())
+
+def _collect_payment_deltas(session, payments):
+    """
+    Record how the payments against open invoices change in this flush:
+    payments added to or removed from an open invoice, and every stored
+    payment of an invoice that is settled, reopened, moved or deleted.
+    """
+    # Invoice -> payments added less payments removed in this flush
+    changed = {}
+    for obj in session.new:
+        if isinstance(obj, Payment):
+            # Pending payments do not lazy-load their invoice
+            invoice = obj.invoice or session.get(Invoice, obj.invoice_id)
+            if invoice is not None:
+                changed[invoice] = changed.get(invoice, Decimal('0')) + _amount(obj.amount)
+    for obj in session.deleted:
+        if isinstance(obj, Payment):
+            invoice = session.get(Invoice, _committed_value(obj, 'invoice_id'))
+            if invoice is not None:
+                changed[invoice] = changed.get(invoice, Decimal('0')) - _amount(_committed_value(obj, 'amount'))
+    for obj in session.new | session.deleted | session.dirty:
+        if isinstance(obj, Invoice):
+            changed.setdefault(obj, Decimal('0'))
+    
+    for invoice, added in changed.items():
+        old = None if invoice in session.new else (_committed_value(invoice, 'client_id'),
+                                                   _is_open(_committed_value(invoice, 'status')))
+        new = None if invoice in session.deleted else (invoice.client_id, _is_open(invoice.status))
+        if old == new:
+            if new[1]:
+                payments[new[0]] += added
+            continue
+        
+        stored = _stored_payments(invoice.id) if old is not None else Decimal('0')
+        if old is not None and old[1]:
+            payments[old[0]] -= stored
+        if new is not None and new[1]:
+            payments[new[0]] += stored + added
+
+@event.listens_for(Session, 'before_flush')
+def collect_invoice_deltas(session, flush_context, instances):
+    """Record how each invoice written in this flush moves the rollups"""
+    deltas = session.info.setdefault(_PENDING_DELTAS, _new_deltas())
+    payments = session.info.setdefault(_PENDING_PAYMENTS, _new_payment_deltas())
+    
+    with session.no_autoflush:
+        for obj in session.new:
+            if isinstance(obj, Invoice):
+                _add_contribution(deltas, _current_values(obj), 1)
+        
+        for obj in session.deleted:
+            if isinstance(obj, Invoice):
+                _add_contribution(deltas, _committed_values(obj), -1)
+        
+        for obj in session.dirty:
+            if isinstance(obj, Invoice) and session.is_modified(obj):
+                old_values = _committed_values(obj)
+                new_values = _current_values(obj)
+                if old_values != new_values:
+                    _add_contribution(deltas, old_values, -1)
+                    _add_contribution(deltas, new_values, 1)
+        
+        _collect_payment_deltas(session, payments)
+
+@event.listens_for(Session, 'after_flush')
+def write_invoice_deltas(session, flush_context):
+    """Apply the recorded deltas in the same transaction as the invoice writes"""
+    deltas = session.info.pop(_PENDING_DELTAS, None)
+    payments = session.info.pop(_PENDING_PAYMENTS, None)
+    if deltas or payments:
+        apply_deltas(session, deltas or {}, payments)
+
+@event.listens_for(Session, 'after_commit')
+def notify_committed_deltas(session):
+    for deltas, payments in session.info.pop(_APPLIED_DELTAS, []):
+        for listener in commit_listeners:
+            listener(deltas, payments)
+
+@event.listens_for(Session, 'after_rollback')
+def discard_invoice_deltas(session):
+    session.info.pop(_PENDING_DELTAS, None)
+    session.info.pop(_PENDING_PAYMENTS, None)
+    session.info.pop(_APPLIED_DELTAS, None)
+
+def move_invoices_to_status(invoice_ids, new_status):
+    """
+    Update the rollups for a set-based status change that bypasses the ORM.
+    Call in the same transaction, before the UPDATE statement runs.
+    """
+    if not invoice_ids:
+        return
+    
+    rows = db.session.query(
+        Invoice.client_id,
+        Invoice.issue_date,
+        Invoice.status,
+        func.count(Invoice.id),
+        func.sum(Invoice.subtotal),
+        func.sum(Invoice.vat_amount),
+        func.sum(Invoice.total_amount)
+    ).filter(
+        Invoice.id.in_(invoice_ids),
+        Invoice.status != new_status
+    ).group_by(Invoice.client_id, Invoice.issue_date, Invoice.status)
+    
+    deltas = _new_deltas()
+    for client_id, day, status, count, subtotal, vat_amount, total_amount in rows:
+        for key, sign in [((client_id, day, status), -1), ((client_id, day, new_status), 1)]:
+            delta = deltas[key]
+            delta[0] += sign * count
+            delta[1] += sign * _amount(subtotal)
+            delta[2] += sign * _amount(vat_amount)
+            delta[3] += sign * _amount(total_amount)
+    
+    # Invoices that are settled or reopened take their stored payments along
+    payments = _new_payment_deltas()
+    status = func.coalesce(Invoice.status, 'Unpaid')
+    if _is_open(new_status):
+        sign, flipped = 1, status == 'Paid'
+    else:
+        sign, flipped = -1, status != 'Paid'
+    for client_id, paid in db.session.query(Invoice.client_id, func.sum(Payment.amount)).join(
+        Payment, Payment.invoice_id == Invoice.id
+    ).filter(Invoice.id.in_(invoice_ids), flipped).group_by(Invoice.client_id):
+        payments[client_id] += sign * _amount(paid)
+    
+    apply_deltas(db.session, deltas, payments)
+
+def record_bulk_payments(payments):
+    """
+    Update the client balances for Payment rows inserted with a bulk
+    statement that bypasses the ORM. Call in the same transaction, before
+    any move_invoices_to_status for the same invoices.
+    """
+    invoice_ids = {payment['invoice_id'] for payment in payments}
+    open_ids = set(db.session.scalars(select(Invoice.id).where(
+        Invoice.id.in_(invoice_ids),
+        func.coalesce(Invoice.status, 'Unpaid') != 'Paid'
+    )))
+    
+    received = _new_payment_deltas()
+    for payment in payments:
+        if payment['invoice_id'] in open_ids:
+            received[payment['client_id']] += _amount(payment['amount'])
+    apply_deltas(db.session, _new_deltas(), received)
+
+def rebuild_rollups():
+    """Recompute every rollup row from the invoices table and its archive"""
+    invoices = invoice_source()
+    db.session.execute(delete(InvoiceDailyRollup))
+    db.session.execute(
+        insert(InvoiceDailyRollup).from_select(
+            ['client_id', 'day', 'status', 'invoice_count', 'subtotal', 'vat_amount', 'total_amount'],
+            select(
+                invoices.client_id,
+                invoices.issue_date,
+                func.coalesce(invoices.status, 'Unpaid'),
+                func.count(invoices.id),
+                func.coalesce(func.sum(invoices.subtotal), 0),
+                func.coalesce(func.sum(invoices.vat_amount), 0),
+                func.coalesce(func.sum(invoices.total_amount), 0)
+            ).group_by(invoices.client_id, invoices.issue_date, func.coalesce(invoices.status, 'Unpaid'))
+        )
+    )
+    db.session.commit()
+    return db.session.query(func.count()).select_from(InvoiceDailyRollup).scalar()
+
+def rebuild_client_summaries():
+    """
+    Recompute the per-client counters from the invoices table and its archive.
+    Returns the number of clients whose stored counters had drifted.
+    """
+    invoices = invoice_source()
+    payments = payment_source()
+    paid = select(
+        payments.invoice_id,
+        func.sum(payments.amount).label('amount')
+    ).group_by(payments.invoice_id).subquery()
+    expected = {
+        row.client_id: (row.invoice_count, _amount(row.outstanding_balance), row.last_invoice_date)
+        for row in db.session.query(
+            invoices.client_id,
+            func.count(invoices.id).label('invoice_count'),
+            func.coalesce(func.sum(case(
+                (func.coalesce(invoices.status, 'Unpaid') != 'Paid',
+                 invoices.total_amount - func.coalesce(paid.c.amount, 0)),
+                else_=0
+            )), 0).label('outstanding_balance'),
+            func.max(invoices.issue_date).label('last_invoice_date')
+        ).outerjoin(paid, paid.c.invoice_id == invoices.id).filter(
+            invoices.client_id.isnot(None),
+            invoices.issue_date.isnot(None)
+        ).group_by(invoices.client_id)
+    }
+    stored = {
+        summary.client_id: (summary.invoice_count, _amount(summary.outstanding_balance), summary.last_invoice_date)
+        for summary in ClientSummary.query
+    }
+    drifted = sum(
+        1 for client_id in set(expected) | set(stored)
+        if expected.get(client_id) != stored.get(client_id)
+    )
+    
+    db.session.execute(delete(ClientSummary))
+    if expected:
+        db.session.execute(insert(ClientSummary), [
+            {
+                'client_id': client_id,
+                'invoice_count': count,
+                'outstanding_balance': outstanding,
+                'last_invoice_date': last_day
+            }
+            for client_id, (count, outstanding, last_day) in expected.items()
+        ])
+    db.session.commit()
+    return drifted
+
+@click.command('rebuild-rollups')
+@with_appcontext
+def rebuild_rollups_command():
+    """Backfill the daily invoice rollup table from existing invoices."""
+    row_count = rebuild_rollups()
+    click.echo(f'Rebuilt {row_count} daily rollup rows.')
+
+@click.command('rebuild-client-summaries')
+@with_appcontext
+def rebuild_client_summaries_command():
+    """Verify the per-client invoice counters and repair any drift."""
+    drifted = rebuild_client_summaries()
+    if drifted:
+        click.echo(f'Repaired counters for {drifted} clients.')
+    else:
+        click.echo('Client counters are consistent.')
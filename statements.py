@@ -0,0 +1,202 @@
+import tempfile
+from datetime import datetime
+from sqlalchemy import select, union_all, literal, cast, func
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+from app import db
+from archive import invoice_source, payment_source
+from money import Money
+from utils import format_currency
+from pdf_engine import PAGE_WIDTH, PAGE_HEIGHT, MARGIN, Column, CanvasTable
+
+# Statement lines shown per page in the browser
+STATEMENT_PAGE_SIZE = 100
+
+# Rows fetched per round trip while rendering a PDF
+STATEMENT_FETCH_SIZE = 1000
+
+def _amount(value):
+    return cast(value, db.Numeric(15, 2))
+
+def statement_entries(client_id, start, end):
+    """Invoices (debits) and payments (credits) of a client dated within start..end"""
+    # Payments may belong to invoices of an earlier, archived year
+    invoice = invoice_source(None, end)
+    payment = payment_source(start, end)
+    
+    invoices = select(
+        invoice.issue_date.label('entry_date'),
+        literal(0).label('kind_order'),
+        invoice.id.label('source_id'),
+        literal('Invoice').label('kind'),
+        invoice.invoice_number.label('reference'),
+        invoice.description.label('description'),
+        _amount(invoice.total_amount).label('debit'),
+        _amount(0).label('credit')
+    ).where(
+        invoice.client_id == client_id,
+        invoice.issue_date >= start,
+        invoice.issue_date <= end
+    )
+    
+    payments = select(
+        payment.payment_date.label('entry_date'),
+        literal(1).label('kind_order'),
+        payment.id.label('source_id'),
+        literal('Payment').label('kind'),
+        payment.reference.label('reference'),
+        invoice.invoice_number.label('description'),
+        _amount(0).label('debit'),
+        _amount(payment.amount).label('credit')
+    ).join(invoice, payment.invoice_id == invoice.id).where(
+        payment.client_id == client_id,
+        payment.payment_date >= start,
+        payment.payment_date <= end
+    )
+    
+    return union_all(invoices, payments).subquery('entries')
+
+def statement_lines_query(client_id, start, end):
+    """
+    Statement lines in date order with the running balance of the period,
+    computed by the database with a window function.
+    """
+    entries = statement_entries(client_id, start, end)
+    ordering = (entries.c.entry_date, entries.c.kind_order, entries.c.source_id)
+    
+    return select(
+        entries.c.entry_date,
+        entries.c.kind,
+        entries.c.reference,
+        entries.c.description,
+        entries.c.debit,
+        entries.c.credit,
+        func.sum(entries.c.debit - entries.c.credit).over(
+            order_by=ordering,
+            rows=(None, 0)
+        ).label('running_total')
+    ).order_by(*ordering)
+
+def statement_totals(client_id, start, end):
+    """Opening balance, period debits and credits and line count in one query"""
+    # The opening balance covers every earlier year, archived ones included
+    invoice = invoice_source(None, end)
+    payment = payment_source(None, end)
+    
+    def invoice_sum(*conditions):
+        return select(func.coalesce(func.sum(invoice.total_amount), 0)).where(
+            invoice.client_id == client_id, *conditions
+        ).scalar_subquery()
+    
+    def payment_sum(*conditions):
+        return select(func.coalesce(func.sum(payment.amount), 0)).where(
+            payment.client_id == client_id, *conditions
+        ).scalar_subquery()
+    
+    in_period = (invoice.issue_date >= start, invoice.issue_date <= end)
+    paid_in_period = (payment.payment_date >= start, payment.payment_date <= end)
+    
+    row = db.session.query(
+        invoice_sum(invoice.issue_date < start).label('invoiced_before'),
+        payment_sum(payment.payment_date < start).label('paid_before'),
+        invoice_sum(*in_period).label('debits'),
+        payment_sum(*paid_in_period).label('credits'),
+        select(func.count(invoice.id)).where(invoice.client_id == client_id, *in_period).scalar_subquery().label('invoice_lines'),
+        select(func.count(payment.id)).where(payment.client_id == client_id, *paid_in_period).scalar_subquery().label('payment_lines')
+    ).one()
+    
+    opening = Money.parse(row.invoiced_before) - Money.parse(row.paid_before)
+    debits = Money.parse(row.debits)
+    credits = Money.parse(row.credits)
+    return {
+        'opening_balance': opening,
+        'debits': debits,
+        'credits': credits,
+        'closing_balance': opening + debits - credits,
+        'line_count': row.invoice_lines + row.payment_lines
+    }
+
+def _statement_line(row, opening):
+    return {
+        'date': row.entry_date,
+        'type': row.kind,
+        'reference': row.reference or '',
+        'description': row.description or '',
+        'debit': Money.parse(row.debit),
+        'credit': Money.parse(row.credit),
+        'balance': opening + Money.parse(row.running_total)
+    }
+
+def statement_page(client_id, start, end, opening, page, per_page=STATEMENT_PAGE_SIZE):
+    """One page of statement lines; balances stay correct across pages"""
+    query = statement_lines_query(client_id, start, end).offset((page - 1) * per_page).limit(per_page)
+    return [_statement_line(row, opening) for row in db.session.execute(query)]
+
+def iter_statement_lines(client_id, start, end, opening):
+    """Every statement line, fetched from the database in batches"""
+    query = statement_lines_query(client_id, start, end).execution_options(yield_per=STATEMENT_FETCH_SIZE)
+    for row in db.session.execute(query):
+        yield _statement_line(row, opening)
+
+STATEMENT_PDF_COLUMNS = [
+    Column('Date', 55),
+    Column('Type', 45),
+    Column('Reference', 90),
+    Column('Description', 115),
+    Column('Debit (SAR)', 75, 'right'),
+    Column('Credit (SAR)', 70, 'right'),
+    Column('Balance (SAR)', 65, 'right')
+]
+
+def render_statement_pdf(client, start, end, totals, lines):
+    """
+    Write a statement PDF row by row to a temporary file and return it,
+    rewound. Lines can be a generator, so no more than one fetch batch is
+    held in memory however long the statement is.
+    """
+    output = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    pdf = canvas.Canvas(output, pagesize=A4)
+    
+    y = PAGE_HEIGHT - MARGIN
+    pdf.setFont('Helvetica-Bold', 16)
+    pdf.drawCentredString(PAGE_WIDTH / 2, y - 10, 'Statement of Account')
+    y -= 36
+    pdf.setFont('Helvetica', 10)
+    pdf.drawString(MARGIN, y, f'Client: {client.name}')
+    if client.vat_number:
+        pdf.drawRightString(PAGE_WIDTH - MARGIN, y, f'VAT Number: {client.vat_number}')
+    y -= 14
+    pdf.drawString(MARGIN, y, f"Period: {start.strftime('%Y-%m-%d')} to {end.strftime('%Y-%m-%d')}")
+    pdf.drawRightString(PAGE_WIDTH - MARGIN, y, f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M')}")
+    y -= 20
+    
+    def continuation(pdf, page_number):
+        pdf.setFont('Helvetica', 8)
+        pdf.drawString(MARGIN, PAGE_HEIGHT - MARGIN, f'Statement of Account - {client.name}')
+        pdf.drawRightString(PAGE_WIDTH - MARGIN, MARGIN / 2, f'Page {page_number}')
+        return PAGE_HEIGHT - MARGIN - 8
+    
+    pdf.setFont('Helvetica', 8)
+    pdf.drawRightString(PAGE_WIDTH - MARGIN, MARGIN / 2, 'Page 1')
+    table = CanvasTable(pdf, STATEMENT_PDF_COLUMNS, y, on_new_page=continuation, font_size=8)
+    
+    table.add_row([start.strftime('%Y-%m-%d'), '', '', 'Opening balance', '', '',
+                   format_currency(totals['opening_balance'])], bold=True)
+    for line in lines:
+        table.add_row([
+            line['date'].strftime('%Y-%m-%d'),
+            line['type'],
+            line['reference'],
+            line['description'],
+            format_currency(line['debit']) if line['debit'] else '',
+            format_currency(line['credit']) if line['credit'] else '',
+            format_currency(line['balance'])
+        ])
+    table.add_row([end.strftime('%Y-%m-%d'), '', '', 'Closing balance',
+                   format_currency(totals['debits']), format_currency(totals['credits']),
+                   format_currency(totals['closing_balance'])], bold=True)
+    table.finish()
+    
+    pdf.save()
+    output.seek(0)
+    return output
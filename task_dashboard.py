@@ -0,0 +1,101 @@
+from datetime import date, timedelta
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
+from app import db
+from models import Task
+from report_cache import cached_report
+
+# Tasks shown per dashboard section before "show more"
+BUCKET_PAGE_SIZE = 10
+
+# Section key -> heading, in display order
+BUCKETS = [
+    ('overdue', 'Overdue'),
+    ('due_today', 'Due Today'),
+    ('due_this_week', 'Due This Week'),
+    ('high_priority', 'High Priority')
+]
+
+PRIORITY_RANK = {'High': 0, 'Medium': 1, 'Low': 2}
+
+def _scope_filter(scope):
+    if 'client_id' in scope:
+        return Task.client_id == scope['client_id']
+    if 'user_id' in scope:
+        return (Task.assigned_to == scope['user_id']) | (Task.created_by == scope['user_id'])
+    return True
+
+def partition_open_tasks(scope, today):
+    """
+    Fetch every open task that belongs on the dashboard in one scan of the
+    open-task index and split the ids into the dashboard sections.
+    A task can appear in more than one section, e.g. overdue and high priority.
+    """
+    week_end = today + timedelta(days=7)
+    
+    rows = db.session.query(Task.id, Task.due_date, Task.priority).filter(
+        Task.status != 'Completed',
+        or_(Task.due_date <= week_end, Task.priority == 'High'),
+        _scope_filter(scope)
+    ).all()
+    
+    overdue = sorted((row for row in rows if row.due_date and row.due_date < today),
+                     key=lambda row: (row.due_date, row.id))
+    due_today = sorted((row for row in rows if row.due_date == today),
+                       key=lambda row: (PRIORITY_RANK.get(row.priority, len(PRIORITY_RANK)), row.id))
+    due_this_week = sorted((row for row in rows if row.due_date and today < row.due_date <= week_end),
+                           key=lambda row: (row.due_date, row.id))
+    high_priority = sorted((row for row in rows if row.priority == 'High'),
+                           key=lambda row: (row.due_date is None, row.due_date or today, row.id))
+    
+    return {
+        'overdue': [row.id for row in overdue],
+        'due_today': [row.id for row in due_today],
+        'due_this_week': [row.id for row in due_this_week],
+        'high_priority': [row.id for row in high_priority]
+    }
+
+def cached_partition(scope, today=None):
+    """The dashboard sections for a scope, reused until tasks change"""
+    today = today or date.today()
+    return cached_report('task_dashboard', {'today': today.isoformat()}, scope, ('tasks',),
+                         lambda: partition_open_tasks(scope, today))
+
+def load_tasks(task_ids):
+    """Load tasks for display in the given order with one query"""
+    if not task_ids:
+        return []
+    tasks = Task.query.options(
+        joinedload(Task.client),
+        joinedload(Task.assigned_user)
+    ).filter(Task.id.in_(task_ids)).all()
+    by_id = {task.id: task for task in tasks}
+    return [by_id[task_id] for task_id in task_ids if task_id in by_id]
+
+def task_dashboard(scope, page_size=BUCKET_PAGE_SIZE):
+    """First page of every dashboard section, loaded with a single query"""
+    partition = cached_partition(scope)
+    
+    shown = {key: partition[key][:page_size] for key, label in BUCKETS}
+    tasks = {task.id: task for task in load_tasks(sorted({task_id for ids in shown.values() for task_id in ids}))}
+    
+    return {
+        key: {
+            'label': label,
+            'tasks': [tasks[task_id] for task_id in shown[key] if task_id in tasks],
+            'total': len(partition[key]),
+            'next_offset': page_size if len(partition[key]) > page_size else None
+        }
+        for key, label in BUCKETS
+    }
+
+def task_dashboard_page(scope, bucket, offset, page_size=BUCKET_PAGE_SIZE):
+    """One further page of a dashboard section for "show more" """
+    task_ids = cached_partition(scope)[bucket]
+    page_ids = task_ids[offset:offset + page_size]
+    next_offset = offset + page_size
+    return {
+        'tasks': load_tasks(page_ids),
+        'total': len(task_ids),
+        'next_offset': next_offset if next_offset < len(task_ids) else None
+    }
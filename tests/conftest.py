@@ -0,0 +1,25 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app is created at import time, so point it at a throwaway database first
+_database = tempfile.NamedTemporaryFile(prefix='accounting-test-', suffix='.db', delete=False)
+os.environ['DATABASE_URL'] = f'sqlite:///{_database.name}'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app
+
+@pytest.fixture
+def app():
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    return flask_app
+
+@pytest.fixture
+def client(app):
+    """A test client logged in as the default admin"""
+    test_client = app.test_client()
+    response = test_client.post('/auth/login', data={'username': 'admin', 'password': 'admin123'})
+    assert response.status_code == 302
+    return test_client
@@ -0,0 +1,50 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+from app import db
+from models import Client, ClientSummary, Invoice, Payment, User
+from money import Money
+from statements import statement_totals
+
+def _add_invoice(customer, admin, number):
+    invoice = Invoice(
+        invoice_number=number,
+        client_id=customer.id,
+        issue_date=date.today() - timedelta(days=10),
+        due_date=date.today(),
+        subtotal=Decimal('100.00'),
+        vat_amount=Decimal('15.00'),
+        total_amount=Decimal('115.00'),
+        status='Unpaid',
+        created_by=admin.id
+    )
+    db.session.add(invoice)
+    return invoice
+
+def test_closing_balance_matches_summary_after_mark_paid(app, client):
+    with app.app_context():
+        admin = User.query.filter_by(username='admin').first()
+        customer = Client(name='Mark Paid Client', created_by=admin.id)
+        db.session.add(customer)
+        db.session.flush()
+        single = _add_invoice(customer, admin, 'STMT-MARK-1')
+        bulk = _add_invoice(customer, admin, 'STMT-MARK-2')
+        _add_invoice(customer, admin, 'STMT-MARK-3')
+        db.session.flush()
+        # A partly paid invoice must be settled for its remaining balance only
+        db.session.add(Payment(invoice_id=single.id, client_id=customer.id, amount=Decimal('15.00'),
+                               payment_date=date.today(), created_by=admin.id))
+        single.status = 'Partially Paid'
+        db.session.commit()
+        client_id, single_id, bulk_id = customer.id, single.id, bulk.id
+    
+    assert client.post(f'/invoices/{single_id}/mark-paid').status_code == 302
+    response = client.post('/invoices/bulk/mark-paid', json={'ids': [bulk_id]})
+    assert response.get_json()['results'] == {str(bulk_id): 'updated'}
+    
+    with app.app_context():
+        totals = statement_totals(client_id, date.today() - timedelta(days=30), date.today())
+        summary = db.session.get(ClientSummary, client_id)
+        assert totals['credits'] == Money.parse('230.00')
+        assert totals['closing_balance'] == Money.parse('115.00')
+        assert totals['closing_balance'] == Money.parse(summary.outstanding_balance)
@@ -0,0 +1,20 @@
+from decimal import Decimal
+
+import pytest
+
+@pytest.mark.parametrize('revenue', ['33.333', '100.005', 100.005, '0.005', '-12.345', 1000])
+def test_batch_vat_matches_single_calculation(client, revenue):
+    single = client.post('/vat-zakat/api/vat/calculate', json={'revenue': revenue}).get_json()
+    batch = client.post('/vat-zakat/api/vat/calculate-batch', json={'revenue': [revenue]}).get_json()
+    
+    assert single['success'] and batch['success']
+    assert batch['errors'] == {}
+    assert Decimal(batch['vat_amount'][0]) == Decimal(str(single['vat_amount']))
+    assert Decimal(batch['total_with_vat'][0]) == Decimal(str(single['total_with_vat']))
+
+def test_batch_vat_reports_values_that_are_not_numbers(client):
+    batch = client.post('/vat-zakat/api/vat/calculate-batch', json={'revenue': ['abc', None, True, '1e999999', '10.00']}).get_json()
+    
+    assert batch['success']
+    assert sorted(batch['errors']) == ['0', '1', '2', '3']
+    assert batch['total_with_vat'] == [None, None, None, None, '11.50']
@@ -0,0 +1,156 @@
+import calendar
+from datetime import date, timedelta
+from decimal import Decimal
+from sqlalchemy import func
+from app import db
+from models import InvoiceDailyRollup
+from money import Money
+
+GRANULARITIES = ('day', 'week', 'month', 'quarter', 'hijri_month')
+
+# Metric name -> (rollup column, only count these statuses, skip these statuses)
+METRICS = {
+    'billed': ('total_amount', None, None),
+    'paid': ('total_amount', ('Paid',), None),
+    'outstanding': ('total_amount', None, ('Paid',)),
+    'vat': ('vat_amount', None, None),
+    'invoices': ('invoice_count', None, None)
+}
+
+# Longest series a single request may ask for
+MAX_BUCKETS = 1500
+
+HIJRI_MONTHS = [
+    'Muharram', 'Safar', "Rabi' al-Awwal", "Rabi' al-Thani", 'Jumada al-Ula', 'Jumada al-Akhirah',
+    'Rajab', "Sha'ban", 'Ramadan', 'Shawwal', "Dhu al-Qi'dah", 'Dhu al-Hijjah'
+]
+
+# Julian day number of 1 Muharram 1 AH in the tabular (civil) Islamic calendar
+_HIJRI_EPOCH = 1948440
+_ORDINAL_TO_JDN = 1721425
+
+def _hijri_to_jdn(year, month, day):
+    return (day + (59 * (month - 1) + 1) // 2 + (year - 1) * 354
+            + (3 + 11 * year) // 30 + _HIJRI_EPOCH - 1)
+
+def gregorian_to_hijri(value):
+    """
+    Convert a date to (year, month, day) in the tabular Islamic calendar.
+    Dates can differ by a day from Umm al-Qura, which is fine for bucketing.
+    """
+    jdn = value.toordinal() + _ORDINAL_TO_JDN
+    year = (30 * (jdn - _HIJRI_EPOCH) + 10646) // 10631
+    month = min(12, -(-(jdn - 29 - _hijri_to_jdn(year, 1, 1)) * 2 // 59) + 1)
+    day = jdn - _hijri_to_jdn(year, month, 1) + 1
+    return year, month, day
+
+def hijri_to_gregorian(year, month, day):
+    """Convert a tabular Islamic calendar date to a Gregorian date"""
+    return date.fromordinal(_hijri_to_jdn(year, month, day) - _ORDINAL_TO_JDN)
+
+def bucket_start(value, granularity):
+    """Truncate a date to the start of its bucket, like date_trunc"""
+    if granularity == 'day':
+        return value
+    if granularity == 'week':
+        return value - timedelta(days=value.weekday())
+    if granularity == 'month':
+        return value.replace(day=1)
+    if granularity == 'quarter':
+        return date(value.year, (value.month - 1) // 3 * 3 + 1, 1)
+    year, month, _ = gregorian_to_hijri(value)
+    return hijri_to_gregorian(year, month, 1)
+
+def next_bucket(start, granularity):
+    """Return the start of the bucket after the one starting at start"""
+    if granularity == 'day':
+        return start + timedelta(days=1)
+    if granularity == 'week':
+        return start + timedelta(days=7)
+    if granularity in ('month', 'quarter'):
+        months = start.month - 1 + (1 if granularity == 'month' else 3)
+        return date(start.year + months // 12, months % 12 + 1, 1)
+    year, month, _ = gregorian_to_hijri(start)
+    return hijri_to_gregorian(year + month // 12, month % 12 + 1, 1)
+
+def bucket_label(start, granularity):
+    """Human readable chart label for a bucket"""
+    if granularity == 'day':
+        return start.strftime('%d %b %Y')
+    if granularity == 'week':
+        year, week, _ = start.isocalendar()
+        return f"W{week:02d} {year}"
+    if granularity == 'month':
+        return f"{calendar.month_abbr[start.month]} {start.year}"
+    if granularity == 'quarter':
+        return f"Q{(start.month - 1) // 3 + 1} {start.year}"
+    year, month, _ = gregorian_to_hijri(start)
+    return f"{HIJRI_MONTHS[month - 1]} {year}"
+
+def bucket_range(start, end, granularity):
+    """List every bucket start between two dates, so empty periods still chart"""
+    buckets = []
+    current = bucket_start(start, granularity)
+    while current <= end:
+        buckets.append(current)
+        if len(buckets) > MAX_BUCKETS:
+            raise ValueError(f"Too many {granularity} buckets; narrow the date range.")
+        current = next_bucket(current, granularity)
+    return buckets
+
+def revenue_timeseries(start, end, granularity='month', metrics=('paid',), client_id=None):
+    """
+    Build gap-filled, columnar series for the selected metrics.
+    Reads the daily rollups with a plain range predicate on the day index
+    and rolls the days up into the requested buckets.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity: {granularity}")
+    unknown = [metric for metric in metrics if metric not in METRICS]
+    if unknown:
+        raise ValueError(f"Unknown metric: {unknown[0]}")
+    if start > end:
+        raise ValueError('Start date must be on or before the end date.')
+    
+    buckets = bucket_range(start, end, granularity)
+    positions = {bucket: position for position, bucket in enumerate(buckets)}
+    totals = {metric: [Decimal('0')] * len(buckets) for metric in metrics}
+    
+    query = db.session.query(
+        InvoiceDailyRollup.day,
+        InvoiceDailyRollup.status,
+        func.sum(InvoiceDailyRollup.invoice_count).label('invoice_count'),
+        func.sum(InvoiceDailyRollup.vat_amount).label('vat_amount'),
+        func.sum(InvoiceDailyRollup.total_amount).label('total_amount')
+    ).filter(
+        InvoiceDailyRollup.day >= start,
+        InvoiceDailyRollup.day <= end
+    )
+    if client_id is not None:
+        query = query.filter(InvoiceDailyRollup.client_id == client_id)
+    
+    # Each bucket start is computed once per distinct day
+    day_positions = {}
+    for row in query.group_by(InvoiceDailyRollup.day, InvoiceDailyRollup.status):
+        position = day_positions.get(row.day)
+        if position is None:
+            position = day_positions[row.day] = positions[bucket_start(row.day, granularity)]
+        for metric in metrics:
+            column, only, skip = METRICS[metric]
+            if (only and row.status not in only) or (skip and row.status in skip):
+                continue
+            totals[metric][position] += getattr(row, column) or 0
+    
+    series = {}
+    for metric, values in totals.items():
+        if metric == 'invoices':
+            series[metric] = [int(value) for value in values]
+        else:
+            series[metric] = [float(Money.parse(value)) for value in values]
+    
+    return {
+        'granularity': granularity,
+        'buckets': [bucket.isoformat() for bucket in buckets],
+        'labels': [bucket_label(bucket, granularity) for bucket in buckets],
+        'series': series
+    }
@@ -1,18 +1,12 @@
 import os
 import uuid
 from datetime import datetime, date
-from decimal import Decimal
+from decimal import ROUND_CEILING
 from werkzeug.utils import secure_filename
-from flask import current_app
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.lib import colors
-from reportlab.pdfgen import canvas
-from reportlab.lib.enums import TA_CENTER, TA_RIGHT
+from flask import current_app, jsonify, flash, redirect
 import csv
-from io import StringIO, BytesIO
+from io import StringIO
+from money import Money, parse_halalas, percent_of, percent_many, halalas_to_decimal
 
 def allowed_file(filename, allowed_extensions):
     """Check if file extension is allowed"""
@@ -38,15 +32,74 @@ def save_uploaded_file(file, upload_folder='uploads'):
         return unique_filename, filename, file_path
     return None, None, None
 
+def get_bulk_ids(req):
+    """
+    Read a list of record ids from a JSON body or form post.
+    Returns (ids, invalid_ids): the integer ids, and the values that are
+    not ids as strings, so they can be reported per id.
+    """
+    if req.is_json:
+        raw_ids = (req.get_json(silent=True) or {}).get('ids') or []
+        if not isinstance(raw_ids, list):
+            raw_ids = [raw_ids]
+    else:
+        raw_ids = req.form.getlist('ids')
+    
+    ids = []
+    invalid_ids = []
+    for raw_id in raw_ids:
+        try:
+            if isinstance(raw_id, (bool, float)):
+                raise ValueError
+            ids.append(int(raw_id))
+        except (TypeError, ValueError):
+            invalid_ids.append(str(raw_id))
+    
+    # Keep request order but drop duplicates
+    return list(dict.fromkeys(ids)), list(dict.fromkeys(invalid_ids))
+
+def get_bulk_param(req, name, default=None):
+    """Read a single bulk operation parameter from a JSON body or form post"""
+    if req.is_json:
+        return (req.get_json(silent=True) or {}).get(name, default)
+    return req.form.get(name, default)
+
+def bulk_response(req, results, redirect_url, label):
+    """Report per-id results of a bulk operation as JSON or a flash summary"""
+    updated = [record_id for record_id, result in results.items() if result == 'updated']
+    skipped = len(results) - len(updated)
+    
+    if req.is_json:
+        return jsonify({
+            'success': True,
+            'updated': len(updated),
+            'skipped': skipped,
+            'results': {str(record_id): result for record_id, result in results.items()}
+        })
+    
+    if updated:
+        flash(f'{len(updated)} {label} updated successfully!', 'success')
+    if skipped:
+        flash(f'{skipped} {label} could not be updated.', 'warning')
+    return redirect(redirect_url)
+
+def bulk_error(req, message, redirect_url, status_code=400):
+    """Reject a bulk operation as JSON or a flash message"""
+    if req.is_json:
+        return jsonify({
+            'success': False,
+            'error': message
+        }), status_code
+    
+    flash(message, 'error')
+    return redirect(redirect_url)
+
 def calculate_vat(subtotal, vat_rate=15.0):
-    """Calculate VAT amount and total"""
-    subtotal = Decimal(str(subtotal))
-    vat_rate = Decimal(str(vat_rate))
-    
-    vat_amount = subtotal * (vat_rate / 100)
-    total_amount = subtotal + vat_amount
+    """Calculate VAT amount and total, rounded to the halala"""
+    subtotal = parse_halalas(subtotal)
+    vat_amount = percent_of(subtotal, vat_rate)
     
-    return vat_amount, total_amount
+    return halalas_to_decimal(vat_amount), halalas_to_decimal(subtotal + vat_amount)
 
 def calculate_zakat(assets, liabilities, nisab_threshold=85 * 595.05):
     """
@@ -54,197 +107,39 @@ def calculate_zakat(assets, liabilities, nisab_threshold=85 * 595.05):
     Default nisab threshold is 85 grams of gold (approximately 50,505 SAR as of 2024)
     Zakat rate is 2.5% of net wealth above nisab
     """
-    assets = Decimal(str(assets))
-    liabilities = Decimal(str(liabilities))
-    nisab = Decimal(str(nisab_threshold))
-    
-    net_wealth = assets - liabilities
+    net_wealth = Money.parse(assets) - Money.parse(liabilities)
+    # Round the nisab up so amounts just below it never qualify
+    nisab = Money(parse_halalas(nisab_threshold, rounding=ROUND_CEILING))
     
     if net_wealth >= nisab:
-        zakat_due = net_wealth * Decimal('0.025')  # 2.5%
+        zakat_due = net_wealth.percent('2.5')
     else:
-        zakat_due = Decimal('0')
+        zakat_due = Money(0)
     
-    return net_wealth, zakat_due, nisab
+    return net_wealth.to_decimal(), zakat_due.to_decimal(), nisab.to_decimal()
 
-def generate_invoice_pdf(invoice):
-    """Generate PDF for invoice"""
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    styles = getSampleStyleSheet()
-    story = []
-    
-    # Title
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        alignment=TA_CENTER,
-        spaceAfter=30
-    )
-    story.append(Paragraph(f"Invoice #{invoice.invoice_number}", title_style))
-    
-    # Invoice details
-    details_data = [
-        ['Invoice Number:', invoice.invoice_number],
-        ['Issue Date:', invoice.issue_date.strftime('%Y-%m-%d')],
-        ['Due Date:', invoice.due_date.strftime('%Y-%m-%d') if invoice.due_date else 'N/A'],
-        ['Client:', invoice.client.name],
-        ['Status:', invoice.status],
-    ]
-    
-    details_table = Table(details_data, colWidths=[2*inch, 3*inch])
-    details_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-    ]))
-    story.append(details_table)
-    story.append(Spacer(1, 20))
-    
-    # Invoice items
-    if invoice.items.count() > 0:
-        items_data = [['Description', 'Quantity', 'Unit Price', 'Total']]
-        for item in invoice.items:
-            items_data.append([
-                str(item.description),
-                str(item.quantity),
-                f"{item.unit_price:.2f} SAR",
-                f"{item.total_price:.2f} SAR"
-            ])
-        
-        items_table = Table(items_data, colWidths=[3*inch, 1*inch, 1.5*inch, 1.5*inch])
-        items_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        story.append(items_table)
-        story.append(Spacer(1, 20))
-    
-    # Totals
-    totals_data = [
-        ['Subtotal:', f"{invoice.subtotal:.2f} SAR"],
-        ['VAT (15%):', f"{invoice.vat_amount:.2f} SAR"],
-        ['Total Amount:', f"{invoice.total_amount:.2f} SAR"],
-    ]
-    
-    totals_table = Table(totals_data, colWidths=[2*inch, 2*inch])
-    totals_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-    ]))
-    story.append(totals_table)
-    
-    doc.build(story)
-    buffer.seek(0)
-    return buffer
-
-def generate_vat_report_pdf(vat_calculation):
-    """Generate PDF for VAT calculation report"""
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    styles = getSampleStyleSheet()
-    story = []
-    
-    # Title
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        alignment=TA_CENTER,
-        spaceAfter=30
-    )
-    story.append(Paragraph("VAT Calculation Report", title_style))
-    
-    # Report details
-    details_data = [
-        ['Period:', f"{vat_calculation.period_start.strftime('%Y-%m-%d')} to {vat_calculation.period_end.strftime('%Y-%m-%d')}"],
-        ['Client:', vat_calculation.client.name if vat_calculation.client else 'N/A'],
-        ['Total Sales:', f"{vat_calculation.total_sales:.2f} SAR"],
-        ['Total Purchases:', f"{vat_calculation.total_purchases:.2f} SAR"],
-        ['Output VAT (15%):', f"{vat_calculation.output_vat:.2f} SAR"],
-        ['Input VAT (15%):', f"{vat_calculation.input_vat:.2f} SAR"],
-        ['Net VAT Due:', f"{vat_calculation.net_vat:.2f} SAR"],
-        ['Status:', vat_calculation.status],
-    ]
-    
-    details_table = Table(details_data, colWidths=[2*inch, 3*inch])
-    details_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-    ]))
-    story.append(details_table)
-    
-    if vat_calculation.notes:
-        story.append(Spacer(1, 20))
-        story.append(Paragraph(f"<b>Notes:</b> {vat_calculation.notes}", styles['Normal']))
-    
-    doc.build(story)
-    buffer.seek(0)
-    return buffer
+def calculate_vat_batch(amounts, vat_rate=15.0):
+    """
+    Calculate VAT over a list of subtotals in integer halalas.
+    Gives the same results as calculate_vat() for each amount.
+    Returns (vat_amounts, total_amounts) as lists of halalas.
+    """
+    vat_amounts = percent_many(amounts, vat_rate)
+    total_amounts = [amount + vat for amount, vat in zip(amounts, vat_amounts)]
+    return vat_amounts, total_amounts
 
-def generate_zakat_report_pdf(zakat_calculation):
-    """Generate PDF for Zakat calculation report"""
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    styles = getSampleStyleSheet()
-    story = []
-    
-    # Title
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        alignment=TA_CENTER,
-        spaceAfter=30
-    )
-    story.append(Paragraph("Zakat Calculation Report", title_style))
-    
-    # Report details
-    details_data = [
-        ['Hijri Year:', zakat_calculation.hijri_year],
-        ['Client:', zakat_calculation.client.name if zakat_calculation.client else 'N/A'],
-        ['Cash and Deposits:', f"{zakat_calculation.cash_and_deposits:.2f} SAR"],
-        ['Trade Goods:', f"{zakat_calculation.trade_goods:.2f} SAR"],
-        ['Receivables:', f"{zakat_calculation.receivables:.2f} SAR"],
-        ['Investments:', f"{zakat_calculation.investments:.2f} SAR"],
-        ['Total Assets:', f"{zakat_calculation.total_assets:.2f} SAR"],
-        ['Liabilities:', f"{zakat_calculation.liabilities:.2f} SAR"],
-        ['Net Wealth:', f"{zakat_calculation.net_wealth:.2f} SAR"],
-        ['Nisab Threshold:', f"{zakat_calculation.nisab_threshold:.2f} SAR"],
-        ['Zakat Due (2.5%):', f"{zakat_calculation.zakat_due:.2f} SAR"],
-        ['Status:', zakat_calculation.status],
-    ]
-    
-    details_table = Table(details_data, colWidths=[2*inch, 3*inch])
-    details_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-    ]))
-    story.append(details_table)
-    
-    if zakat_calculation.notes:
-        story.append(Spacer(1, 20))
-        story.append(Paragraph(f"<b>Notes:</b> {zakat_calculation.notes}", styles['Normal']))
-    
-    doc.build(story)
-    buffer.seek(0)
-    return buffer
+def calculate_zakat_batch(assets, liabilities, nisab_threshold=85 * 595.05):
+    """
+    Calculate Zakat over parallel lists of assets and liabilities in halalas.
+    Gives the same results as calculate_zakat() for each pair.
+    Returns (net_wealth, zakat_due, nisab) with lists of halalas.
+    """
+    nisab = parse_halalas(nisab_threshold, rounding=ROUND_CEILING)
+    net_wealth = [asset - liability for asset, liability in zip(assets, liabilities)]
+    eligible = [net for net in net_wealth if net >= nisab]
+    zakat_iter = iter(percent_many(eligible, '2.5'))
+    zakat_due = [next(zakat_iter) if net >= nisab else 0 for net in net_wealth]
+    return net_wealth, zakat_due, nisab
 
 def export_to_csv(data, columns):
     """Export data to CSV format"""
@@ -261,11 +156,50 @@ def export_to_csv(data, columns):
     output.seek(0)
     return output.getvalue()
 
+# Date formats accepted in imported CSV files
+CSV_DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%m/%d/%Y')
+
+def parse_csv_date(value):
+    """Parse a date from an imported CSV cell, or return None"""
+    for fmt in CSV_DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), fmt).date()
+        except ValueError:
+            continue
+    return None
+
+def pick_csv_value(row, headers):
+    """Return the first non-empty value among the accepted (lower-cased) headers"""
+    for header in headers:
+        value = row.get(header)
+        if value:
+            return value.strip()
+    return ''
+
+class _RowBuffer:
+    """Minimal file object that hands back whatever csv.writer wrote"""
+    
+    def __init__(self):
+        self.value = ''
+    
+    def write(self, value):
+        self.value = value
+
+def stream_csv(rows, columns):
+    """Yield CSV text one row at a time so large exports are never held in memory"""
+    buffer = _RowBuffer()
+    writer = csv.writer(buffer)
+    
+    writer.writerow(columns)
+    yield buffer.value
+    
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.value
+
 def format_currency(amount, currency='SAR'):
     """Format currency amount"""
-    if amount is None:
-        return f"0.00 {currency}"
-    return f"{amount:.2f} {currency}"
+    return Money.parse(amount, currency).format()
 
 def get_current_hijri_year():
     """Get current Hijri year (approximate)"""
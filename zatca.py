@@ -0,0 +1,224 @@
+"""
+ZATCA e-invoice serialization: UBL 2.1 invoice XML, TLV-encoded QR
+payloads and the invoice hash chain.
+
+Nothing here touches the database or the Flask app, so serialize_invoice
+can run in worker processes. Building and serializing the XML is the
+expensive part and runs independently per invoice; link_invoice then
+chains the results in order, which only costs one SHA-256 per invoice.
+
+The XML is not cryptographically stamped: the signature and QR tags 7-9
+need the device certificate (CSID) issued by ZATCA during onboarding.
+"""
+import base64
+import hashlib
+import xml.etree.ElementTree as ET
+from money import parse_halalas, format_halalas, percent_of
+
+UBL_NS = 'urn:oasis:names:specification:ubl:schema:xsd:Invoice-2'
+CAC_NS = 'urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2'
+CBC_NS = 'urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2'
+
+ET.register_namespace('', UBL_NS)
+ET.register_namespace('cac', CAC_NS)
+ET.register_namespace('cbc', CBC_NS)
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>\n'
+
+# Previous invoice hash of the first invoice in a chain, as defined by ZATCA
+INITIAL_PREVIOUS_HASH = 'NWZlY2ViNjZmZmM4NmYzOGQ5NTI3ODZjNmQ2OTZjNzljMmRiYzIzOWRkNGU5MWI0NjcyOWQ3M2EyN2ZiNTdlOQ=='
+
+# Invoice type transaction codes: standard (B2B) and simplified (B2C)
+STANDARD_INVOICE = '0100000'
+SIMPLIFIED_INVOICE = '0200000'
+
+CURRENCY = 'SAR'
+
+# Filled in by link_invoice once the previous invoice's hash is known
+PIH_PLACEHOLDER = '@@PIH@@'
+QR_PLACEHOLDER = '@@QR@@'
+
+# The QR reference in canonical form; it is left out of the invoice hash
+QR_REFERENCE = (
+    '<cac:AdditionalDocumentReference><cbc:ID>QR</cbc:ID><cac:Attachment>'
+    '<cbc:EmbeddedDocumentBinaryObject mimeCode="text/plain">{}</cbc:EmbeddedDocumentBinaryObject>'
+    '</cac:Attachment></cac:AdditionalDocumentReference>'
+)
+
+def _cac(parent, tag):
+    return ET.SubElement(parent, f'{{{CAC_NS}}}{tag}')
+
+def _cbc(parent, tag, text=None, **attributes):
+    element = ET.SubElement(parent, f'{{{CBC_NS}}}{tag}', attributes)
+    if text is not None:
+        # Line ends as an XML parser normalizes them, so the text is canonical
+        element.text = str(text).replace('\r\n', '\n').replace('\r', '\n')
+    return element
+
+def _amount(parent, tag, halalas):
+    return _cbc(parent, tag, format_halalas(halalas), currencyID=CURRENCY)
+
+def _document_reference(parent, reference_id, text=None, uuid=None):
+    reference = _cac(parent, 'AdditionalDocumentReference')
+    _cbc(reference, 'ID', reference_id)
+    if uuid is not None:
+        _cbc(reference, 'UUID', uuid)
+    if text is not None:
+        attachment = _cac(reference, 'Attachment')
+        _cbc(attachment, 'EmbeddedDocumentBinaryObject', text, mimeCode='text/plain')
+
+def _tax_category(parent, tag, rate):
+    category = _cac(parent, tag)
+    _cbc(category, 'ID', 'S')
+    _cbc(category, 'Percent', rate)
+    _cbc(_cac(category, 'TaxScheme'), 'ID', 'VAT')
+
+def _party(parent, tag, party):
+    element = _cac(_cac(parent, tag), 'Party')
+    if party.get('cr_number'):
+        _cbc(_cac(element, 'PartyIdentification'), 'ID', party['cr_number'], schemeID='CRN')
+    address = _cac(element, 'PostalAddress')
+    if party.get('address'):
+        _cbc(address, 'StreetName', party['address'])
+    _cbc(_cac(address, 'Country'), 'IdentificationCode', 'SA')
+    if party.get('vat_number'):
+        tax_scheme = _cac(element, 'PartyTaxScheme')
+        _cbc(tax_scheme, 'CompanyID', party['vat_number'])
+        _cbc(_cac(tax_scheme, 'TaxScheme'), 'ID', 'VAT')
+    _cbc(_cac(element, 'PartyLegalEntity'), 'RegistrationName', party['name'])
+
+def _lines(invoice):
+    # UBL needs at least one line; an invoice without items is billed as one
+    if invoice['items']:
+        return invoice['items']
+    return [{
+        'description': invoice['description'] or invoice['invoice_number'],
+        'quantity': '1',
+        'unit_price': invoice['subtotal'],
+        'total_price': invoice['subtotal']
+    }]
+
+def build_invoice_xml(invoice):
+    """UBL invoice element tree with placeholders for the chained fields"""
+    rate = format_halalas(parse_halalas(invoice['vat_rate']))
+    subtotal = parse_halalas(invoice['subtotal'])
+    vat_amount = parse_halalas(invoice['vat_amount'])
+    total_amount = parse_halalas(invoice['total_amount'])
+    
+    root = ET.Element(f'{{{UBL_NS}}}Invoice')
+    _cbc(root, 'ProfileID', 'reporting:1.0')
+    _cbc(root, 'ID', invoice['invoice_number'])
+    _cbc(root, 'UUID', invoice['uuid'])
+    _cbc(root, 'IssueDate', invoice['issue_date'])
+    _cbc(root, 'IssueTime', invoice['issue_time'])
+    type_code = STANDARD_INVOICE if invoice['buyer'].get('vat_number') else SIMPLIFIED_INVOICE
+    _cbc(root, 'InvoiceTypeCode', '388', name=type_code)
+    _cbc(root, 'DocumentCurrencyCode', CURRENCY)
+    _cbc(root, 'TaxCurrencyCode', CURRENCY)
+    
+    _document_reference(root, 'ICV', uuid=invoice['counter'])
+    _document_reference(root, 'PIH', PIH_PLACEHOLDER)
+    _document_reference(root, 'QR', QR_PLACEHOLDER)
+    
+    _party(root, 'AccountingSupplierParty', invoice['seller'])
+    _party(root, 'AccountingCustomerParty', invoice['buyer'])
+    _cbc(_cac(root, 'Delivery'), 'ActualDeliveryDate', invoice['issue_date'])
+    
+    _amount(_cac(root, 'TaxTotal'), 'TaxAmount', vat_amount)
+    tax_total = _cac(root, 'TaxTotal')
+    _amount(tax_total, 'TaxAmount', vat_amount)
+    tax_subtotal = _cac(tax_total, 'TaxSubtotal')
+    _amount(tax_subtotal, 'TaxableAmount', subtotal)
+    _amount(tax_subtotal, 'TaxAmount', vat_amount)
+    _tax_category(tax_subtotal, 'TaxCategory', rate)
+    
+    monetary_total = _cac(root, 'LegalMonetaryTotal')
+    _amount(monetary_total, 'LineExtensionAmount', subtotal)
+    _amount(monetary_total, 'TaxExclusiveAmount', subtotal)
+    _amount(monetary_total, 'TaxInclusiveAmount', total_amount)
+    _amount(monetary_total, 'PayableAmount', total_amount)
+    
+    for number, item in enumerate(_lines(invoice), 1):
+        line_total = parse_halalas(item['total_price'])
+        line_vat = percent_of(line_total, invoice['vat_rate'])
+        line = _cac(root, 'InvoiceLine')
+        _cbc(line, 'ID', number)
+        _cbc(line, 'InvoicedQuantity', item['quantity'], unitCode='PCE')
+        _amount(line, 'LineExtensionAmount', line_total)
+        line_tax = _cac(line, 'TaxTotal')
+        _amount(line_tax, 'TaxAmount', line_vat)
+        _amount(line_tax, 'RoundingAmount', line_total + line_vat)
+        line_item = _cac(line, 'Item')
+        _cbc(line_item, 'Name', item['description'])
+        _tax_category(line_item, 'ClassifiedTaxCategory', rate)
+        _amount(_cac(line, 'Price'), 'PriceAmount', parse_halalas(item['unit_price']))
+    
+    return root
+
+def tlv(tag, value):
+    """One TLV field: tag byte, length byte, UTF-8 value"""
+    value = value.encode('utf-8') if isinstance(value, str) else value
+    if len(value) > 255:
+        raise ValueError(f'QR field {tag} is longer than 255 bytes')
+    return bytes([tag, len(value)]) + value
+
+def qr_payload(seller_name, vat_number, timestamp, total_amount, vat_amount, invoice_hash=None):
+    """Base64 TLV QR payload: seller, VAT number, timestamp, totals and hash"""
+    fields = [seller_name, vat_number, timestamp, total_amount, vat_amount]
+    if invoice_hash is not None:
+        fields.append(invoice_hash)
+    return base64.b64encode(b''.join(tlv(tag, value) for tag, value in enumerate(fields, 1))).decode('ascii')
+
+def decode_qr_payload(payload):
+    """Field values of a TLV QR payload by tag"""
+    data = base64.b64decode(payload)
+    fields = {}
+    position = 0
+    while position < len(data):
+        tag, length = data[position], data[position + 1]
+        fields[tag] = data[position + 2:position + 2 + length].decode('utf-8')
+        position += 2 + length
+    return fields
+
+def canonical_xml(root):
+    """
+    Serialize a tree built by build_invoice_xml in C14N 1.1 form. The tree
+    declares its namespaces on the root and carries at most one attribute
+    per element, so ElementTree output only needs explicit end tags.
+    """
+    return ET.tostring(root, encoding='unicode', short_empty_elements=False)
+
+def serialize_invoice(invoice):
+    """
+    Canonical XML of one invoice, split around the chained fields.
+    invoice is a plain dict so it can be sent to a worker process.
+    """
+    canonical = canonical_xml(build_invoice_xml(invoice))
+    head, rest = canonical.split(PIH_PLACEHOLDER)
+    middle, tail = rest.split(QR_REFERENCE.format(QR_PLACEHOLDER))
+    return {
+        'invoice_id': invoice['invoice_id'],
+        'head': head,
+        'middle': middle,
+        'tail': tail,
+        'qr_fields': [
+            invoice['seller']['name'],
+            invoice['seller'].get('vat_number') or '',
+            f"{invoice['issue_date']}T{invoice['issue_time']}",
+            format_halalas(parse_halalas(invoice['total_amount'])),
+            format_halalas(parse_halalas(invoice['vat_amount']))
+        ]
+    }
+
+def invoice_hash(serialized, previous_hash):
+    """Base64 SHA-256 of the canonical XML without the QR reference"""
+    document = serialized['head'] + previous_hash + serialized['middle'] + serialized['tail']
+    return base64.b64encode(hashlib.sha256(document.encode('utf-8')).digest()).decode('ascii')
+
+def link_invoice(serialized, previous_hash):
+    """Chain a serialized invoice to its predecessor: (hash, QR payload, XML)"""
+    digest = invoice_hash(serialized, previous_hash)
+    qr = qr_payload(*serialized['qr_fields'], invoice_hash=digest)
+    xml = (XML_DECLARATION + serialized['head'] + previous_hash + serialized['middle']
+           + QR_REFERENCE.format(qr) + serialized['tail'])
+    return digest, qr, xml